@@ -5,12 +5,21 @@ CREATE TABLE listen (
         track_name      TEXT                     NOT NULL,
         user_name       TEXT                     NOT NULL,
         created         TIMESTAMP WITH TIME ZONE DEFAULT NOW() NOT NULL,
-        data            JSONB                    NOT NULL
+        data            JSONB                    NOT NULL,
+        recording_msid  UUID
 );
 
 -- 86400 seconds * 5 = 432000 seconds = 5 days
 SELECT create_hypertable('listen', 'listened_at', chunk_time_interval => 432000);
 
+-- Number of listens of each user in each 5 day span aligned with the listen hypertable chunks,
+-- maintained on insert. Used to find the time range that contains a page of listens.
+CREATE TABLE listen_user_chunk_count (
+        user_name       TEXT                     NOT NULL,
+        chunk_start     BIGINT                   NOT NULL,
+        count           INTEGER                  NOT NULL
+);
+
 -- Playlists
 
 CREATE TABLE playlist.playlist (
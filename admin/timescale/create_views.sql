@@ -3,3 +3,8 @@ CREATE MATERIALIZED VIEW listen_count_30day WITH (timescaledb.continuous) AS SEL
 
 -- Add a policy to keep the listen_count_30day up to date for the last year, but the last bucket
 SELECT add_continuous_aggregate_policy('listen_count_30day', start_offset => 31536000, end_offset => 432000, schedule_interval => INTERVAL '1 hour');
+
+-- Per user first and last listen timestamp for every 30 day bucket, used to look up the min and max timestamps of a user
+CREATE MATERIALIZED VIEW listen_timestamps_30day WITH (timescaledb.continuous) AS SELECT time_bucket(bigint '2592000', listened_at) AS listened_at_bucket, user_name, min(listened_at) AS min_listened_at, max(listened_at) AS max_listened_at FROM listen GROUP BY listened_at_bucket, user_name;
+
+SELECT add_continuous_aggregate_policy('listen_timestamps_30day', start_offset => 31536000, end_offset => 432000, schedule_interval => INTERVAL '1 hour');
@@ -1,5 +1,6 @@
 BEGIN;
 
 DROP TABLE IF EXISTS listen CASCADE;
+DROP TABLE IF EXISTS listen_user_chunk_count CASCADE;
 
 COMMIT;
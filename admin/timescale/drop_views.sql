@@ -1,5 +1,6 @@
 BEGIN;
 
 DROP VIEW listen_count_30day CASCADE;
+DROP VIEW listen_timestamps_30day CASCADE;
 
 COMMIT;
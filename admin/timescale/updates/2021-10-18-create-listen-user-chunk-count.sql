@@ -0,0 +1,17 @@
+BEGIN;
+
+CREATE TABLE listen_user_chunk_count (
+        user_name       TEXT                     NOT NULL,
+        chunk_start     BIGINT                   NOT NULL,
+        count           INTEGER                  NOT NULL
+);
+
+ALTER TABLE listen_user_chunk_count ADD CONSTRAINT listen_user_chunk_count_pkey PRIMARY KEY (user_name, chunk_start);
+
+-- 432000 seconds = 5 days, the chunk interval of the listen hypertable
+INSERT INTO listen_user_chunk_count (user_name, chunk_start, count)
+     SELECT user_name, listened_at - listened_at % 432000 AS chunk_start, count(*)
+       FROM listen
+   GROUP BY user_name, chunk_start;
+
+COMMIT;
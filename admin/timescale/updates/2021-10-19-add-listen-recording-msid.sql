@@ -0,0 +1,10 @@
+-- Existing listens are backfilled afterwards with: python manage.py backfill_listen_recording_msid
+BEGIN;
+
+ALTER TABLE listen ADD COLUMN recording_msid UUID;
+
+COMMIT;
+
+-- transaction_per_chunk builds the index one chunk at a time instead of locking the whole hypertable,
+-- so it has to run outside of a transaction block.
+CREATE INDEX recording_msid_ndx_listen ON listen (recording_msid) WITH (timescaledb.transaction_per_chunk);
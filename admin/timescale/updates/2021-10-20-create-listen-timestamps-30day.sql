@@ -0,0 +1,18 @@
+-- Continuous aggregates cannot be created inside a transaction, run this without one.
+
+CREATE MATERIALIZED VIEW listen_timestamps_30day WITH (timescaledb.continuous) AS SELECT time_bucket(bigint '2592000', listened_at) AS listened_at_bucket, user_name, min(listened_at) AS min_listened_at, max(listened_at) AS max_listened_at FROM listen GROUP BY listened_at_bucket, user_name;
+
+SELECT add_continuous_aggregate_policy('listen_timestamps_30day', start_offset => 31536000, end_offset => 432000, schedule_interval => INTERVAL '1 hour');
+
+-- The index goes on the materialization hypertable, whose name is only known once the view exists
+DO $$
+DECLARE
+    hypertable_schema TEXT;
+    hypertable_name TEXT;
+BEGIN
+    SELECT materialization_hypertable_schema, materialization_hypertable_name
+      INTO hypertable_schema, hypertable_name
+      FROM timescaledb_information.continuous_aggregates
+     WHERE view_name = 'listen_timestamps_30day';
+    EXECUTE format('CREATE INDEX user_name_ndx_listen_timestamps_30day ON %I.%I (user_name)', hypertable_schema, hypertable_name);
+END $$;
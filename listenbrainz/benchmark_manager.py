@@ -0,0 +1,208 @@
+""" This module contains a click group with commands to benchmark
+performance critical code paths against a development setup.
+"""
+
+# listenbrainz-server - Server for the ListenBrainz project
+#
+# Copyright (C) 2021 MetaBrainz Foundation Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import gc
+import logging
+import time
+import tracemalloc
+import uuid
+from datetime import datetime
+
+import click
+import ujson
+from brainzutils import cache
+
+from listenbrainz import config
+from listenbrainz.listen import Listen, LazyListen
+from listenbrainz.listenstore import TimescaleListenStore
+from listenbrainz.listenstore.timescale_listenstore import REDIS_USER_LISTEN_COUNT, REDIS_USER_TIMESTAMPS, \
+    REDIS_USER_DATA_STALE, REDIS_USER_LISTENS_PAGE
+from listenbrainz.webserver.views.api_tools import validate_listen, validate_listens, LISTEN_TYPE_IMPORT
+
+cli = click.Group()
+
+DEFAULT_INSERT_BATCH_SIZES = (1000, 10000, 100000)
+DEFAULT_LISTEN_OBJECT_COUNT = 1000000
+DEFAULT_VALIDATE_PAYLOAD_SIZE = 1000
+DEFAULT_VALIDATE_ROUNDS = 100
+
+
+def generate_listens(user_name, count, start_ts=1500000000):
+    """ Generate count distinct listens for user_name, one second apart. """
+    artist_msid = str(uuid.uuid4())
+    listens = []
+    for i in range(count):
+        listens.append(Listen(
+            user_name=user_name,
+            user_id=0,
+            timestamp=start_ts + i,
+            artist_msid=artist_msid,
+            recording_msid=str(uuid.uuid4()),
+            data={
+                'artist_name': 'Frank Ocean',
+                'track_name': 'Track %d' % i,
+                'additional_info': {'tags': ['benchmark']},
+            },
+        ))
+    return listens
+
+
+def delete_benchmark_user(ls, user_name):
+    """ Delete the listens of a throwaway benchmark user along with the data cached about it in redis """
+    ls.delete(user_name)
+    keys = [REDIS_USER_LISTEN_COUNT + user_name, REDIS_USER_TIMESTAMPS + user_name]
+    keys += [REDIS_USER_DATA_STALE + key for key in keys] + [REDIS_USER_LISTENS_PAGE + user_name]
+    cache._r.delete(*[cache._prep_key(key) for key in keys])
+
+
+@cli.command(name="listen_insert")
+@click.option("--size", "-s", "sizes", type=int, multiple=True, default=DEFAULT_INSERT_BATCH_SIZES,
+              show_default=True, help="Number of listens per batch, can be given multiple times.")
+def listen_insert(sizes):
+    """ Compare the execute_values and COPY insert paths of the timescale listenstore.
+
+        Listens are written for a throwaway user, which is deleted again afterwards.
+        Do not run this against a production database.
+    """
+    ls = TimescaleListenStore({
+        'REDIS_HOST': config.REDIS_HOST,
+        'REDIS_PORT': config.REDIS_PORT,
+        'REDIS_NAMESPACE': config.REDIS_NAMESPACE,
+        'SQLALCHEMY_TIMESCALE_URI': config.SQLALCHEMY_TIMESCALE_URI,
+    }, logging.getLogger(__name__))
+
+    click.echo("%10s %16s %16s" % ("listens", "values (s)", "copy (s)"))
+    for size in sizes:
+        timings = []
+        for use_copy in (False, True):
+            user_name = "benchmark-%s" % uuid.uuid4()
+            listens = generate_listens(user_name, size)
+            try:
+                t0 = time.monotonic()
+                ls.insert(listens, use_copy=use_copy)
+                timings.append(time.monotonic() - t0)
+            finally:
+                delete_benchmark_user(ls, user_name)
+        click.echo("%10d %16.3f %16.3f" % (size, timings[0], timings[1]))
+
+
+def generate_timescale_rows(count):
+    """ Generate count rows as read from the listen table, with the listen JSON as text. """
+    created = datetime.utcnow()
+    rows = []
+    for listen in generate_listens("benchmark", count):
+        listened_at, track_name, user_name, data, _ = listen.to_timescale()
+        rows.append((listened_at, track_name, user_name, created, data))
+    return rows
+
+
+def _construct(rows, lazy):
+    if lazy:
+        return [LazyListen(*row) for row in rows]
+    # psycopg2 decodes JSONB columns, so decoding is part of what creating a Listen costs
+    return [Listen.from_timescale(ts, track_name, user_name, created, ujson.loads(data))
+            for ts, track_name, user_name, created, data in rows]
+
+
+@cli.command(name="listen_objects")
+@click.option("--count", "-c", type=int, default=DEFAULT_LISTEN_OBJECT_COUNT, show_default=True,
+              help="Number of listens to create.")
+def listen_objects(count):
+    """ Compare construction time and memory use of Listen and LazyListen objects
+        made from listen table rows. Doesn't need a database.
+    """
+    rows = generate_timescale_rows(count)
+
+    click.echo("%12s %16s %16s %16s" % ("class", "construct (s)", "ts access (s)", "memory (MB)"))
+    for name, lazy in (("Listen", False), ("LazyListen", True)):
+        gc.collect()
+        t0 = time.monotonic()
+        listens = _construct(rows, lazy)
+        construct_time = time.monotonic() - t0
+
+        t0 = time.monotonic()
+        for listen in listens:
+            listen.ts_since_epoch, listen.user_name
+        access_time = time.monotonic() - t0
+        del listens
+
+        # measure memory separately, tracemalloc slows down allocations considerably
+        gc.collect()
+        tracemalloc.start()
+        listens = _construct(rows, lazy)
+        memory, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del listens
+
+        click.echo("%12s %16.3f %16.3f %16.1f" % (name, construct_time, access_time, memory / (1024 * 1024)))
+
+
+def generate_import_payload(count, start_ts=1500000000):
+    """ Generate the JSON body of an import submission with count listens, with MBIDs like most scrobblers send. """
+    listens = []
+    for i in range(count):
+        listens.append({
+            'listened_at': start_ts + i,
+            'track_metadata': {
+                'artist_name': 'Frank Ocean',
+                'track_name': 'Track %d' % i,
+                'release_name': 'Blonde',
+                'additional_info': {
+                    'recording_mbid': str(uuid.uuid4()),
+                    'release_mbid': str(uuid.uuid4()),
+                    'artist_mbids': [str(uuid.uuid4())],
+                    'tags': ['benchmark'],
+                },
+            },
+        })
+    return ujson.dumps({'listen_type': 'import', 'payload': listens})
+
+
+def _validate_one_by_one(payload):
+    return [validate_listen(listen, LISTEN_TYPE_IMPORT) for listen in payload]
+
+
+def _validate_in_one_pass(payload):
+    return validate_listens(payload, LISTEN_TYPE_IMPORT)
+
+
+@cli.command(name="validate_listens")
+@click.option("--count", "-c", type=int, default=DEFAULT_VALIDATE_PAYLOAD_SIZE, show_default=True,
+              help="Number of listens per payload.")
+@click.option("--rounds", "-r", type=int, default=DEFAULT_VALIDATE_ROUNDS, show_default=True,
+              help="Number of payloads to validate.")
+def validate_listens_benchmark(count, rounds):
+    """ Compare validating import payloads one listen at a time with validate_listen
+        and in one pass with validate_listens. Doesn't need a database.
+    """
+    raw_data = generate_import_payload(count)
+
+    click.echo("%16s %16s %16s" % ("method", "total (s)", "per payload (ms)"))
+    for name, validate in (("validate_listen", _validate_one_by_one), ("validate_listens", _validate_in_one_pass)):
+        total = 0.0
+        for _ in range(rounds):
+            # validation mutates the listens, so every round gets freshly decoded ones like a request does
+            payload = ujson.loads(raw_data)['payload']
+            t0 = time.monotonic()
+            validate(payload)
+            total += time.monotonic() - t0
+        click.echo("%16s %16.3f %16.3f" % (name, total, total * 1000 / rounds))
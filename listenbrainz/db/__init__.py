@@ -1,10 +1,12 @@
 
 import sqlalchemy
 from sqlalchemy import create_engine
-from sqlalchemy.pool import NullPool
 import time
+import uuid
 import psycopg2
 
+from listenbrainz.db import pool
+
 # This value must be incremented after schema changes on replicated tables!
 SCHEMA_VERSION = 5
 
@@ -12,18 +14,25 @@ engine = None
 
 DUMP_DEFAULT_THREAD_COUNT = 4
 
+# Default number of rows fetched at a time by stream_query
+STREAM_QUERY_BLOCK_SIZE = 10000
+
 
-def init_db_connection(connect_str):
+def init_db_connection(connect_str, pool_prefix=None):
     """Initializes database connection using the specified Flask app.
 
     Configuration file must contain `SQLALCHEMY_DATABASE_URI` key. See
     https://pythonhosted.org/Flask-SQLAlchemy/config.html#configuration-keys
     for more info.
+
+    If pool_prefix is given, the engine keeps a connection pool configured by the config
+    keys with that prefix, see listenbrainz.db.pool.
     """
     global engine
     while True:
         try:
-            engine = create_engine(connect_str, poolclass=NullPool)
+            engine = create_engine(connect_str, **pool.engine_options(pool_prefix))
+            pool.init_pool_metrics(engine, pool_prefix)
             break
         except psycopg2.OperationalError as e:
             print("Couldn't establish connection to db: {}".format(str(e)))
@@ -56,3 +65,28 @@ def run_sql_script_without_transaction(sql_file_path):
             connection.close()
         return True
 
+
+def stream_query(connection, query, params=None, block_size=STREAM_QUERY_BLOCK_SIZE, cursor_factory=None,
+                 withhold=False):
+    """ Run a query on a named server side cursor and yield its result in lists of up to
+        block_size rows, so that only one block of the result is held in memory at a time.
+
+        Args:
+            connection: a psycopg2 connection, for a SQLAlchemy connection pass connection.connection.
+                The cursor lives in the current transaction of the connection unless withhold is set,
+                so the connection must not be in autocommit mode.
+            query: the query, with psycopg2 style %(name)s parameters
+            params: the parameters of the query
+            block_size: the number of rows fetched from the server at a time
+            cursor_factory: an optional psycopg2 cursor class, e.g. psycopg2.extras.DictCursor
+            withhold: keep the cursor open when the transaction is committed while iterating
+    """
+    with connection.cursor(name="stream_query_%s" % uuid.uuid4().hex, cursor_factory=cursor_factory,
+                           withhold=withhold) as curs:
+        curs.itersize = block_size
+        curs.execute(query, params)
+        while True:
+            rows = curs.fetchmany(block_size)
+            if not rows:
+                break
+            yield rows
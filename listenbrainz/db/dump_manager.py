@@ -244,7 +244,9 @@ def create_feedback(location, threads):
 @click.option('--public-archive', '-pu', default=None, required=False)
 @click.option('--listen-archive', '-l', default=None, required=True)
 @click.option('--threads', '-t', type=int, default=DUMP_DEFAULT_THREAD_COUNT)
-def import_dump(private_archive, public_archive, listen_archive, threads):
+@click.option('--parallel', is_flag=True, help="Import listens with worker processes and COPY, recalculating "
+                                               "the listen counts and timestamps of all users at the end.")
+def import_dump(private_archive, public_archive, listen_archive, threads, parallel):
     """ Import a ListenBrainz dump into the database.
 
         Note: This method tries to import the private db dump first, followed by the public db
@@ -258,6 +260,7 @@ def import_dump(private_archive, public_archive, listen_archive, threads):
             public_archive (str): the path to the ListenBrainz public dump to be imported
             listen_archive (str): the path to the ListenBrainz listen dump archive to be imported
             threads (int): the number of threads to use during decompression, defaults to 1
+            parallel (bool): import the listens with threads worker processes, for restoring mirrors
     """
     app = create_app()
     with app.app_context():
@@ -265,7 +268,7 @@ def import_dump(private_archive, public_archive, listen_archive, threads):
 
         from listenbrainz.webserver.timescale_connection import _ts as ls
         try:
-            ls.import_listens_dump(listen_archive, threads)
+            ls.import_listens_dump(listen_archive, threads, parallel=parallel)
         except psycopg2.OperationalError as e:
             current_app.logger.critical(
                 'OperationalError while trying to import data: %s', str(e), exc_info=True)
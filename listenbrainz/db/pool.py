@@ -0,0 +1,125 @@
+""" Connection pool settings of the SQLAlchemy engines.
+
+The pool of each database is configured with config keys that start with a per database prefix,
+DB for the ListenBrainz database, TIMESCALE and MESSYBRAINZ for the others:
+
+    <PREFIX>_POOL_SIZE: number of connections kept open, 0 opens a new connection for every
+                        checkout as before (default 0)
+    <PREFIX>_POOL_MAX_OVERFLOW: number of connections opened beyond the pool size under load (default 10)
+    <PREFIX>_POOL_PRE_PING: test connections for liveness on checkout (default True)
+    <PREFIX>_POOL_RECYCLE: seconds after which connections are replaced, -1 never (default 1800)
+    <PREFIX>_PGBOUNCER: the database is behind PgBouncer, which pools server connections itself,
+                        so don't keep a second pool on top of it (default False)
+"""
+
+import os
+import time
+
+from brainzutils import metrics
+from sqlalchemy import event, exc
+from sqlalchemy.pool import NullPool, QueuePool
+
+from listenbrainz import config
+
+METRIC_UPDATE_INTERVAL = 60  # seconds
+
+
+def engine_options(prefix):
+    """ Return the pool related keyword arguments of create_engine for the database with the given
+        config prefix. Without a prefix, connections aren't pooled.
+    """
+    if prefix is None:
+        return {"poolclass": NullPool}
+
+    pool_size = getattr(config, prefix + "_POOL_SIZE", 0)
+    if pool_size <= 0 or getattr(config, prefix + "_PGBOUNCER", False):
+        return {"poolclass": NullPool}
+
+    return {
+        "poolclass": MeteredQueuePool,
+        "pool_size": pool_size,
+        "max_overflow": getattr(config, prefix + "_POOL_MAX_OVERFLOW", 10),
+        "pool_pre_ping": getattr(config, prefix + "_POOL_PRE_PING", True),
+        "pool_recycle": getattr(config, prefix + "_POOL_RECYCLE", 1800),
+    }
+
+
+def init_pool_metrics(engine, name):
+    """ Report the checkout latency and saturation of the pool of the engine as metrics with the given name """
+    if name and isinstance(engine.pool, MeteredQueuePool):
+        engine.pool.metrics_name = name
+
+
+class MeteredQueuePool(QueuePool):
+    """ A QueuePool which keeps track of the time spent waiting for connections and regularly
+        submits it with the number of connections in use as metrics, once a name is set with
+        init_pool_metrics.
+    """
+
+    metrics_name = None
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.checkouts = 0
+        self.checkout_time = 0.0
+        self.max_checkout_time = 0.0
+        self.metric_submission_time = time.monotonic() + METRIC_UPDATE_INTERVAL
+
+    def recreate(self):
+        pool = super().recreate()
+        pool.metrics_name = self.metrics_name
+        return pool
+
+    def _do_get(self):
+        t0 = time.monotonic()
+        try:
+            return super()._do_get()
+        finally:
+            elapsed = time.monotonic() - t0
+            self.checkouts += 1
+            self.checkout_time += elapsed
+            self.max_checkout_time = max(self.max_checkout_time, elapsed)
+            if self.metrics_name and time.monotonic() > self.metric_submission_time:
+                self._submit_metrics()
+
+    def _submit_metrics(self):
+        self.metric_submission_time = time.monotonic() + METRIC_UPDATE_INTERVAL
+        try:
+            metrics.set("db_pool_%s" % self.metrics_name,
+                        checkouts=self.checkouts,
+                        checkout_time_ms=int(self.checkout_time * 1000),
+                        max_checkout_time_ms=int(self.max_checkout_time * 1000),
+                        checked_out=self.checkedout(),
+                        capacity=self.size() + self._max_overflow)
+        except Exception:
+            # Not critical, metrics are not initialized outside of the webserver
+            pass
+        self.checkouts = 0
+        self.checkout_time = 0.0
+        self.max_checkout_time = 0.0
+
+
+@event.listens_for(MeteredQueuePool, "connect")
+def _remember_pid(dbapi_connection, connection_record):
+    connection_record.info["pid"] = os.getpid()
+
+
+@event.listens_for(MeteredQueuePool, "checkin")
+def _reset_autocommit(dbapi_connection, connection_record):
+    """ Don't return a connection switched to autocommit on the DBAPI level, like by
+        set_isolation_level(0), to the pool, later checkouts would run without transactions.
+    """
+    if dbapi_connection is not None and getattr(dbapi_connection, "autocommit", False) is True:
+        dbapi_connection.autocommit = False
+
+
+@event.listens_for(MeteredQueuePool, "checkout")
+def _check_pid(dbapi_connection, connection_record, connection_proxy):
+    """ Don't hand out connections opened before a fork, like by the uwsgi master, in the forked
+        process. Drop the reference without closing the connection, which the parent still uses.
+    """
+    if connection_record.info["pid"] != os.getpid():
+        connection_record.connection = connection_proxy.connection = None
+        raise exc.DisconnectionError(
+            "Connection record belongs to pid %s, attempting to check out in pid %s" %
+            (connection_record.info["pid"], os.getpid()))
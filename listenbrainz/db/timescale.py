@@ -6,6 +6,7 @@ import time
 import psycopg2
 
 from listenbrainz import config
+from listenbrainz.db import pool
 
 # This value must be incremented after schema changes on replicated tables!
 SCHEMA_VERSION = 6
@@ -15,12 +16,15 @@ engine = None
 DUMP_DEFAULT_THREAD_COUNT = 4
 
 
-def init_db_connection(connect_str):
+def init_db_connection(connect_str, pool_prefix=None):
     """Initializes timescale connection using the specified Flask app.
 
     Configuration file must contain `SQLALCHEMY_DATABASE_URI` key. See
     https://pythonhosted.org/Flask-SQLAlchemy/config.html#configuration-keys
     for more info.
+
+    If pool_prefix is given, the engine keeps a connection pool configured by the config
+    keys with that prefix, see listenbrainz.db.pool.
     """
     global engine
     if not connect_str:
@@ -28,7 +32,8 @@ def init_db_connection(connect_str):
 
     while True:
         try:
-            engine = create_engine(connect_str, poolclass=NullPool)
+            engine = create_engine(connect_str, **pool.engine_options(pool_prefix))
+            pool.init_pool_metrics(engine, pool_prefix)
             break
         except psycopg2.OperationalError as e:
             print("Couldn't establish connection to timescale: {}".format(str(e)))
@@ -80,33 +85,30 @@ def create_view_indexes():
     admin_engine = create_engine(
         config.TIMESCALE_ADMIN_LB_URI, poolclass=NullPool)
     with admin_engine.connect() as connection:
-        query = """SELECT materialization_hypertable_schema, materialization_hypertable_name
-                     FROM timescaledb_information.continuous_aggregates
-                    WHERE view_name = 'listen_count_30day'"""
-        curs = connection.execute(query)
-        row = curs.fetchone()
-        if row is None:
-            raise RuntimeError(
-                "Cannot find materialized view name for listen_count view.")
-
-        view_schema = row[0]
-        view_name = row[1]
-        if not view_name:
-            raise RuntimeError(
-                "Cannot find materialized view name for listen_count view.")
-
-        query = """CREATE INDEX listened_at_bucket_user_name_ndx_listen_count_30day
-                             ON %s.%s (listened_at_bucket, user_name)""" % (view_schema, view_name)
-        try:
-            connection.execute(query)
-        except Exception as err:
-            raise RuntimeError(
-                "Cannot create index on materialized view of listen_count_30day")
-
-        query = """CREATE INDEX user_name_ndx_listen_count_30day
-                             ON %s.%s (user_name)""" % (view_schema, view_name)
-        try:
-            connection.execute(query)
-        except Exception as err:
-            raise RuntimeError(
-                "Cannot create index on materialized view of listen_count_30day")
+        _create_view_index(connection, "listen_count_30day",
+                           "listened_at_bucket_user_name_ndx_listen_count_30day", "listened_at_bucket, user_name")
+        _create_view_index(connection, "listen_count_30day", "user_name_ndx_listen_count_30day", "user_name")
+        _create_view_index(connection, "listen_timestamps_30day", "user_name_ndx_listen_timestamps_30day", "user_name")
+
+
+def _create_view_index(connection, view, index_name, columns):
+    """ Create an index on the materialization hypertable of the continuous aggregate view """
+
+    query = """SELECT materialization_hypertable_schema, materialization_hypertable_name
+                 FROM timescaledb_information.continuous_aggregates
+                WHERE view_name = :view"""
+    curs = connection.execute(sqlalchemy.text(query), view=view)
+    row = curs.fetchone()
+    if row is None or not row[1]:
+        raise RuntimeError(
+            "Cannot find materialized view name for %s view." % view)
+
+    view_schema = row[0]
+    view_name = row[1]
+    query = """CREATE INDEX %s
+                         ON %s.%s (%s)""" % (index_name, view_schema, view_name, columns)
+    try:
+        connection.execute(query)
+    except Exception as err:
+        raise RuntimeError(
+            "Cannot create index on materialized view of %s" % view)
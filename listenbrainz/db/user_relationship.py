@@ -17,7 +17,7 @@
 # 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
 
 from datetime import datetime
-from typing import List, Tuple
+from typing import Dict, Iterable, List, Tuple
 
 from listenbrainz import db
 from listenbrainz.db.exceptions import DatabaseException
@@ -95,6 +95,27 @@ def get_followers_of_user(user: int) -> List[dict]:
         return [dict(row) for row in result.fetchall()]
 
 
+def get_follower_ids_of_users(users: Iterable[int]) -> Dict[int, List[int]]:
+    """ Returns a dict of user id to the ids of the users who follow that user, for the specified users
+        who have followers.
+    """
+    users = tuple(users)
+    if not users:
+        return {}
+
+    with db.engine.connect() as connection:
+        result = connection.execute(sqlalchemy.text("""
+            SELECT user_1 AS followed, array_agg(user_0) AS followers
+              FROM user_relationship
+             WHERE user_1 IN :users
+               AND relationship_type = 'follow'
+          GROUP BY user_1
+        """), {
+            "users": users,
+        })
+        return {row["followed"]: row["followers"] for row in result.fetchall()}
+
+
 def get_following_for_user(user: int) -> List[dict]:
     """ Returns a list of users who the specified user follows.
     """
@@ -7,6 +7,7 @@ import psycopg2.extras
 from datasethoster import Query
 from unidecode import unidecode
 from listenbrainz import config
+from listenbrainz.db import stream_query
 
 
 class ArtistCreditRecordingLookupQuery(Query):
@@ -38,24 +39,20 @@ class ArtistCreditRecordingLookupQuery(Query):
         lookup_strings = tuple(lookup_strings)
 
         with psycopg2.connect(config.MBID_MAPPING_DATABASE_URI) as conn:
-            with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as curs:
-                curs.execute("""SELECT artist_credit_name,
-                                       artist_credit_id,
-                                       artist_mbids,
-                                       release_name,
-                                       release_mbid,
-                                       recording_name,
-                                       recording_mbid,
-                                       combined_lookup
-                                  FROM mapping.mbid_mapping
-                                 WHERE combined_lookup IN %s""", (lookup_strings,))
-
-                results = []
-                while True:
-                    data = curs.fetchone()
-                    if not data:
-                        break
-
+            query = """SELECT artist_credit_name,
+                              artist_credit_id,
+                              artist_mbids,
+                              release_name,
+                              release_mbid,
+                              recording_name,
+                              recording_mbid,
+                              combined_lookup
+                         FROM mapping.mbid_mapping
+                        WHERE combined_lookup IN %s"""
+
+            results = []
+            for rows in stream_query(conn, query, (lookup_strings,), cursor_factory=psycopg2.extras.DictCursor):
+                for data in rows:
                     data = dict(data)
                     index = string_index[data["combined_lookup"]]
                     data["recording_arg"] = params[index]["[recording_name]"]
@@ -63,4 +60,4 @@ class ArtistCreditRecordingLookupQuery(Query):
                     data["index"] = index
                     results.append(data)
 
-                return results
+            return results
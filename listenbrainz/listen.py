@@ -208,7 +208,7 @@ class Listen(object):
         return (self.ts_since_epoch, track_name, self.user_name, ujson.dumps({
             'user_id': self.user_id,
             'track_metadata': track_metadata
-        }))
+        }), self.recording_msid)
 
     def validate(self):
         return (self.user_id is not None and self.timestamp is not None and self.artist_msid is not None
@@ -227,6 +227,98 @@ class Listen(object):
                (self.user_name, self.ts_since_epoch, self.artist_msid, self.release_msid, self.recording_msid, self.data['artist_name'], self.data['track_name'])
 
 
+class LazyListen:
+    """ A read only listen made from a row of the timescale listen table, with the same attributes
+        and to_api/to_json output as the Listen that Listen.from_timescale makes from the row.
+
+        The listen JSON is kept as it was read from the database and only decoded the first time
+        the track metadata is used, so that callers which only need timestamps and user names
+        never decode it. The JSON in the listen table was flattened and checked for nulls by
+        Listen when it was inserted, so that isn't repeated either.
+    """
+
+    __slots__ = ('ts_since_epoch', 'track_name', 'user_name', 'inserted_timestamp',
+                 'recording_mbid', 'release_mbid', 'artist_mbids', '_raw', '_json')
+
+    def __init__(self, listened_at, track_name, user_name, created, data,
+                 recording_mbid=None, release_mbid=None, artist_mbids=None):
+        """ data can either be the listen JSON as str or bytes, or the already decoded dict """
+        self.ts_since_epoch = int(listened_at)
+        self.track_name = track_name
+        self.user_name = user_name
+        self.inserted_timestamp = created
+        self.recording_mbid = recording_mbid
+        self.release_mbid = release_mbid
+        self.artist_mbids = artist_mbids
+        self._raw = data
+        self._json = None
+
+    def _decode(self):
+        if self._json is None:
+            j = ujson.loads(self._raw) if isinstance(self._raw, (str, bytes)) else self._raw
+            j['track_metadata']['track_name'] = self.track_name
+            if self.recording_mbid is not None:
+                j["track_metadata"]["mbid_mapping"] = {
+                    "recording_mbid": str(self.recording_mbid),
+                    "release_mbid": str(self.release_mbid),
+                    "artist_mbids": [str(m) for m in self.artist_mbids]}
+            self._json = j
+            self._raw = None
+        return self._json
+
+    @property
+    def data(self):
+        return self._decode()['track_metadata']
+
+    @property
+    def user_id(self):
+        return self._decode().get('user_id')
+
+    @property
+    def timestamp(self):
+        return datetime.utcfromtimestamp(self.ts_since_epoch)
+
+    @property
+    def artist_msid(self):
+        return self.data['additional_info'].get('artist_msid')
+
+    @property
+    def release_msid(self):
+        return self.data['additional_info'].get('release_msid')
+
+    @property
+    def recording_msid(self):
+        return self.data['additional_info'].get('recording_msid')
+
+    def to_api(self):
+        """ See Listen.to_api """
+        track_metadata = self.data.copy()
+        track_metadata['additional_info']['artist_msid'] = self.artist_msid
+        track_metadata['additional_info']['release_msid'] = self.release_msid
+
+        return {
+            'track_metadata': track_metadata,
+            'listened_at': self.ts_since_epoch,
+            'recording_msid': self.recording_msid,
+            'user_name': self.user_name,
+            'inserted_at': self.inserted_timestamp or 0
+        }
+
+    def to_json(self):
+        """ See Listen.to_json """
+        return {
+            'user_id': self.user_id,
+            'user_name': self.user_name,
+            'timestamp': self.timestamp,
+            'track_metadata': self.data,
+            'recording_msid': self.recording_msid
+        }
+
+    def __repr__(self):
+        return "<LazyListen: user_name: %s, time: %s, track_name: %s>" % \
+               (self.user_name, self.ts_since_epoch, self.track_name)
+
+
 class NowPlayingListen:
     """Represents a now playing listen"""
 
@@ -56,9 +56,12 @@ class ListenStore(object):
         """
         raise NotImplementedError()
 
-    def fetch_listens(self, user_name, from_ts=None, to_ts=None, limit=DEFAULT_LISTENS_PER_FETCH):
+    def fetch_listens(self, user_name, from_ts=None, to_ts=None, limit=DEFAULT_LISTENS_PER_FETCH, as_json=False):
         """ Check from_ts, to_ts, and limit for fetching listens
             and set them to default values if not given.
+
+            If as_json is set, the listens are returned as JSON strings in the
+            format of the API instead of Listen objects.
         """
         if from_ts and to_ts and from_ts >= to_ts:
             raise ValueError("from_ts should be less than to_ts")
@@ -67,4 +70,4 @@ class ListenStore(object):
         else:
             order = ORDER_DESC
 
-        return self.fetch_listens_from_storage(user_name, from_ts, to_ts, limit, order)
+        return self.fetch_listens_from_storage(user_name, from_ts, to_ts, limit, order, as_json)
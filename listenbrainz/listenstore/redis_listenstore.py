@@ -1,21 +1,124 @@
+import hashlib
+from collections import defaultdict
 from datetime import datetime
 from time import time
 
 import redis
 from typing import Optional
 import ujson
+from werkzeug.http import http_date
 
 from listenbrainz.listen import Listen, NowPlayingListen
 from listenbrainz.listenstore import ListenStore
 from brainzutils import cache
 from listenbrainz.utils import create_path, init_cache
 
+# Redis script to store the playing now listen of a user unless it is the same track as the stored one.
+# KEYS holds the playing now key and the key of the hash of its track, ARGV holds the hash of the
+# track, the listen JSON and the expiry time in seconds. The listen is msgpack encoded, as written by
+# brainzutils cache. Returns 1 if the listen was stored, 0 if the track is unchanged.
+UPDATE_PLAYING_NOW_SCRIPT = """
+if redis.call('GET', KEYS[2]) == ARGV[1] and redis.call('EXISTS', KEYS[1]) == 1 then
+    return 0
+end
+redis.call('SET', KEYS[1], cmsgpack.pack(ARGV[2]), 'EX', ARGV[3])
+redis.call('SET', KEYS[2], ARGV[1], 'EX', ARGV[3])
+return 1
+"""
+
+# Redis script to add listens to the recent listens of all users and of each user, and trim both
+# to their maximum size. KEYS holds the key of all recent listens followed by the keys of the
+# users. ARGV holds the max number of recent listens of all users and of each user and the expiry
+# time of the user keys in seconds, followed by four values for each listen: its listened_at, its
+# entry in the recent listens of all users, the index of its user's key in KEYS or 0 to only add
+# it to the recent listens of all users, and its entry in the recent listens of the user.
+UPDATE_RECENT_LISTENS_SCRIPT = """
+local user_keys = {}
+for i = 4, #ARGV, 4 do
+    redis.call('ZADD', KEYS[1], 'NX', ARGV[i], ARGV[i + 1])
+    local user_key = tonumber(ARGV[i + 2])
+    if user_key > 0 then
+        redis.call('ZADD', KEYS[user_key], 'NX', ARGV[i], ARGV[i + 3])
+        user_keys[user_key] = true
+    end
+end
+redis.call('ZREMRANGEBYRANK', KEYS[1], 0, -tonumber(ARGV[1]) - 1)
+for user_key in pairs(user_keys) do
+    redis.call('ZREMRANGEBYRANK', KEYS[user_key], 0, -tonumber(ARGV[2]) - 1)
+    redis.call('EXPIRE', KEYS[user_key], ARGV[3])
+end
+"""
+
+# Redis script to add listens to the feeds of the users who follow their listeners, and trim the
+# feeds to their maximum size. Each feed is a sorted set of references to listens scored by
+# listened_at, which comes with a key holding the feed generation it was started in and the
+# listened_at above which the feed has every listen of the followed users, as "generation,listened_at".
+# Feeds of an earlier generation than the current one are started again. KEYS holds the key of the
+# current feed generation followed by the key of each feed and the key of its listened_at. ARGV
+# holds the max number of listens in a feed, the expiry time of the keys in seconds and the
+# listened_at of new feeds, followed by the number of listens added to each feed and their
+# listened_at and reference.
+ADD_FEED_LISTENS_SCRIPT = """
+local generation = redis.call('GET', KEYS[1]) or '0'
+local i = 4
+for k = 2, #KEYS, 2 do
+    local feed_generation, since = string.match(redis.call('GET', KEYS[k + 1]) or '', '^(%d+),(%d+)$')
+    if feed_generation ~= generation then
+        redis.call('DEL', KEYS[k])
+        since = ARGV[3]
+        redis.call('SET', KEYS[k + 1], generation .. ',' .. since)
+    end
+    local count = tonumber(ARGV[i])
+    for j = i + 1, i + 2 * count, 2 do
+        redis.call('ZADD', KEYS[k], 'NX', ARGV[j], ARGV[j + 1])
+    end
+    i = i + 1 + 2 * count
+    if redis.call('ZREMRANGEBYRANK', KEYS[k], 0, -tonumber(ARGV[1]) - 1) > 0 then
+        local oldest = tonumber(redis.call('ZRANGE', KEYS[k], 0, 0, 'WITHSCORES')[2])
+        if oldest > tonumber(since) then
+            redis.call('SET', KEYS[k + 1], string.format('%s,%d', generation, oldest))
+        end
+    end
+    redis.call('EXPIRE', KEYS[k], ARGV[2])
+    redis.call('EXPIRE', KEYS[k + 1], ARGV[2])
+end
+"""
+
+# The MBID mapping of the recordings of the recent listens of each user, added by the mbid mapping writer
+RECENT_LISTENS_MBID_MAPPING_KEY = "rl-mbid."
+
+
+def set_recent_listens_mbid_mappings(mappings):
+    """ Store the MBID mapping of recordings for the recent listens of each user, which are stored
+        before the listens are mapped.
+
+        Args:
+            mappings: dict of recording_msid to the mbid_mapping of its listens in the API
+    """
+    cache.set_many({RECENT_LISTENS_MBID_MAPPING_KEY + msid: mapping for msid, mapping in mappings.items()},
+                   expirein=RedisListenStore.USER_RECENT_LISTENS_EXPIRY)
+
+
+def get_recent_listens_mbid_mappings(recording_msids):
+    """ Returns a dict of recording_msid to mbid_mapping for the given recordings with a stored MBID mapping """
+    if not recording_msids:
+        return {}
+    mappings = cache.get_many([RECENT_LISTENS_MBID_MAPPING_KEY + msid for msid in recording_msids])
+    return {key[len(RECENT_LISTENS_MBID_MAPPING_KEY):]: mapping for key, mapping in mappings.items()}
+
 
 class RedisListenStore(ListenStore):
 
     RECENT_LISTENS_KEY = "rl-"
     RECENT_LISTENS_MAX = 100
+    USER_RECENT_LISTENS_KEY = "rl."
+    USER_RECENT_LISTENS_EXPIRY = 7 * 24 * 60 * 60  # 7 days in seconds
+    FEED_LISTENS_KEY = "feed-listens."
+    FEED_LISTENS_SINCE_KEY = "feed-listens-since."
+    FEED_LISTENS_GENERATION_KEY = "feed-listens-generation"
+    FEED_LISTENS_EXPIRY = 7 * 24 * 60 * 60  # 7 days in seconds
     PLAYING_NOW_KEY = "pn."
+    PLAYING_NOW_TRACK_KEY = "pn-track."
     LISTEN_COUNT_PER_DAY_EXPIRY_TIME = 3 * 24 * 60 * 60  # 3 days in seconds
     LISTEN_COUNT_PER_DAY_KEY = "lc-day-"
 
@@ -28,6 +131,13 @@ class RedisListenStore(ListenStore):
                    namespace=conf['REDIS_NAMESPACE'])
         # This is used in tests. Leave for cleanup in LB-879
         self.redis = cache._r
+        self.update_playing_now_script = cache._r.register_script(UPDATE_PLAYING_NOW_SCRIPT)
+        self.update_recent_listens_script = cache._r.register_script(UPDATE_RECENT_LISTENS_SCRIPT)
+        self.add_feed_listens_script = cache._r.register_script(ADD_FEED_LISTENS_SCRIPT)
+        # the number of recent listens kept for each user, 0 disables them
+        self.user_recent_listens_max = conf.get('USER_RECENT_LISTENS_MAX', 0)
+        # the number of listens of followed users kept for the feed of each user, 0 disables the feeds
+        self.feed_listens_max = conf.get('FEED_LISTENS_MAX', 0)
 
     def get_playing_now(self, user_id):
         """ Return the current playing song of the user
@@ -55,6 +165,25 @@ class RedisListenStore(ListenStore):
         """
         cache.set(self.PLAYING_NOW_KEY + str(user_id), ujson.dumps(listen).encode('utf-8'), expirein=expire_time)
 
+    def update_playing_now(self, user_id, listen, expire_time):
+        """ Save a listen as `playing_now` like put_playing_now, unless the user is already playing
+        the same track, which is checked atomically in a single round trip.
+
+        Args:
+            user_id (int): the row ID of the user
+            listen (dict): the listen data
+            expire_time (int): the time in seconds in which the `playing_now` listen should expire
+
+        Returns:
+            True if the listen was saved, False if the track is unchanged
+        """
+        track_metadata = listen['track_metadata']
+        track_hash = hashlib.sha1(ujson.dumps(
+            [track_metadata['track_name'], track_metadata['artist_name']]).encode('utf-8')).hexdigest()
+        keys = [cache._prep_key(self.PLAYING_NOW_KEY + str(user_id)),
+                cache._prep_key(self.PLAYING_NOW_TRACK_KEY + str(user_id))]
+        return self.update_playing_now_script(keys=keys, args=[track_hash, ujson.dumps(listen), expire_time]) == 1
+
     def check_connection(self):
         """ Pings the redis server to check if the connection works or not """
         try:
@@ -68,21 +197,113 @@ class RedisListenStore(ListenStore):
         """ 
             Store the most recent listens in redis so we can fetch them easily for a recent listens page. This
             is not a critical action, so if it fails, it fails. Let's live with it.
+
+            If USER_RECENT_LISTENS_MAX is set, the most recent listens of each user are also stored, as API
+            JSON, for TimescaleListenStore.fetch_recent_listens_for_users.
         """
 
-        recent = {}
+        keys = [cache._prep_key(self.RECENT_LISTENS_KEY)]
+        user_key_indexes = {}
+        args = [self.RECENT_LISTENS_MAX, self.user_recent_listens_max, self.USER_RECENT_LISTENS_EXPIRY]
+        # formatted like jsonify formats the inserted_at of listens from the listen table in API responses
+        inserted_at = http_date(time())
         for listen in unique:
-            recent[ujson.dumps(listen.to_json()).encode('utf-8')] = float(listen.ts_since_epoch)
+            args.append(listen.ts_since_epoch)
+            args.append(ujson.dumps(listen.to_json()))
+            if self.user_recent_listens_max > 0:
+                user_key = cache._prep_key(self.USER_RECENT_LISTENS_KEY + listen.user_name)
+                if user_key not in user_key_indexes:
+                    keys.append(user_key)
+                    user_key_indexes[user_key] = len(keys)
+                data = listen.to_api()
+                data['inserted_at'] = inserted_at
+                args.append(user_key_indexes[user_key])
+                args.append(ujson.dumps(data))
+            else:
+                args.append(0)
+                args.append('')
 
         # Don't take this very seriously -- if it fails, really no big deal. Let is go.
-        if recent:
-            cache._r.zadd(cache._prep_key(self.RECENT_LISTENS_KEY), recent, nx=True)
+        if unique:
+            self.update_recent_listens_script(keys=keys, args=args)
 
-            # Don't prune the sorted list each time, but only when it reaches twice the desired size 
-            count = cache._r.zcard(cache._prep_key(self.RECENT_LISTENS_KEY))
-            if count > (self.RECENT_LISTENS_MAX * 2):
-                cache._r.zpopmin(cache._prep_key(self.RECENT_LISTENS_KEY), count - self.RECENT_LISTENS_MAX - 1)
 
+    def add_listens_to_feeds(self, unique, followers, max_listened_at):
+        """ Add references to listens to the feeds of the users who follow their listeners, so that
+            the listen events of a feed can be read with get_feed_listens instead of querying the
+            listens of every followed user.
+
+            Args:
+                unique: the inserted listens
+                followers: dict of user id to the ids of the users who follow the user
+                max_listened_at: the highest listened_at of listens which were submitted before now,
+                    a feed created now has every later listen of the followed users
+        """
+        feeds = defaultdict(list)
+        for listen in unique:
+            ref = ujson.dumps([listen.ts_since_epoch, listen.user_name, listen.data['track_name']])
+            for follower in followers.get(listen.user_id, []):
+                feeds[follower].extend((listen.ts_since_epoch, ref))
+
+        if not feeds:
+            return
+
+        keys = [cache._prep_key(self.FEED_LISTENS_GENERATION_KEY)]
+        args = [self.feed_listens_max, self.FEED_LISTENS_EXPIRY, max_listened_at]
+        for follower, listens in feeds.items():
+            keys.append(cache._prep_key(self.FEED_LISTENS_KEY + str(follower)))
+            keys.append(cache._prep_key(self.FEED_LISTENS_SINCE_KEY + str(follower)))
+            args.append(len(listens) // 2)
+            args.extend(listens)
+        self.add_feed_listens_script(keys=keys, args=args)
+
+    def get_feed_listens(self, user_id, min_ts, max_ts, count):
+        """ Get the references to the up to count latest listens of the users followed by the user
+            between min_ts and max_ts, exclusive, from the feed of the user.
+
+            Returns:
+                a list of (listened_at, user_name, track_name) tuples, latest first, or None if the feed
+                doesn't hold every listen of the range, in which case the listens have to be queried
+        """
+        pipe = cache._r.pipeline()
+        pipe.get(cache._prep_key(self.FEED_LISTENS_GENERATION_KEY))
+        pipe.get(cache._prep_key(self.FEED_LISTENS_SINCE_KEY + str(user_id)))
+        pipe.zrevrangebyscore(cache._prep_key(self.FEED_LISTENS_KEY + str(user_id)),
+                              "+inf" if max_ts is None else "(%d" % max_ts,
+                              "-inf" if min_ts is None else "(%d" % min_ts,
+                              start=0, num=count, withscores=True)
+        generation, since, refs = pipe.execute()
+        if since is None:
+            return None
+
+        # feeds of an earlier generation may have missed listens
+        feed_generation, since = since.split(b",")
+        if int(feed_generation) != int(generation or 0):
+            return None
+
+        # a full page is complete if all of it is newer than the start of the feed
+        since = int(since)
+        if len(refs) == count and count > 0:
+            if refs[-1][1] <= since:
+                return None
+        elif min_ts is None or min_ts < since:
+            return None
+
+        return [tuple(ujson.loads(ref)) for ref, _ in refs]
+
+    def reset_feed_listens(self, user_id):
+        """ Remove the feed of the user, for example when the user starts or stops following someone.
+            It is started again with the next listens of the users the user follows.
+        """
+        cache._r.delete(cache._prep_key(self.FEED_LISTENS_KEY + str(user_id)),
+                        cache._prep_key(self.FEED_LISTENS_SINCE_KEY + str(user_id)))
+
+    def invalidate_feeds(self):
+        """ Start a new feed generation, so that the feeds of all users are no longer served and are
+            started again with the next listens of the users they follow. This is used when listens
+            may have been inserted without being added to the feeds.
+        """
+        cache._r.incr(cache._prep_key(self.FEED_LISTENS_GENERATION_KEY))
 
     def get_recent_listens(self, max = RECENT_LISTENS_MAX):
         """
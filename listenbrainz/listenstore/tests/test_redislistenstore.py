@@ -50,6 +50,32 @@ class RedisListenStoreTestCase(DatabaseTestCase):
         self.assertEqual(playing_now.data['artist_name'], 'The Strokes')
         self.assertEqual(playing_now.data['track_name'], 'Call It Fate, Call It Karma')
 
+    def test_update_playing_now(self):
+        listen = {
+            'user_id': self.testuser['id'],
+            'user_name': self.testuser['musicbrainz_id'],
+            'track_metadata': {
+                'artist_name': 'The Strokes',
+                'track_name': 'Call It Fate, Call It Karma',
+                'additional_info': {},
+            },
+        }
+        self.assertTrue(self._redis.update_playing_now(listen['user_id'], listen, config.PLAYING_NOW_MAX_DURATION))
+        # the same track again is not stored
+        self.assertFalse(self._redis.update_playing_now(listen['user_id'], listen, config.PLAYING_NOW_MAX_DURATION))
+
+        playing_now = self._redis.get_playing_now(listen['user_id'])
+        self.assertIsInstance(playing_now, NowPlayingListen)
+        self.assertEqual(playing_now.data['track_name'], 'Call It Fate, Call It Karma')
+
+        listen['track_metadata']['track_name'] = 'Ode to the Mets'
+        self.assertTrue(self._redis.update_playing_now(listen['user_id'], listen, config.PLAYING_NOW_MAX_DURATION))
+        self.assertEqual(self._redis.get_playing_now(listen['user_id']).data['track_name'], 'Ode to the Mets')
+
+        # once the playing now listen is gone, the same track is stored again
+        cache.delete(RedisListenStore.PLAYING_NOW_KEY + str(listen['user_id']))
+        self.assertTrue(self._redis.update_playing_now(listen['user_id'], listen, config.PLAYING_NOW_MAX_DURATION))
+
 
     def test_update_and_get_recent_listens(self):
 
@@ -82,6 +108,48 @@ class RedisListenStoreTestCase(DatabaseTestCase):
         for i, r in enumerate(recent):
             self.assertEqual(r.timestamp, listens[i].timestamp)
 
+    def test_add_and_get_feed_listens(self):
+        self._redis.feed_listens_max = 3
+        follower = db_user.get_or_create(2, "follower")
+        t = int(time.time())
+        listens = [Listen(user_id=self.testuser['id'], user_name=self.testuser['musicbrainz_id'], timestamp=t - i,
+                          data={'artist_name': 'The Strokes', 'track_name': 'Track %d' % i, 'additional_info': {}})
+                   for i in range(5)]
+
+        # without a feed, the listens have to be queried
+        self.assertIsNone(self._redis.get_feed_listens(follower['id'], t - 10, t + 1, 2))
+
+        self._redis.add_listens_to_feeds(listens[:2], {self.testuser['id']: [follower['id']]}, t - 5)
+        self.assertEqual(self._redis.get_feed_listens(follower['id'], t - 5, t + 1, 5), [
+            (t, 'test', 'Track 0'),
+            (t - 1, 'test', 'Track 1'),
+        ])
+        # the feed doesn't hold the listens before it was started, unless the page is full
+        self.assertIsNone(self._redis.get_feed_listens(follower['id'], t - 10, t + 1, 5))
+        self.assertEqual(self._redis.get_feed_listens(follower['id'], t - 10, t + 1, 1), [(t, 'test', 'Track 0')])
+
+        # listens of users nobody follows aren't stored, and the feed is trimmed to its max size
+        self._redis.add_listens_to_feeds(listens[2:], {}, t)
+        self._redis.add_listens_to_feeds(listens[2:], {self.testuser['id']: [follower['id']]}, t)
+        self.assertEqual(self._redis.get_feed_listens(follower['id'], t - 10, t + 1, 2), [
+            (t, 'test', 'Track 0'),
+            (t - 1, 'test', 'Track 1'),
+        ])
+        # after trimming, the feed only holds every listen newer than its oldest one
+        self.assertIsNone(self._redis.get_feed_listens(follower['id'], t - 10, t + 1, 3))
+        self.assertIsNone(self._redis.get_feed_listens(follower['id'], t - 5, t + 1, 5))
+
+        self._redis.reset_feed_listens(follower['id'])
+        self.assertIsNone(self._redis.get_feed_listens(follower['id'], t - 3, t + 1, 5))
+
+        # feeds of an earlier generation are not served and are started again
+        self._redis.add_listens_to_feeds(listens[:1], {self.testuser['id']: [follower['id']]}, t - 1)
+        self.assertEqual(self._redis.get_feed_listens(follower['id'], t - 1, t + 1, 5), [(t, 'test', 'Track 0')])
+        self._redis.invalidate_feeds()
+        self.assertIsNone(self._redis.get_feed_listens(follower['id'], t - 1, t + 1, 5))
+        self._redis.add_listens_to_feeds(listens[1:2], {self.testuser['id']: [follower['id']]}, t - 2)
+        self.assertEqual(self._redis.get_feed_listens(follower['id'], t - 2, t + 1, 5), [(t - 1, 'test', 'Track 1')])
+
     def test_incr_listen_count_for_day(self):
         today = datetime.datetime.utcnow()
         # get without setting any value, should return None
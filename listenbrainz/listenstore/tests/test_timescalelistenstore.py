@@ -11,8 +11,10 @@ import tempfile
 import random
 
 import ujson
+import pyarrow.parquet as pq
 import psycopg2
 import sqlalchemy
+from werkzeug.http import http_date
 import listenbrainz.db.user as db_user
 from psycopg2.extras import execute_values
 from listenbrainz.db.testing import DatabaseTestCase
@@ -21,8 +23,11 @@ from listenbrainz import config
 from listenbrainz.listenstore.tests.util import create_test_data_for_timescalelistenstore, generate_data
 from listenbrainz.webserver.timescale_connection import init_timescale_connection
 from listenbrainz.db.dump import SchemaMismatchException
-from listenbrainz.listenstore import LISTENS_DUMP_SCHEMA_VERSION
-from listenbrainz.listenstore.timescale_listenstore import REDIS_USER_LISTEN_COUNT, REDIS_USER_TIMESTAMPS
+from listenbrainz.listenstore import LISTENS_DUMP_SCHEMA_VERSION, RedisListenStore
+from listenbrainz.listenstore.redis_listenstore import set_recent_listens_mbid_mappings
+from listenbrainz.listenstore.timescale_utils import refresh_continuous_aggregates
+from listenbrainz.listenstore.timescale_listenstore import REDIS_USER_LISTEN_COUNT, REDIS_USER_TIMESTAMPS, \
+    REDIS_USER_DATA_LOCK, REDIS_USER_DATA_STALE, LISTEN_JSON_EXPORT
 from brainzutils import cache
 
 TIMESCALE_SQL_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', '..', '..', 'admin', 'timescale')
@@ -107,7 +112,7 @@ class TestTimescaleListenStore(DatabaseTestCase):
         for listen in listens:
             submit.append((*listen.to_timescale(), listen.inserted_timestamp))
 
-        query = """INSERT INTO listen (listened_at, track_name, user_name, data, created)
+        query = """INSERT INTO listen (listened_at, track_name, user_name, data, recording_msid, created)
                         VALUES %s
                    ON CONFLICT (listened_at, track_name, user_name)
                     DO NOTHING
@@ -143,6 +148,42 @@ class TestTimescaleListenStore(DatabaseTestCase):
         listens, min_ts, max_ts = self.logstore.fetch_listens(user_name=self.testuser_name, from_ts=1399999999)
         self.assertEqual(len(listens), count)
 
+    def test_insert_timescale_with_copy(self):
+        test_data = generate_data(self.testuser_id, self.testuser_name, 1400000000, 200)
+        test_data[0].data['release_name'] = ''
+        test_data[1].data['track_name'] = 'quote " comma , newline \n tab \t backslash \\'
+
+        inserted = self.logstore.insert(test_data, use_copy=True)
+        self.assertEqual(len(inserted), 200)
+
+        # inserting the same listens again must not insert duplicates
+        inserted = self.logstore.insert(test_data[:10] + test_data[:10], use_copy=True)
+        self.assertEqual(len(inserted), 0)
+
+        listens, _, _ = self.logstore.fetch_listens(user_name=self.testuser_name, from_ts=1399999999, limit=200)
+        self.assertEqual(len(listens), 200)
+        self.assertEqual(listens[-1].data['release_name'], '')
+        self.assertEqual(listens[-2].data['track_name'], 'quote " comma , newline \n tab \t backslash \\')
+
+    def test_insert_timescale_with_values_returns_all_pages(self):
+        test_data = generate_data(self.testuser_id, self.testuser_name, 1400000000, 250)
+        inserted = self.logstore.insert(test_data, use_copy=False)
+        self.assertEqual(len(inserted), 250)
+
+    def test_insert_timescale_sets_recording_msid(self):
+        test_data = generate_data(self.testuser_id, self.testuser_name, 1400000000, 4)
+        self.logstore.insert(test_data[:2], use_copy=False)
+        self.logstore.insert(test_data[2:], use_copy=True)
+
+        with ts.engine.connect() as connection:
+            result = connection.execute(sqlalchemy.text("""
+                SELECT recording_msid::TEXT
+                  FROM listen
+                 WHERE user_name = :user_name
+                   AND recording_msid::TEXT = data->'track_metadata'->'additional_info'->>'recording_msid'
+            """), user_name=self.testuser_name)
+            self.assertCountEqual([row[0] for row in result], [listen.recording_msid for listen in test_data])
+
     def test_fetch_listens_0(self):
         self._create_test_data(self.testuser_name)
         listens, min_ts, max_ts = self.logstore.fetch_listens(user_name=self.testuser_name, from_ts=1400000000, limit=1)
@@ -215,6 +256,35 @@ class TestTimescaleListenStore(DatabaseTestCase):
         self.assertEqual(listens[2].ts_since_epoch, 1400000050)
         self.assertEqual(listens[3].ts_since_epoch, 1400000000)
 
+    def test_fetch_listens_with_gaps_and_limit(self):
+        self._create_test_data(self.testuser_name,
+                               test_data_file_name='timescale_listenstore_test_listens_over_greater_time_range.json')
+
+        # the chunk counts limit the range to the chunk holding the two newest listens
+        listens, _, _ = self.logstore.fetch_listens(user_name=self.testuser_name, to_ts=1420000051, limit=2)
+        self.assertEqual([l.ts_since_epoch for l in listens], [1420000050, 1420000000])
+
+        listens, _, _ = self.logstore.fetch_listens(user_name=self.testuser_name, from_ts=1400000000, limit=2)
+        self.assertEqual([l.ts_since_epoch for l in listens], [1420000000, 1400000050])
+
+        # listens which are not counted in listen_user_chunk_count are still found
+        with ts.engine.connect() as connection:
+            connection.execute(sqlalchemy.text("DELETE FROM listen_user_chunk_count"))
+        listens, _, _ = self.logstore.fetch_listens(user_name=self.testuser_name, to_ts=1420000051, limit=3)
+        self.assertEqual([l.ts_since_epoch for l in listens], [1420000050, 1420000000, 1400000050])
+
+    def test_chunk_counts(self):
+        self._create_test_data(self.testuser_name)
+        query = "SELECT chunk_start, count FROM listen_user_chunk_count WHERE user_name = :user_name"
+        with ts.engine.connect() as connection:
+            rows = connection.execute(sqlalchemy.text(query), user_name=self.testuser_name).fetchall()
+        self.assertEqual([tuple(row) for row in rows], [(1399680000, 5)])
+
+        self.logstore.delete_listen(1400000050, self.testuser_name, "c7a41965-9f1e-456c-8b1d-27c0f0dde280")
+        with ts.engine.connect() as connection:
+            rows = connection.execute(sqlalchemy.text(query), user_name=self.testuser_name).fetchall()
+        self.assertEqual([tuple(row) for row in rows], [(1399680000, 4)])
+
     def test_fetch_listens_with_mapping(self):
         self._create_test_data(self.testuser_name)
         self._insert_mapping_metadata("c7a41965-9f1e-456c-8b1d-27c0f0dde280")
@@ -224,6 +294,29 @@ class TestTimescaleListenStore(DatabaseTestCase):
         self.assertEqual(listens[0].data["mbid_mapping"]["release_mbid"], '1fd178b4-1575-11ec-b98a-d72392cd8c97')
         self.assertEqual(listens[0].data["mbid_mapping"]["recording_mbid"], '076255b4-1575-11ec-ac84-135bf6a670e3')
 
+    def test_fetch_listens_as_json(self):
+        self._create_test_data(self.testuser_name)
+        self._insert_mapping_metadata("c7a41965-9f1e-456c-8b1d-27c0f0dde280")
+        listens, _, _ = self.logstore.fetch_listens(user_name=self.testuser_name, to_ts=1400000300)
+        listens_json, _, _ = self.logstore.fetch_listens(user_name=self.testuser_name, to_ts=1400000300, as_json=True)
+        self.assertEqual(len(listens_json), 5)
+
+        for listen, listen_json in zip(listens, listens_json):
+            expected = listen.to_api()
+            # like jsonify writes the datetime
+            expected["inserted_at"] = http_date(expected["inserted_at"])
+            self.assertDictEqual(ujson.loads(listen_json), expected)
+
+        # the export has inserted_at in seconds since epoch instead
+        listens_json, _, _ = self.logstore.fetch_listens(user_name=self.testuser_name, to_ts=1400000300,
+                                                         as_json=LISTEN_JSON_EXPORT)
+        for listen, listen_json in zip(listens, listens_json):
+            self.assertEqual(ujson.loads(listen_json)["inserted_at"], int(listen.inserted_timestamp.timestamp()))
+
+        recent = self.logstore.fetch_recent_listens_for_users([self.testuser_name], limit=1,
+                                                              max_age=10000000000, as_json=True)
+        self.assertEqual(ujson.loads(recent[0])["listened_at"], 1400000200)
+
     def test_get_listen_count_for_user(self):
         uid = random.randint(2000, 1 << 31)
         testuser = db_user.get_or_create(uid, "user_%d" % uid)
@@ -233,6 +326,47 @@ class TestTimescaleListenStore(DatabaseTestCase):
         listen_count = self.logstore.get_listen_count_for_user(user_name=testuser_name)
         self.assertEqual(count, listen_count)
 
+    def test_select_single_timestamp(self):
+        self._create_test_data(self.testuser_name)
+        self.assertEqual(self.logstore._select_single_timestamp(True, self.testuser_name), 1400000000)
+        self.assertEqual(self.logstore._select_single_timestamp(False, self.testuser_name), 1400000200)
+        self.assertEqual(self.logstore._select_single_timestamp(True, "nonexistent-user"), 0)
+
+    def test_select_single_timestamp_stale_aggregate(self):
+        self._create_test_data(self.testuser_name)
+        refresh_continuous_aggregates(0, int(time()))
+        # listens in buckets the aggregate has already materialized, one in a chunk before the
+        # aggregate's min and one in the chunk of its max
+        self.logstore.insert(generate_data(self.testuser_id, self.testuser_name, 1300000000, 1))
+        self.logstore.insert(generate_data(self.testuser_id, self.testuser_name, 1400000300, 1))
+        self.assertEqual(self.logstore._select_single_timestamp(True, self.testuser_name), 1300000000)
+        self.assertEqual(self.logstore._select_single_timestamp(False, self.testuser_name), 1400000300)
+
+    def test_get_timestamps_for_users(self):
+        self._create_test_data(self.testuser_name)
+        self._create_test_data("cached-user")
+        cache.delete(REDIS_USER_TIMESTAMPS + self.testuser_name)
+        timestamps = self.logstore.get_timestamps_for_users([self.testuser_name, "cached-user", "nonexistent-user"])
+        self.assertEqual(timestamps, {
+            self.testuser_name: (1400000000, 1400000200),
+            "cached-user": (1400000000, 1400000200),
+            "nonexistent-user": (0, 0),
+        })
+
+    def test_listen_count_recalculation_serves_stale(self):
+        count = self._create_test_data(self.testuser_name)
+        key = REDIS_USER_LISTEN_COUNT + self.testuser_name
+        cache.delete(key)
+        cache.set(REDIS_USER_DATA_STALE + key, 3, expirein=0, encode=False)
+
+        # another process is recalculating the listen count, so the stale value is served
+        cache.set(REDIS_USER_DATA_LOCK + key, 1, expirein=0)
+        self.assertEqual(self.logstore.get_listen_count_for_user(self.testuser_name), 3)
+
+        cache.delete(REDIS_USER_DATA_LOCK + key)
+        self.assertEqual(self.logstore.get_listen_count_for_user(self.testuser_name), count)
+        self.assertEqual(int(cache.get(REDIS_USER_DATA_STALE + key, decode=False)), count)
+
     def test_fetch_recent_listens(self):
         user = db_user.get_or_create(2, 'someuser')
         user_name = user['musicbrainz_id']
@@ -253,6 +387,50 @@ class TestTimescaleListenStore(DatabaseTestCase):
         self.assertEqual(len(recent), 1)
         self.assertEqual(recent[0].ts_since_epoch, 1400000200)
 
+    def test_fetch_recent_listens_from_redis(self):
+        redis_store = RedisListenStore(self.log, {
+            'REDIS_HOST': config.REDIS_HOST,
+            'REDIS_PORT': config.REDIS_PORT,
+            'REDIS_NAMESPACE': config.REDIS_NAMESPACE,
+            'USER_RECENT_LISTENS_MAX': 3,
+        })
+        self.logstore.user_recent_listens_max = 3
+        now = int(time())
+        cached_user = db_user.get_or_create(2, 'cacheduser')['musicbrainz_id']
+        listens = generate_data(2, cached_user, now - 100, 5)
+        self.logstore.insert(listens)
+        redis_store.update_recent_listens(listens)
+        self._create_test_data(self.testuser_name)
+        mbid_mapping = {
+            "recording_mbid": "2f3d422f-8890-41a1-9762-fbe16f107c31",
+            "release_mbid": "76df3287-6cda-33eb-8e9a-044b5e15ffdd",
+            "artist_mbids": ["8f6bd1e4-fbe1-4f50-aa9b-94c450ec0f11"],
+        }
+        set_recent_listens_mbid_mappings({listens[4].recording_msid: mbid_mapping})
+
+        # the listens of users without enough recent listens in redis come from the listen table
+        recent = self.logstore.fetch_recent_listens_for_users([cached_user, self.testuser_name], limit=2,
+                                                              max_age=now - 1400000000)
+        self.assertEqual([(l.user_name, l.ts_since_epoch) for l in recent], [
+            (cached_user, now - 96), (cached_user, now - 97),
+            (self.testuser_name, 1400000200), (self.testuser_name, 1400000150),
+        ])
+
+        # the 3 most recent listens kept in redis fill the limit
+        recent = self.logstore.fetch_recent_listens_for_users([cached_user], limit=3, max_age=1000, as_json=True)
+        recent = [ujson.loads(l) for l in recent]
+        self.assertEqual([l["listened_at"] for l in recent], [now - 96, now - 97, now - 98])
+        self.assertTrue(recent[0]["inserted_at"].endswith(" GMT"))
+        # the MBID mapping added by the mbid mapping writer is included
+        self.assertEqual(recent[0]["track_metadata"]["mbid_mapping"], mbid_mapping)
+        self.assertNotIn("mbid_mapping", recent[1]["track_metadata"])
+
+        recent = self.logstore.fetch_recent_listens_for_users([cached_user], limit=1, max_age=1000)
+        self.logstore.delete_listen(now - 96, cached_user, recent[0].recording_msid)
+        # redis only has 2 listens left, so they come from the listen table
+        recent = self.logstore.fetch_recent_listens_for_users([cached_user], limit=3, max_age=1000)
+        self.assertEqual([l.ts_since_epoch for l in recent], [now - 97, now - 98, now - 99])
+
     def test_dump_listens(self):
         self._create_test_data(self.testuser_name)
         temp_dir = tempfile.mkdtemp()
@@ -338,6 +516,87 @@ class TestTimescaleListenStore(DatabaseTestCase):
         self.assertEqual(listens[4].ts_since_epoch, 1400000000)
         shutil.rmtree(temp_dir)
 
+    def test_dump_listens_for_spark(self):
+        self._create_test_data(self.testuser_name)
+        self._insert_mapping_metadata("c7a41965-9f1e-456c-8b1d-27c0f0dde280")
+        temp_dir = tempfile.mkdtemp()
+        dump_location = self.logstore.dump_listens_for_spark(temp_dir, dump_id=1, end_time=datetime.now())
+
+        with tarfile.open(dump_location) as tar:
+            members = [member for member in tar.getmembers() if member.name.endswith(".parquet")]
+            self.assertEqual(len(members), 1)
+            table = pq.read_table(tar.extractfile(members[0]))
+
+        self.assertEqual(table.to_pylist(), [{
+            'listened_at': datetime.utcfromtimestamp(1400000050),
+            'user_name': self.testuser_name,
+            'artist_name': 'artist name',
+            'artist_credit_id': 65,
+            'release_name': None,
+            'release_mbid': '1fd178b4-1575-11ec-b98a-d72392cd8c97',
+            'recording_name': 'recording name',
+            'recording_mbid': '076255b4-1575-11ec-ac84-135bf6a670e3',
+            'artist_credit_mbids': ['6a221fda-2200-11ec-ac7d-dfa16a57158f'],
+        }])
+        shutil.rmtree(temp_dir)
+
+    def test_import_listens_written_in_process(self):
+        """ Dumps written without worker processes are the same as the ones written with them """
+        self._create_test_data(self.testuser_name)
+        temp_dir = tempfile.mkdtemp()
+        dump_location = self.logstore.dump_listens(
+            location=temp_dir,
+            dump_id=1,
+            end_time=datetime.now(),
+            threads=1,
+        )
+        self.reset_timescale_db()
+        self.logstore.import_listens_dump(dump_location)
+        listens, min_ts, max_ts = self.logstore.fetch_listens(user_name=self.testuser_name, to_ts=1400000300)
+        self.assertEqual([listen.ts_since_epoch for listen in listens],
+                         [1400000200, 1400000150, 1400000100, 1400000050, 1400000000])
+        shutil.rmtree(temp_dir)
+
+    def test_import_listens_parallel(self):
+        self._create_test_data(self.testuser_name)
+        temp_dir = tempfile.mkdtemp()
+        dump_location = self.logstore.dump_listens(
+            location=temp_dir,
+            dump_id=1,
+            end_time=datetime.now(),
+        )
+        self.reset_timescale_db()
+        imported = self.logstore.import_listens_dump(dump_location, threads=2, parallel=True)
+        self.assertEqual(imported, 5)
+
+        # the user data is recalculated once after the import
+        self.assertEqual(self.logstore.get_listen_count_for_user(self.testuser_name), 5)
+        self.assertEqual(self.logstore.get_timestamps_for_user(self.testuser_name), (1400000000, 1400000200))
+        listens, min_ts, max_ts = self.logstore.fetch_listens(user_name=self.testuser_name, to_ts=1400000300)
+        self.assertEqual(len(listens), 5)
+        shutil.rmtree(temp_dir)
+
+    def test_import_listens_parallel_refreshes_aggregates(self):
+        self._create_test_data(self.testuser_name)
+        temp_dir = tempfile.mkdtemp()
+        dump_location = self.logstore.dump_listens(
+            location=temp_dir,
+            dump_id=1,
+            end_time=datetime.now(),
+        )
+        self.reset_timescale_db()
+        # materialize the empty aggregates, their policies won't refresh the old buckets of the imported listens
+        refresh_continuous_aggregates(0, int(time()))
+        self.assertEqual(self.logstore._select_listen_count(self.testuser_name), 0)
+
+        self.logstore.import_listens_dump(dump_location, threads=2, parallel=True)
+
+        self.assertEqual(self.logstore._select_listen_count(self.testuser_name), 5)
+        self.assertEqual(self.logstore._select_timestamps(self.testuser_name), "1400000000,1400000200")
+        self.assertEqual(self.logstore.get_listen_count_for_user(self.testuser_name), 5)
+        self.assertEqual(self.logstore.get_timestamps_for_user(self.testuser_name), (1400000000, 1400000200))
+        shutil.rmtree(temp_dir)
+
     def test_dump_and_import_listens_escaped(self):
         user = db_user.get_or_create(3, 'i have a\\weird\\user, na/me"\n')
         self._create_test_data(user['musicbrainz_id'])
@@ -441,6 +700,24 @@ class TestTimescaleListenStore(DatabaseTestCase):
         self.logstore.insert(batch)
         self.assertEqual(count + 1, int(cache.get(user_key, decode=False) or 0))
 
+    def test_user_data_in_cache_for_multiple_users(self):
+        """ Inserting a batch with listens of several users updates the counts and timestamps of each user """
+        user_1 = db_user.get_or_create(random.randint(2000, 1 << 31), "user_1")['musicbrainz_id']
+        user_2 = db_user.get_or_create(random.randint(2000, 1 << 31), "user_2")['musicbrainz_id']
+        # user_1 already has a cached entry without listens, user_2 has nothing cached
+        self.logstore.set_empty_cache_values_for_user(user_1)
+
+        batch = generate_data(1, user_1, 1400000000, 3) + generate_data(2, user_2, 1500000000, 2)
+        self.logstore.insert(batch)
+
+        self.assertEqual(3, int(cache.get(REDIS_USER_LISTEN_COUNT + user_1, decode=False)))
+        self.assertEqual(2, int(cache.get(REDIS_USER_LISTEN_COUNT + user_2, decode=False)))
+        self.assertEqual((1400000000, 1400000002), self.logstore.get_timestamps_for_user(user_1))
+        self.assertEqual((1500000000, 1500000001), self.logstore.get_timestamps_for_user(user_2))
+
+        self.logstore.insert(generate_data(1, user_1, 1300000000, 1))
+        self.assertEqual((1300000000, 1400000002), self.logstore.get_timestamps_for_user(user_1))
+
     def test_delete_listens(self):
         uid = random.randint(2000, 1 << 31)
         testuser = db_user.get_or_create(uid, "user_%d" % uid)
@@ -484,6 +761,18 @@ class TestTimescaleListenStore(DatabaseTestCase):
         self.assertEqual(min_ts, 1400000000)
         self.assertEqual(max_ts, 1400000200)
 
+    def test_cached_listens_page_invalidation(self):
+        self.logstore.set_cached_listens_page(self.testuser_name, 25, "page")
+        self.assertEqual(self.logstore.get_cached_listens_page(self.testuser_name, 25), b"page")
+        self.assertIsNone(self.logstore.get_cached_listens_page(self.testuser_name, 10))
+
+        self._create_test_data(self.testuser_name)
+        self.assertIsNone(self.logstore.get_cached_listens_page(self.testuser_name, 25))
+
+        self.logstore.set_cached_listens_page(self.testuser_name, 25, "page")
+        self.logstore.delete_listen(1400000050, self.testuser_name, "c7a41965-9f1e-456c-8b1d-27c0f0dde280")
+        self.assertIsNone(self.logstore.get_cached_listens_page(self.testuser_name, 25))
+
     def test_for_empty_timestamps(self):
         """
             Even if a user has no listens they should have the sentinel timestamps of 0,0 stored in the
@@ -1,5 +1,8 @@
 # coding=utf-8
 
+import csv
+import io
+import multiprocessing
 import os
 import subprocess
 import tarfile
@@ -15,21 +18,20 @@ from psycopg2.extras import execute_values
 from psycopg2.errors import UntranslatableCharacter
 from typing import List
 import sqlalchemy
-import pandas as pd
 import pyarrow as pa
 import pyarrow.parquet as pq
-import numpy as np
 
-from brainzutils import cache
+from brainzutils import cache, metrics
 
 import listenbrainz.db.user as db_user
 from listenbrainz.db import timescale
 from listenbrainz import DUMP_LICENSE_FILE_PATH
-from listenbrainz.db import DUMP_DEFAULT_THREAD_COUNT
+from listenbrainz.db import DUMP_DEFAULT_THREAD_COUNT, stream_query
 from listenbrainz.db.dump import SchemaMismatchException
-from listenbrainz.listen import Listen
+from listenbrainz.listen import Listen, LazyListen
 from listenbrainz.listenstore import ListenStore
 from listenbrainz.listenstore import ORDER_ASC, ORDER_TEXT, LISTENS_DUMP_SCHEMA_VERSION
+from listenbrainz.listenstore.redis_listenstore import RedisListenStore, get_recent_listens_mbid_mappings
 from listenbrainz.utils import create_path, init_cache
 from listenbrainz import config
 
@@ -39,26 +41,133 @@ REDIS_USER_TIMESTAMPS = "ts."
 REDIS_TOTAL_LISTEN_COUNT = "lc-total"
 REDIS_POST_IMPORT_LISTEN_COUNT_EXPIRY = 86400  # 24 hours
 
+# Redis hash of the serialized latest listens page of a user, keyed on the number of listens
+# in the page. Append the user name. The hash is deleted whenever listens of the user are
+# inserted or deleted, the expiry bounds how long a page can miss mapping updates.
+REDIS_USER_LISTENS_PAGE = "lp."
+USER_LISTENS_PAGE_CACHE_EXPIRY = 300  # 5 minutes
+
+# Only one process at a time recalculates a missing listen count or timestamps key, it holds a
+# lock key with this prefix prepended to the key being recalculated. Meanwhile other processes
+# serve the stale copy of the key, which has this prefix prepended, or wait for the new value.
+REDIS_USER_DATA_LOCK = "lock."
+REDIS_USER_DATA_STALE = "stale."
+USER_DATA_LOCK_TIMEOUT = 60  # seconds
+USER_DATA_LOCK_WAIT = 2  # seconds
+USER_DATA_LOCK_POLL_INTERVAL = 0.05  # seconds
+USER_DATA_STALE_EXPIRY = 604800  # 7 days
+
+# Redis script to update the listen counts and timestamps of a batch of users atomically
+# and drop their cached listens pages. KEYS holds the listen count key, the timestamps key
+# and the listens page key of each user, ARGV holds the number of inserted listens, min and
+# max listened_at of each user in the same order. The timestamps are msgpack encoded
+# "min_ts,max_ts" strings, as written by brainzutils cache. Returns the 0 based indexes of
+# the users whose timestamps are not cached.
+UPDATE_USER_DATA_SCRIPT = """
+local missing = {}
+for i = 1, #KEYS / 3 do
+    local count = tonumber(ARGV[3 * i - 2])
+    local min_ts = tonumber(ARGV[3 * i - 1])
+    local max_ts = tonumber(ARGV[3 * i])
+
+    redis.call('INCRBY', KEYS[3 * i - 2], count)
+    redis.call('DEL', KEYS[3 * i])
+
+    local packed = redis.call('GET', KEYS[3 * i - 1])
+    if packed then
+        local cached_min, cached_max = string.match(cmsgpack.unpack(packed), '(%d+),(%d+)')
+        cached_min = tonumber(cached_min)
+        cached_max = tonumber(cached_max)
+        -- a min timestamp of 0 means that the user has no listens yet
+        if min_ts < cached_min or cached_min == 0 or max_ts > cached_max then
+            if min_ts < cached_min or cached_min == 0 then
+                cached_min = min_ts
+            end
+            if max_ts > cached_max then
+                cached_max = max_ts
+            end
+            redis.call('SET', KEYS[3 * i - 1], cmsgpack.pack(string.format('%d,%d', cached_min, cached_max)))
+        end
+    else
+        table.insert(missing, i - 1)
+    end
+end
+return missing
+"""
+
+# The columns a Listen is created from with Listen.from_timescale
+LISTEN_COLUMNS = "listened_at, track_name, user_name, created, data, recording_mbid, release_mbid, artist_mbids"
+
+# The values of the as_json argument of the fetch methods, for the JSON of listens in API responses,
+# which serialize inserted_at like jsonify as an HTTP date, and in the listens export, which
+# serializes it like ujson as seconds since epoch. True is the same as LISTEN_JSON_API.
+LISTEN_JSON_API = "api"
+LISTEN_JSON_EXPORT = "export"
+
+# Builds the same JSON as Listen.from_timescale(*LISTEN_COLUMNS).to_api() in the database, so that
+# responses can be assembled from the rows without creating Listen objects
+LISTEN_JSON_TEMPLATE = """jsonb_build_object(
+                        'listened_at', listened_at,
+                        'recording_msid', data->'track_metadata'->'additional_info'->'recording_msid',
+                        'user_name', user_name,
+                        'inserted_at', %s,
+                        'track_metadata', data->'track_metadata'
+                                          || jsonb_build_object('track_name', track_name)
+                                          || CASE WHEN recording_mbid IS NULL THEN '{}'::jsonb
+                                                  ELSE jsonb_build_object('mbid_mapping', jsonb_build_object(
+                                                        'recording_mbid', recording_mbid,
+                                                        'release_mbid', release_mbid,
+                                                        'artist_mbids', artist_mbids))
+                                              END
+                     )::TEXT"""
+LISTEN_API_JSON = LISTEN_JSON_TEMPLATE % \
+    """COALESCE(to_jsonb(to_char(created AT TIME ZONE 'UTC', 'Dy, DD Mon YYYY HH24:MI:SS "GMT"')), '0'::jsonb)"""
+LISTEN_EXPORT_JSON = LISTEN_JSON_TEMPLATE % "COALESCE(extract(epoch from created)::BIGINT, 0)"
+
+
+def _listen_columns(as_json):
+    """ Return the columns to select for listens returned as the as_json argument of the fetch methods asks """
+    if not as_json:
+        return LISTEN_COLUMNS
+    if as_json == LISTEN_JSON_EXPORT:
+        return LISTEN_EXPORT_JSON
+    return LISTEN_API_JSON
+
 DUMP_CHUNK_SIZE = 100000
+DUMP_FETCH_SIZE = 10000  # rows fetched from the server side cursor at a time when writing dumps
 NUMBER_OF_USERS_PER_DIRECTORY = 1000
 DUMP_FILE_SIZE_LIMIT = 1024 * 1024 * 1024  # 1 GB
 DATA_START_YEAR = 2005
 DATA_START_YEAR_IN_SECONDS = 1104537600
 
-# How many listens to fetch on the first attempt. If we don't fetch enough, increase it by WINDOW_SIZE_MULTIPLIER
-DEFAULT_FETCH_WINDOW = 30 * 86400  # 30 days
-
-# When expanding the search, how fast should the bounds be moved out
-WINDOW_SIZE_MULTIPLIER = 3
+# The time span covered by a row of listen_user_chunk_count, same as the chunk interval of the listen hypertable
+LISTEN_CHUNK_SIZE = 432000  # 5 days
 
 LISTEN_COUNT_BUCKET_WIDTH = 2592000
 
-# These values are defined to create spark parquet files that are at most 128MB in size.
-# This compression ration allows us to roughly estimate how full we can make files before starting a new one
-PARQUET_APPROX_COMPRESSION_RATIO = .57
+# Batches of at least this many listens are inserted with COPY instead of a multi row INSERT
+COPY_INSERT_THRESHOLD = 1000
+
+# The max size of a spark parquet file. Files are written a row group of PARQUET_FETCH_SIZE listens
+# at a time, a new file is started when the next row group, estimated to be as large as the previous
+# one, would make the file exceed this.
+PARQUET_TARGET_SIZE = 134217728  # 128MB
 
-# This is the approximate amount of data to write to a parquet file in order to meet the max size
-PARQUET_TARGET_SIZE = 134217728 / PARQUET_APPROX_COMPRESSION_RATIO  # 128MB / compression ratio
+# The number of listens fetched from the database and written to a parquet row group at a time
+PARQUET_FETCH_SIZE = 100000
+
+# The columns of the spark parquet files
+PARQUET_SCHEMA = pa.schema([
+    ('listened_at', pa.timestamp('us')),
+    ('user_name', pa.string()),
+    ('artist_name', pa.string()),
+    ('artist_credit_id', pa.int64()),
+    ('release_name', pa.string()),
+    ('release_mbid', pa.string()),
+    ('recording_name', pa.string()),
+    ('recording_mbid', pa.string()),
+    ('artist_credit_mbids', pa.list_(pa.string())),
+])
 
 
 class TimescaleListenStore(ListenStore):
@@ -69,11 +178,15 @@ class TimescaleListenStore(ListenStore):
     def __init__(self, conf, logger):
         super(TimescaleListenStore, self).__init__(logger)
 
-        timescale.init_db_connection(conf['SQLALCHEMY_TIMESCALE_URI'])
+        self.timescale_uri = conf['SQLALCHEMY_TIMESCALE_URI']
+        timescale.init_db_connection(self.timescale_uri, pool_prefix="TIMESCALE")
 
         # Initialize brainzutils cache
         init_cache(host=conf['REDIS_HOST'], port=conf['REDIS_PORT'],
                    namespace=conf['REDIS_NAMESPACE'])
+        self.update_user_data_script = cache._r.register_script(UPDATE_USER_DATA_SCRIPT)
+        # the number of recent listens of each user kept by RedisListenStore, 0 if it doesn't
+        self.user_recent_listens_max = conf.get('USER_RECENT_LISTENS_MAX', 0)
         self.dump_temp_dir_root = conf.get(
             'LISTEN_DUMP_TEMP_DIR_ROOT', tempfile.mkdtemp())
 
@@ -81,8 +194,8 @@ class TimescaleListenStore(ListenStore):
         """When a user is created, set the listen_count and timestamp keys so that we
            can avoid the expensive lookup for a brand new user."""
 
-        cache.set(REDIS_USER_LISTEN_COUNT + user_name, 0, expirein=0, encode=False)
-        cache.set(REDIS_USER_TIMESTAMPS + user_name, "0,0", expirein=0)
+        self._set_user_data(REDIS_USER_LISTEN_COUNT + user_name, 0, encode=False)
+        self._set_user_data(REDIS_USER_TIMESTAMPS + user_name, "0,0")
 
     def get_listen_count_for_user(self, user_name):
         """Get the total number of listens for a user. The number of listens comes from
@@ -94,9 +207,9 @@ class TimescaleListenStore(ListenStore):
 
         count = cache.get(REDIS_USER_LISTEN_COUNT + user_name, decode=False)
         if count is None:
-            return self.reset_listen_count(user_name)
-        else:
-            return int(count)
+            count = self._recalculate_single_flight(REDIS_USER_LISTEN_COUNT + user_name,
+                                                    lambda: self._select_listen_count(user_name), encode=False)
+        return int(count)
 
     def reset_listen_count(self, user_name):
         """ Reset the listen count of a user from cache and put in a new calculated value.
@@ -105,6 +218,13 @@ class TimescaleListenStore(ListenStore):
             Args:
                 user_name: the musicbrainz id of user whose listen count needs to be reset
         """
+        count = self._select_listen_count(user_name)
+        self._set_user_data(REDIS_USER_LISTEN_COUNT + user_name, count, encode=False)
+        return count
+
+    def _select_listen_count(self, user_name):
+        """ Calculate the listen count of a user from the listen_count_30day aggregate """
+
         query = "SELECT SUM(count) FROM listen_count_30day WHERE user_name = :user_name"
         t0 = time.monotonic()
         try:
@@ -121,11 +241,51 @@ class TimescaleListenStore(ListenStore):
 
         # intended for production monitoring
         self.log.info("listen counts %s %.2fs" % (user_name, time.monotonic() - t0))
-        # put this value into brainzutils cache without an expiry time
-        cache.set(REDIS_USER_LISTEN_COUNT + user_name,
-                  count, expirein=0, encode=False)
         return count
 
+    def _set_user_data(self, key, value, encode=True):
+        """ Put a recalculated listen count or timestamps value into brainzutils cache without an
+            expiry time, along with the stale copy which is served while it is recalculated.
+        """
+        cache.set(key, value, expirein=0, encode=encode)
+        cache.set(REDIS_USER_DATA_STALE + key, value, expirein=USER_DATA_STALE_EXPIRY, encode=encode)
+
+    def _recalculate_single_flight(self, key, recalculate, encode=True):
+        """ Recalculate the value of a missing listen count or timestamps key, making sure that only
+            one process recalculates it at a time.
+
+            If another process holds the lock, the stale copy of the key is returned if there is one.
+            Otherwise this waits up to USER_DATA_LOCK_WAIT seconds for the other process to store the
+            value, and recalculates it without the lock if it doesn't.
+
+            Args:
+                key: the brainzutils cache key to recalculate
+                recalculate: a function without arguments that returns the value of the key
+                encode: whether the value is msgpack encoded in the cache
+        """
+
+        lock_key = cache._prep_key(REDIS_USER_DATA_LOCK + key)
+        if cache._r.set(lock_key, 1, nx=True, ex=USER_DATA_LOCK_TIMEOUT):
+            try:
+                value = recalculate()
+                self._set_user_data(key, value, encode=encode)
+            finally:
+                cache._r.delete(lock_key)
+            return value
+
+        value = cache.get(REDIS_USER_DATA_STALE + key, decode=encode)
+        if value is not None:
+            return value
+
+        deadline = time.monotonic() + USER_DATA_LOCK_WAIT
+        while time.monotonic() < deadline:
+            time.sleep(USER_DATA_LOCK_POLL_INTERVAL)
+            value = cache.get(key, decode=encode)
+            if value is not None:
+                return value
+
+        return recalculate()
+
     def set_listen_count_expiry_for_user(self, user_name):
         """ Set an expire time for the listen count cache item. This is called after
             a bulk import which allows for timescale continuous aggregates to catch up
@@ -135,7 +295,15 @@ class TimescaleListenStore(ListenStore):
             Args:
                 user_name: the musicbrainz id of user whose listen count needs an expiry time
         """
-        cache._r.expire(cache._prep_key(REDIS_USER_LISTEN_COUNT + user_name), REDIS_POST_IMPORT_LISTEN_COUNT_EXPIRY)
+        key = cache._prep_key(REDIS_USER_LISTEN_COUNT + user_name)
+        count = cache._r.get(key)
+        pipe = cache._r.pipeline()
+        if count is not None:
+            # keep the current count around to be served while the expired key is recalculated
+            pipe.set(cache._prep_key(REDIS_USER_DATA_STALE + REDIS_USER_LISTEN_COUNT + user_name),
+                     count, ex=USER_DATA_STALE_EXPIRY)
+        pipe.expire(key, REDIS_POST_IMPORT_LISTEN_COUNT_EXPIRY)
+        pipe.execute()
 
     def update_timestamps_for_user(self, user_name, min_ts, max_ts):
         """
@@ -147,8 +315,9 @@ class TimescaleListenStore(ListenStore):
         """
 
         cached_min_ts, cached_max_ts = self.get_timestamps_for_user(user_name)
-        if min_ts < cached_min_ts or max_ts > cached_max_ts:
-            if min_ts < cached_min_ts:
+        if min_ts < cached_min_ts or max_ts > cached_max_ts or cached_min_ts == 0:
+            # A min timestamp of 0 means that the user has no listens yet
+            if min_ts < cached_min_ts or cached_min_ts == 0:
                 cached_min_ts = min_ts
             if max_ts > cached_max_ts:
                 cached_max_ts = max_ts
@@ -165,15 +334,64 @@ class TimescaleListenStore(ListenStore):
             min_ts = int(min_ts)
             max_ts = int(max_ts)
         else:
-            t0 = time.monotonic()
-            min_ts = self._select_single_timestamp(True, user_name)
-            max_ts = self._select_single_timestamp(False, user_name)
-            cache.set(REDIS_USER_TIMESTAMPS + user_name, "%d,%d" % (min_ts, max_ts), expirein=0)
-            # intended for production monitoring
-            self.log.info("timestamps %s %.2fs" % (user_name, time.monotonic() - t0))
+            tss = self._recalculate_single_flight(REDIS_USER_TIMESTAMPS + user_name,
+                                                  lambda: self._select_timestamps(user_name))
+            (min_ts, max_ts) = tss.split(",")
+            min_ts = int(min_ts)
+            max_ts = int(max_ts)
 
         return min_ts, max_ts
 
+    def get_timestamps_for_users(self, user_names):
+        """ Return the min_ts and max_ts of each of the given users, with a single redis round trip
+            for the users whose timestamps are cached.
+
+            Returns:
+                a dict of user name to a (min_ts, max_ts) tuple
+        """
+
+        cached = cache.get_many([REDIS_USER_TIMESTAMPS + user_name for user_name in user_names])
+        timestamps = {}
+        for user_name in user_names:
+            tss = cached.get(REDIS_USER_TIMESTAMPS + user_name)
+            if tss:
+                (min_ts, max_ts) = tss.split(",")
+                timestamps[user_name] = (int(min_ts), int(max_ts))
+            else:
+                timestamps[user_name] = self.get_timestamps_for_user(user_name)
+        return timestamps
+
+    def _select_timestamps(self, user_name):
+        """ Calculate the "min_ts,max_ts" timestamps string of a user as stored in brainzutils cache """
+
+        t0 = time.monotonic()
+        min_ts = self._select_single_timestamp(True, user_name)
+        max_ts = self._select_single_timestamp(False, user_name)
+        # intended for production monitoring
+        self.log.info("timestamps %s %.2fs" % (user_name, time.monotonic() - t0))
+        return "%d,%d" % (min_ts, max_ts)
+
+    def get_cached_listens_page(self, user_name, count):
+        """ Return the serialized latest count listens of the user if they are cached, otherwise None """
+
+        return cache._r.hget(cache._prep_key(REDIS_USER_LISTENS_PAGE + user_name), count)
+
+    def set_cached_listens_page(self, user_name, count, page):
+        """ Cache the serialized latest count listens of the user """
+
+        key = cache._prep_key(REDIS_USER_LISTENS_PAGE + user_name)
+        pipe = cache._r.pipeline()
+        pipe.hset(key, count, page)
+        pipe.expire(key, USER_LISTENS_PAGE_CACHE_EXPIRY)
+        pipe.execute()
+
+    def invalidate_cached_listens_pages(self, user_names):
+        """ Drop the cached listens pages of the given users """
+
+        keys = [cache._prep_key(REDIS_USER_LISTENS_PAGE + user_name) for user_name in user_names]
+        if keys:
+            cache._r.delete(*keys)
+
     def _select_single_timestamp(self, select_min_timestamp, user_name):
         """ Fetch a single timestamp (min or max) from the listenstore for a given user.
 
@@ -186,23 +404,48 @@ class TimescaleListenStore(ListenStore):
                 The selected timestamp for the user or 0 if no timestamp was found.
         """
 
-        function = "max"
         if select_min_timestamp:
-            function = "min"
-
-        query = """SELECT %s(listened_at) AS ts
-                     FROM listen
-                     WHERE user_name = :user_name""" % function
+            function, column = "min", "min_listened_at"
+        else:
+            function, column = "max", "max_listened_at"
+
+        # the continuous aggregate has a row per user per 30 day bucket, so this reads a few
+        # hundred rows at most instead of every listen of the user. Buckets older than its refresh
+        # policy can be stale though, e.g. after a dump import, so the listens of the user's first
+        # or last chunk in listen_user_chunk_count, which is exact, are checked beyond its value.
+        aggregate_query = """SELECT %s(%s) AS ts
+                               FROM listen_timestamps_30day
+                              WHERE user_name = :user_name""" % (function, column)
+        chunk_query = """SELECT %s(chunk_start) AS chunk_start
+                           FROM listen_user_chunk_count
+                          WHERE user_name = :user_name
+                            AND count > 0""" % function
+        listen_query = """SELECT %s(listened_at) AS ts
+                            FROM listen
+                           WHERE user_name = :user_name
+                             AND listened_at >= :start_ts
+                             AND listened_at < :end_ts""" % function
         try:
             with timescale.engine.connect() as connection:
-                result = connection.execute(sqlalchemy.text(query), {
-                    "user_name": user_name
-                })
-                row = result.fetchone()
-                if row is None or row['ts'] is None:
+                chunk_start = connection.execute(sqlalchemy.text(chunk_query), user_name=user_name).fetchone()['chunk_start']
+                if chunk_start is None:
                     return 0
 
-                return row['ts']
+                aggregate_ts = connection.execute(sqlalchemy.text(aggregate_query), user_name=user_name).fetchone()['ts']
+                start_ts, end_ts = chunk_start, chunk_start + LISTEN_CHUNK_SIZE
+                if aggregate_ts is not None and start_ts <= aggregate_ts < end_ts:
+                    # only listens beyond the aggregate's value can be missing from it
+                    if select_min_timestamp:
+                        end_ts = aggregate_ts
+                    else:
+                        start_ts = aggregate_ts + 1
+
+                ts = connection.execute(sqlalchemy.text(listen_query), user_name=user_name,
+                                        start_ts=start_ts, end_ts=end_ts).fetchone()['ts']
+                if ts is None:
+                    return aggregate_ts or 0
+
+                return ts
 
         except psycopg2.OperationalError as e:
             self.log.error("Cannot fetch min/max timestamp: %s" %
@@ -235,62 +478,156 @@ class TimescaleListenStore(ListenStore):
             cache.set(REDIS_TOTAL_LISTEN_COUNT, count, expirein=0)
         return count
 
-    def insert(self, listens):
+    def insert(self, listens, use_copy=None):
         """
             Insert a batch of listens. Returns a list of (listened_at, track_name, user_name) that indicates
             which rows were inserted into the DB. If the row is not listed in the return values, it was a duplicate.
+
+            Batches of COPY_INSERT_THRESHOLD or more listens are loaded into a staging table with COPY and
+            inserted from there, smaller batches are inserted with a multi row INSERT. Pass use_copy to
+            force one or the other.
         """
 
         submit = []
         for listen in listens:
             submit.append(listen.to_timescale())
 
-        query = """INSERT INTO listen (listened_at, track_name, user_name, data)
-                        VALUES %s
-                   ON CONFLICT (listened_at, track_name, user_name)
-                    DO NOTHING
-                     RETURNING listened_at, track_name, user_name"""
+        inserted_rows = self._insert_rows(submit, use_copy)
+        if inserted_rows is None:
+            return
+
+        self.update_user_data_for_inserted_rows(inserted_rows)
+
+        return inserted_rows
+
+    @classmethod
+    def _insert_rows(cls, submit, use_copy=None):
+        """ Insert rows as returned by Listen.to_timescale and update the chunk counts, without
+            touching the cached user data. Returns the inserted rows, or None if the batch
+            could not be inserted.
+        """
+
+        if use_copy is None:
+            use_copy = len(submit) >= COPY_INSERT_THRESHOLD
 
-        inserted_rows = []
         conn = timescale.engine.raw_connection()
-        with conn.cursor() as curs:
-            try:
-                execute_values(curs, query, submit, template=None)
-                while True:
-                    result = curs.fetchone()
-                    if not result:
-                        break
-                    inserted_rows.append((result[0], result[1], result[2]))
-            except UntranslatableCharacter:
-                conn.rollback()
-                return
-
-        conn.commit()
-
-        # update the listen counts and timestamps for the users
-        user_timestamps = {}
-        user_counts = defaultdict(int)
+        try:
+            with conn.cursor() as curs:
+                try:
+                    if use_copy:
+                        inserted_rows = cls._insert_with_copy(curs, submit)
+                    else:
+                        inserted_rows = cls._insert_with_values(curs, submit)
+                    cls._update_chunk_counts(curs, inserted_rows)
+                except UntranslatableCharacter:
+                    conn.rollback()
+                    return
+
+            conn.commit()
+        finally:
+            conn.close()
+
+        return inserted_rows
+
+    def update_user_data_for_inserted_rows(self, inserted_rows):
+        """ Update the cached listen counts and timestamps of all users in a batch of inserted
+            (listened_at, track_name, user_name) rows and drop their cached listens pages
+            with a single redis script call.
+        """
+
+        user_data = {}
         for ts, _, user_name in inserted_rows:
-            if listen.user_name in user_timestamps:
-                if ts < user_timestamps[listen.user_name][0]:
-                    user_timestamps[listen.user_name][0] = ts
-                if ts > user_timestamps[listen.user_name][1]:
-                    user_timestamps[listen.user_name][1] = ts
+            if user_name in user_data:
+                data = user_data[user_name]
+                data[0] += 1
+                if ts < data[1]:
+                    data[1] = ts
+                if ts > data[2]:
+                    data[2] = ts
             else:
-                user_timestamps[listen.user_name] = [ts, ts]
+                user_data[user_name] = [1, ts, ts]
 
-            user_counts[user_name] += 1
+        if not user_data:
+            return
 
-        for user_name in user_counts:
-            cache.increment(REDIS_USER_LISTEN_COUNT + user_name, amount=user_counts[user_name])
+        keys = []
+        args = []
+        user_names = list(user_data)
+        for user_name in user_names:
+            keys.append(cache._prep_key(REDIS_USER_LISTEN_COUNT + user_name))
+            keys.append(cache._prep_key(REDIS_USER_TIMESTAMPS + user_name))
+            keys.append(cache._prep_key(REDIS_USER_LISTENS_PAGE + user_name))
+            args.extend(user_data[user_name])
 
-        for user in user_timestamps:
-            self.update_timestamps_for_user(
-                user, user_timestamps[user][0], user_timestamps[user][1])
+        # The script cannot calculate the timestamps of users that aren't cached, do that here
+        for index in self.update_user_data_script(keys=keys, args=args):
+            user_name = user_names[index]
+            self.update_timestamps_for_user(user_name, user_data[user_name][1], user_data[user_name][2])
 
-        return inserted_rows
+    @staticmethod
+    def _insert_with_values(curs, submit):
+        """ Insert rows as returned by Listen.to_timescale with a single multi row INSERT statement. """
+
+        query = """INSERT INTO listen (listened_at, track_name, user_name, data, recording_msid)
+                        VALUES %s
+                   ON CONFLICT (listened_at, track_name, user_name)
+                    DO NOTHING
+                     RETURNING listened_at, track_name, user_name"""
+
+        # page_size covers the whole batch, so that fetch returns the inserted rows of every page
+        return execute_values(curs, query, submit, template=None, page_size=max(len(submit), 1), fetch=True)
+
+    @staticmethod
+    def _insert_with_copy(curs, submit):
+        """ Insert rows as returned by Listen.to_timescale by COPYing them into a temporary staging
+            table and inserting everything from there with one INSERT ... SELECT.
+        """
+
+        curs.execute("""CREATE TEMPORARY TABLE listen_staging (
+                                listened_at     BIGINT,
+                                track_name      TEXT,
+                                user_name       TEXT,
+                                data            JSONB,
+                                recording_msid  UUID
+                        ) ON COMMIT DROP""")
+
+        # QUOTE_NONNUMERIC quotes every string, so that empty strings are not read as NULL.
+        # csv writes a missing recording_msid as "", FORCE_NULL reads that back as NULL.
+        buf = io.StringIO()
+        csv.writer(buf, quoting=csv.QUOTE_NONNUMERIC).writerows(submit)
+        buf.seek(0)
+        curs.copy_expert("""COPY listen_staging (listened_at, track_name, user_name, data, recording_msid)
+                            FROM STDIN WITH (FORMAT csv, FORCE_NULL (recording_msid))""", buf)
+
+        curs.execute("""INSERT INTO listen (listened_at, track_name, user_name, data, recording_msid)
+                             SELECT listened_at, track_name, user_name, data, recording_msid
+                               FROM listen_staging
+                        ON CONFLICT (listened_at, track_name, user_name)
+                         DO NOTHING
+                          RETURNING listened_at, track_name, user_name""")
+        return curs.fetchall()
+
+    @staticmethod
+    def _update_chunk_counts(curs, inserted_rows):
+        """ Add a batch of inserted (listened_at, track_name, user_name) rows to listen_user_chunk_count. """
+
+        counts = defaultdict(int)
+        for listened_at, _, user_name in inserted_rows:
+            counts[(user_name, listened_at - listened_at % LISTEN_CHUNK_SIZE)] += 1
+
+        if not counts:
+            return
+
+        query = """INSERT INTO listen_user_chunk_count (user_name, chunk_start, count)
+                        VALUES %s
+                   ON CONFLICT (user_name, chunk_start)
+                 DO UPDATE SET count = listen_user_chunk_count.count + EXCLUDED.count"""
+
+        # rows are sorted so that concurrent writers lock them in the same order
+        values = sorted((user_name, chunk_start, count) for (user_name, chunk_start), count in counts.items())
+        execute_values(curs, query, values, template=None, page_size=len(values))
 
-    def fetch_listens_from_storage(self, user_name, from_ts, to_ts, limit, order):
+    def fetch_listens_from_storage(self, user_name, from_ts, to_ts, limit, order, as_json=False):
         """ The timestamps are stored as UTC in the postgres datebase while on retrieving
             the value they are converted to the local server's timezone. So to compare
             datetime object we need to create a object in the same timezone as the server.
@@ -302,11 +639,14 @@ class TimescaleListenStore(ListenStore):
             to_ts: seconds since epoch, in float
             limit: the maximum number of items to return
             order: 0 for ASCending order, 1 for DESCending order
+            as_json: return the listens as JSON strings instead of Listen objects, in the format of
+                     LISTEN_JSON_API (or True) or LISTEN_JSON_EXPORT
         """
 
-        return self.fetch_listens_for_multiple_users_from_storage([user_name], from_ts, to_ts, limit, order)
+        return self.fetch_listens_for_multiple_users_from_storage([user_name], from_ts, to_ts, limit, order, as_json)
 
-    def fetch_listens_for_multiple_users_from_storage(self, user_names: List[str], from_ts: float, to_ts: float, limit: int, order: int):
+    def fetch_listens_for_multiple_users_from_storage(self, user_names: List[str], from_ts: float, to_ts: float, limit: int, order: int,
+                                                      as_json=False):
         """ The timestamps are stored as UTC in the postgres datebase while on retrieving
             the value they are converted to the local server's timezone. So to compare
             datetime object we need to create a object in the same timezone as the server.
@@ -314,15 +654,20 @@ class TimescaleListenStore(ListenStore):
             If neither from_ts nor to_ts is provided, the latest listens for the user are returned.
             Returns a tuple of (listens, min_user_timestamp, max_user_timestamp)
 
+            If only one of from_ts and to_ts is given, the listen_user_chunk_count table is used to
+            pick the other bound so that the range holds about limit listens. If the estimate was
+            too tight, the query is repeated once over the whole remaining listen history of the users.
+
             from_ts: seconds since epoch, in float
             to_ts: seconds since epoch, in float
             limit: the maximum number of items to return
             order: 0 for DESCending order, 1 for ASCending order
+            as_json: return the listens as JSON strings built by the database instead of Listen objects,
+                     in the format of LISTEN_JSON_API (or True) or LISTEN_JSON_EXPORT
         """
 
         min_user_ts = max_user_ts = None
-        for user_name in user_names:
-            min_ts, max_ts = self.get_timestamps_for_user(user_name)
+        for min_ts, max_ts in self.get_timestamps_for_users(user_names).values():
             min_user_ts = min(min_ts, min_user_ts or min_ts)
             max_user_ts = max(max_ts, max_user_ts or max_ts)
 
@@ -332,11 +677,10 @@ class TimescaleListenStore(ListenStore):
         if min_user_ts == 0 and max_user_ts == 0:
             return ([], min_user_ts, max_user_ts)
 
-        window_size = DEFAULT_FETCH_WINDOW
-        query = """SELECT listened_at, track_name, user_name, created, data, recording_mbid, release_mbid, artist_mbids
-                     FROM listen
+        query = "SELECT " + _listen_columns(as_json) + """
+                     FROM listen l
           FULL OUTER JOIN listen_join_listen_mbid_mapping lj
-                       ON (data->'track_metadata'->'additional_info'->>'recording_msid')::uuid = lj.recording_msid
+                       ON l.recording_msid = lj.recording_msid
           FULL OUTER JOIN listen_mbid_mapping m
                        ON lj.listen_mbid_mapping = m.id
                     WHERE user_name IN :user_names
@@ -344,69 +688,43 @@ class TimescaleListenStore(ListenStore):
                       AND listened_at < :to_ts
                  ORDER BY listened_at """ + ORDER_TEXT[order] + " LIMIT :limit"
 
-        if from_ts and to_ts:
-            to_dynamic = False
-            from_dynamic = False
-        elif from_ts is not None:
-            to_ts = from_ts + window_size
-            to_dynamic = True
-            from_dynamic = False
-        else:
-            from_ts = to_ts - window_size
-            to_dynamic = False
-            from_dynamic = True
-
-        listens = []
-        done = False
         with timescale.engine.connect() as connection:
             t0 = time.monotonic()
 
+            # The range that certainly holds every listen of the users on the open side. The open
+            # bound is only estimated if the listens are returned starting from the given bound.
+            if from_ts is None:
+                full_from_ts, full_to_ts = min_user_ts - 1, to_ts
+                from_ts = full_from_ts
+                if order != ORDER_ASC:
+                    estimate = self._estimate_range_bound(connection, user_names, to_ts, limit, order)
+                    if estimate is not None and estimate > full_from_ts:
+                        from_ts = estimate
+            elif to_ts is None:
+                full_from_ts, full_to_ts = from_ts, max_user_ts + 1
+                to_ts = full_to_ts
+                if order == ORDER_ASC:
+                    estimate = self._estimate_range_bound(connection, user_names, from_ts, limit, order)
+                    if estimate is not None and estimate < full_to_ts:
+                        to_ts = estimate
+            else:
+                full_from_ts, full_to_ts = from_ts, to_ts
+
             passes = 0
             while True:
                 passes += 1
-
-                # Oh shit valve. I'm keeping it here for the time being. :)
-                if passes == 10:
-                    done = True
-                    break
-
                 curs = connection.execute(sqlalchemy.text(query), user_names=tuple(user_names),
                                           from_ts=from_ts, to_ts=to_ts, limit=limit)
-                while True:
-                    result = curs.fetchone()
-                    if not result:
-                        if not to_dynamic and not from_dynamic:
-                            done = True
-                            break
-
-                        if from_ts < min_user_ts - 1:
-                            done = True
-                            break
-
-                        if to_ts > int(time.time()) + ListenStore.MAX_FUTURE_SECONDS:
-                            done = True
-                            break
-
-                        if to_dynamic:
-                            from_ts += window_size - 1
-                            window_size *= WINDOW_SIZE_MULTIPLIER
-                            to_ts += window_size
-
-                        if from_dynamic:
-                            to_ts -= window_size
-                            window_size *= WINDOW_SIZE_MULTIPLIER
-                            from_ts -= window_size
-
-                        break
-
-
-                    listens.append(Listen.from_timescale(*result))
-                    if len(listens) == limit:
-                        done = True
-                        break
+                if as_json:
+                    listens = [result[0] for result in curs.fetchall()]
+                else:
+                    listens = [Listen.from_timescale(*result) for result in curs.fetchall()]
 
-                if done:
+                # the chunk counts can overestimate the listens in a range, e.g. right after a listen
+                # was deleted, so if the page is not full look at the entire range once more
+                if len(listens) == limit or (from_ts, to_ts) == (full_from_ts, full_to_ts):
                     break
+                from_ts, to_ts = full_from_ts, full_to_ts
 
             fetch_listens_time = time.monotonic() - t0
 
@@ -415,33 +733,161 @@ class TimescaleListenStore(ListenStore):
 
         self.log.info("fetch listens %s %.2fs (%d passes)" %
                       (str(user_names), fetch_listens_time, passes))
+        try:
+            metrics.increment("fetch_listens_passes", amount=passes)
+        except Exception:
+            # Not critical, metrics are not initialized outside of the webserver
+            pass
 
         return (listens, min_user_ts, max_user_ts)
 
-    def fetch_recent_listens_for_users(self, user_list, limit=2, max_age=3600):
+    def fetch_listens_by_refs(self, refs):
+        """ Fetch the listens with the given (listened_at, user_name, track_name) references, as stored in
+            the feeds of RedisListenStore. References to listens which don't exist anymore are skipped.
+
+            Returns a list of listens, latest first
+        """
+        if not refs:
+            return []
+
+        listened_ats, user_names, track_names = zip(*refs)
+        # the range of listened_at lets timescale skip the chunks without any of the listens
+        query = "SELECT " + LISTEN_COLUMNS + """
+                     FROM listen l
+          FULL OUTER JOIN listen_join_listen_mbid_mapping lj
+                       ON l.recording_msid = lj.recording_msid
+          FULL OUTER JOIN listen_mbid_mapping m
+                       ON lj.listen_mbid_mapping = m.id
+                    WHERE (listened_at, user_name, track_name) IN (
+                              SELECT * FROM unnest(CAST(:listened_ats AS BIGINT[]), CAST(:user_names AS TEXT[]),
+                                                   CAST(:track_names AS TEXT[])))
+                      AND listened_at >= :from_ts
+                      AND listened_at <= :to_ts
+                 ORDER BY listened_at DESC"""
+
+        with timescale.engine.connect() as connection:
+            curs = connection.execute(sqlalchemy.text(query), listened_ats=list(listened_ats),
+                                      user_names=list(user_names), track_names=list(track_names),
+                                      from_ts=min(listened_ats), to_ts=max(listened_ats))
+            return [Listen.from_timescale(*result) for result in curs.fetchall()]
+
+    def _estimate_range_bound(self, connection, user_names, ts, limit, order):
+        """ Use the per user chunk counts to find the open bound of a listen range starting at ts
+            that holds at least limit listens of the given users.
+
+            For ORDER_DESC, ts is the exclusive upper bound and the returned value is a lower
+            bound, for ORDER_ASC ts is the exclusive lower bound and an upper bound is returned.
+            Returns None if the users do not have limit listens on that side of ts.
+        """
+
+        if order == ORDER_ASC:
+            query = """SELECT chunk_start
+                         FROM (SELECT chunk_start, sum(sum(count)) OVER (ORDER BY chunk_start ASC) AS running_count
+                                 FROM listen_user_chunk_count
+                                WHERE user_name IN :user_names
+                                  AND chunk_start > :ts - :chunk_size
+                             GROUP BY chunk_start) counts
+                        WHERE running_count >= :limit
+                     ORDER BY chunk_start ASC
+                        LIMIT 1"""
+        else:
+            query = """SELECT chunk_start
+                         FROM (SELECT chunk_start, sum(sum(count)) OVER (ORDER BY chunk_start DESC) AS running_count
+                                 FROM listen_user_chunk_count
+                                WHERE user_name IN :user_names
+                                  AND chunk_start < :ts
+                             GROUP BY chunk_start) counts
+                        WHERE running_count >= :limit
+                     ORDER BY chunk_start DESC
+                        LIMIT 1"""
+
+        result = connection.execute(sqlalchemy.text(query), user_names=tuple(user_names), ts=ts,
+                                    chunk_size=LISTEN_CHUNK_SIZE, limit=limit)
+        row = result.fetchone()
+        if row is None:
+            return None
+
+        if order == ORDER_ASC:
+            return row["chunk_start"] + LISTEN_CHUNK_SIZE
+        return row["chunk_start"] - 1
+
+    def fetch_recent_listens_for_users(self, user_list, limit=2, max_age=3600, as_json=False):
         """ Fetch recent listens for a list of users, given a limit which applies per user. If you
             have a limit of 3 and 3 users you should get 9 listens if they are available.
 
+            The listens are read from the recent listens of each user kept in redis if the limit
+            allows it. They may be missing listens, e.g. after the key expired or a listen was deleted,
+            so the users for whom redis has fewer than limit listens after min_ts are looked up in the
+            listen table.
+
             user_list: A list containing the users for which you'd like to retrieve recent listens.
             limit: the maximum number of listens for each user to fetch.
             max_age: Only return listens if they are no more than max_age seconds old. Default 3600 seconds
+            as_json: return the listens as API JSON strings instead of Listen objects
         """
+        min_ts = int(time.time()) - max_age
+
+        cached_users, cached = set(), []
+        if 0 < limit <= self.user_recent_listens_max:
+            cached_users, cached = self._fetch_cached_recent_listens_for_users(user_list, limit, min_ts)
+        user_list = [user_name for user_name in user_list if user_name not in cached_users]
 
-        args = {'user_list': tuple(user_list), 'ts': int(
-            time.time()) - max_age, 'limit': limit}
-        query = """SELECT * FROM (
+        listens = []
+        for listen in cached:
+            if as_json:
+                listens.append((listen["listened_at"], ujson.dumps(listen)))
+            else:
+                listens.append((listen["listened_at"], Listen.from_json(listen)))
+        if user_list:
+            listens.extend(self._select_recent_listens_for_users(user_list, limit, min_ts, as_json))
+
+        listens.sort(key=lambda listen: listen[0], reverse=True)
+        return [listen for _, listen in listens]
+
+    def _fetch_cached_recent_listens_for_users(self, user_list, limit, min_ts):
+        """ Returns a tuple of the set of users who have limit recent listens after min_ts in redis and a
+            list of these listens, as API dicts with the MBID mapping added where it is known.
+        """
+        pipe = cache._r.pipeline()
+        for user_name in user_list:
+            key = cache._prep_key(RedisListenStore.USER_RECENT_LISTENS_KEY + user_name)
+            pipe.zrevrangebyscore(key, "+inf", "(%d" % min_ts, start=0, num=limit)
+        results = pipe.execute()
+
+        cached_users = set()
+        listens = []
+        for user_name, user_listens in zip(user_list, results):
+            # with fewer listens, the listen table may have listens which redis doesn't
+            if len(user_listens) == limit:
+                cached_users.add(user_name)
+                listens.extend(ujson.loads(listen) for listen in user_listens)
+
+        mappings = get_recent_listens_mbid_mappings(
+            {listen["recording_msid"] for listen in listens if listen.get("recording_msid")})
+        for listen in listens:
+            mapping = mappings.get(listen.get("recording_msid"))
+            if mapping is not None:
+                listen["track_metadata"]["mbid_mapping"] = mapping
+        return cached_users, listens
+
+    def _select_recent_listens_for_users(self, user_list, limit, min_ts, as_json):
+        """ Returns a list of (listened_at, listen) tuples of the recent listens of the users from the listen table """
+
+        args = {'user_list': tuple(user_list), 'ts': min_ts, 'limit': limit}
+        query = "SELECT listened_at, " + _listen_columns(as_json) + """ FROM (
                               SELECT listened_at, track_name, user_name, created, data, recording_mbid, release_mbid, artist_mbids,
                                      row_number() OVER (partition by user_name ORDER BY listened_at DESC) AS rownum
                                 FROM listen l
                      FULL OUTER JOIN listen_join_listen_mbid_mapping lj
-                                  ON (data->'track_metadata'->'additional_info'->>'recording_msid')::uuid = lj.recording_msid
+                                  ON l.recording_msid = lj.recording_msid
                      FULL OUTER JOIN listen_mbid_mapping m
                                   ON lj.listen_mbid_mapping = m.id
                                WHERE user_name IN :user_list
                                  AND listened_at > :ts
                             GROUP BY user_name, listened_at, track_name, created, data, recording_mbid, release_mbid, artist_mbids
                             ORDER BY listened_at DESC) tmp
-                               WHERE rownum <= :limit"""
+                               WHERE rownum <= :limit
+                            ORDER BY listened_at DESC"""
 
         listens = []
         with timescale.engine.connect() as connection:
@@ -451,7 +897,10 @@ class TimescaleListenStore(ListenStore):
                 if not result:
                     break
 
-                listens.append(Listen.from_timescale(*result[0:8]))
+                if as_json:
+                    listens.append((result[0], result[1]))
+                else:
+                    listens.append((result[0], Listen.from_timescale(*result[1:])))
 
         return listens
 
@@ -461,10 +910,10 @@ class TimescaleListenStore(ListenStore):
             Use listened_at timestamp, since not all listens have the created timestamp.
         """
 
-        query = """SELECT listened_at, track_name, user_name, created, data
+        query = """SELECT listened_at, track_name, user_name, created, data::TEXT
                      FROM listen
-                    WHERE listened_at >= :start_time
-                      AND listened_at <= :end_time
+                    WHERE listened_at >= %(start_time)s
+                      AND listened_at <= %(end_time)s
                  ORDER BY listened_at ASC"""
         args = {
             'start_time': start_time,
@@ -479,10 +928,10 @@ class TimescaleListenStore(ListenStore):
             This uses the `created` column to fetch listens.
         """
 
-        query = """SELECT listened_at, track_name, user_name, created, data
+        query = """SELECT listened_at, track_name, user_name, created, data::TEXT
                      FROM listen
-                    WHERE created > :start_ts
-                      AND created <= :end_ts
+                    WHERE created > %(start_ts)s
+                      AND created <= %(end_ts)s
                  ORDER BY created ASC"""
 
         args = {
@@ -542,13 +991,18 @@ class TimescaleListenStore(ListenStore):
                 'Exception while adding dump metadata: %s', str(e), exc_info=True)
             raise
 
-    def write_listens(self, temp_dir, tar_file, archive_name, start_time_range=None, end_time_range=None, full_dump=True):
+    def write_listens(self, temp_dir, tar_file, archive_name, start_time_range=None, end_time_range=None, full_dump=True,
+                      processes=DUMP_DEFAULT_THREAD_COUNT):
         """ Dump listens in the format for the ListenBrainz dump.
 
+        Each month of listens is written to its own file by a pool of worker processes, the files
+        are added to the archive in order as they are finished.
+
         Args:
             end_time_range (datetime): the range of time for the listens dump.
             temp_dir (str): the dir to use to write files before adding to archive
             full_dump (bool): the type of dump
+            processes (int): the number of processes writing listen files
         """
         t0 = time.monotonic()
         listen_count = 0
@@ -564,6 +1018,8 @@ class TimescaleListenStore(ListenStore):
             end_time_range = datetime.utcfromtimestamp(
                 datetime.timestamp(end_time_range))
 
+        months = []
+        jobs = []
         year = start_time_range.year
         month = start_time_range.month
         while True:
@@ -584,12 +1040,6 @@ class TimescaleListenStore(ListenStore):
                 end_time = end_time_range
 
             filename = os.path.join(temp_dir, str(year), "%d.listens" % month)
-            try:
-                os.makedirs(os.path.join(temp_dir, str(year)))
-            except FileExistsError:
-                pass
-
-            query, args = None, None
             if full_dump:
                 query, args = self.get_listens_query_for_dump(int(start_time.strftime('%s')),
                                                               int(end_time.strftime('%s')))
@@ -597,30 +1047,39 @@ class TimescaleListenStore(ListenStore):
                 query, args = self.get_incremental_listens_query(
                     start_time, end_time)
 
-            rows_added = 0
-            with timescale.engine.connect() as connection:
-                curs = connection.execute(sqlalchemy.text(query), args)
-                if curs.rowcount:
-                    with open(filename, "w") as out_file:
-                        while True:
-                            result = curs.fetchone()
-                            if not result:
-                                break
-
-                            listen = Listen.from_timescale(
-                                result[0], result[1], result[2], result[3], result[4]).to_json()
-                            out_file.write(ujson.dumps(listen) + "\n")
-                            rows_added += 1
-                    tar_file.add(filename, arcname=os.path.join(
-                        archive_name, 'listens', str(year), "%d.listens" % month))
-
-                    listen_count += rows_added
-                    self.log.info("%d listens dumped for %s at %.2f listens/s", listen_count, start_time.strftime("%Y-%m-%d"),
-                                  listen_count / (time.monotonic() - t0))
+            months.append((year, month, start_time))
+            jobs.append((filename, query, args))
 
             month = next_month
             year = next_year
-            rows_added = 0
+
+        if processes > 1:
+            # spawn, so that the workers don't share the database connections of this process
+            pool = multiprocessing.get_context("spawn").Pool(
+                processes, initializer=_init_dump_worker, initargs=(self.timescale_uri,))
+            # the files are written faster than they are compressed, so keep only a few of them
+            # ahead of the archive to bound the temporary disk space
+            results = _imap_bounded(pool, _write_listens_file, jobs, 2 * processes)
+        else:
+            pool = None
+            results = map(_write_listens_file, jobs)
+
+        try:
+            for (year, month, start_time), (filename, _, _), rows_added in zip(months, jobs, results):
+                if not rows_added:
+                    continue
+
+                tar_file.add(filename, arcname=os.path.join(
+                    archive_name, 'listens', str(year), "%d.listens" % month))
+                os.remove(filename)
+
+                listen_count += rows_added
+                self.log.info("%d listens dumped for %s at %.2f listens/s", listen_count, start_time.strftime("%Y-%m-%d"),
+                              listen_count / (time.monotonic() - t0))
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
 
     def dump_listens(self, location, dump_id, start_time=datetime.utcfromtimestamp(0), end_time=None,
                      threads=DUMP_DEFAULT_THREAD_COUNT):
@@ -637,7 +1096,7 @@ class TimescaleListenStore(ListenStore):
             dump_id (int): the ID of the dump in the dump sequence
             start_time and end_time (datetime): the time range for which listens should be dumped
                 start_time defaults to utc 0 (meaning a full dump) and end_time defaults to the current time
-            threads (int): the number of threads to use for compression
+            threads (int): the number of threads to use for compression, also the number of processes writing listen files
 
         Returns:
             the path to the dump archive
@@ -673,7 +1132,7 @@ class TimescaleListenStore(ListenStore):
 
                 listens_path = os.path.join(temp_dir, 'listens')
                 self.write_listens(listens_path, tar, archive_name,
-                                   start_time, end_time, full_dump)
+                                   start_time, end_time, full_dump, processes=threads)
 
                 # remove the temporary directory
                 shutil.rmtree(temp_dir)
@@ -720,21 +1179,22 @@ class TimescaleListenStore(ListenStore):
         else:
             end_time = datetime.now()
 
+        # Either take the original listen metadata or the mapping metadata, columns in PARQUET_SCHEMA order
         query = """SELECT listened_at,
                           user_name,
+                          CASE WHEN artist_credit_id IS NULL THEN data->'track_metadata'->>'artist_name'
+                               ELSE artist_credit_name END,
                           artist_credit_id,
-                          artist_mbids::TEXT[] AS artist_credit_mbids,
-                          artist_credit_name AS m_artist_name,
-                          data->'track_metadata'->>'artist_name' AS l_artist_name,
-                          release_name AS m_release_name,
-                          data->'track_metadata'->>'release_name' AS l_release_name,
+                          CASE WHEN artist_credit_id IS NULL THEN data->'track_metadata'->>'release_name'
+                               ELSE release_name END,
                           release_mbid::TEXT,
-                          recording_name AS m_recording_name,
-                          track_name AS l_recording_name,
-                          recording_mbid::TEXT
+                          CASE WHEN artist_credit_id IS NULL THEN track_name
+                               ELSE recording_name END,
+                          recording_mbid::TEXT,
+                          artist_mbids::TEXT[]
                      FROM listen l
                      JOIN listen_join_listen_mbid_mapping lj
-                       ON (data->'track_metadata'->'additional_info'->>'recording_msid')::uuid = lj.recording_msid
+                       ON l.recording_msid = lj.recording_msid
                      JOIN listen_mbid_mapping m
                        ON lj.listen_mbid_mapping = m.id
                     WHERE listened_at > %s
@@ -744,83 +1204,54 @@ class TimescaleListenStore(ListenStore):
         args = (int(start_time.timestamp()), int(end_time.timestamp()))
 
         listen_count = 0
-        current_listened_at = None
         conn = timescale.engine.raw_connection()
-        with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as curs:
-            curs.execute(query, args)
-            while True:
+        try:
+            blocks = stream_query(conn, query, args, block_size=PARQUET_FETCH_SIZE)
+            rows = next(blocks, None)
+            while rows:
                 t0 = time.monotonic()
                 written = 0
-                approx_size = 0
-                data = {
-                    'listened_at': [],
-                    'user_name': [],
-                    'artist_name': [],
-                    'artist_credit_id': [],
-                    'release_name': [],
-                    'release_mbid': [],
-                    'recording_name': [],
-                    'recording_mbid': [],
-                    'artist_credit_mbids': []
-                }
-                while True:
-                    result = curs.fetchone()
-                    if not result:
-                        break
-
-                    # Either take the original listen metadata or the mapping metadata
-                    if result["artist_credit_id"] is None:
-                        data["artist_name"].append(result["l_artist_name"])
-                        data["release_name"].append(result["l_release_name"])
-                        data["recording_name"].append(result["l_recording_name"])
-                        data["artist_credit_id"].append(None)
-                        approx_size += len(result["l_artist_name"]) + len(result["l_release_name"] or "0") + \
-                            len(result["l_recording_name"])
-                    else:
-                        data["artist_name"].append(result["m_artist_name"])
-                        data["release_name"].append(result["m_release_name"])
-                        data["recording_name"].append(result["m_recording_name"])
-                        data["artist_credit_id"].append(result["artist_credit_id"])
-                        approx_size += len(result["m_artist_name"]) + len(result["m_release_name"]) + \
-                            len(result["m_recording_name"]) + len(str(result["artist_credit_id"]))
-
-                    for col in data:
-                        if col == 'listened_at':
-                            current_listened_at = datetime.utcfromtimestamp(result['listened_at'])
-                            data[col].append(current_listened_at)
-                            approx_size += len(str(result[col]))
-                        elif col in ['artist_name', 'release_name', 'recording_name', 'artist_credit_id']:
-                            pass
-                        else:
-                            data[col].append(result[col])
-                            approx_size += len(str(result[col]))
-
-                    written += 1
-                    listen_count += 1
-                    if approx_size > PARQUET_TARGET_SIZE:
-                        break
-
-                if written == 0:
-                    break
-
                 filename = os.path.join(temp_dir, "%d.parquet" % parquet_file_id)
+                with open(filename, "wb") as f:
+                    writer = pq.ParquetWriter(f, PARQUET_SCHEMA)
+                    try:
+                        # every write_table call writes a row group to f, so f.tell() is the file size so far
+                        group_size = 0
+                        while rows and (written == 0 or f.tell() + group_size <= PARQUET_TARGET_SIZE):
+                            group_start = f.tell()
+                            writer.write_table(self._rows_to_parquet_table(rows))
+                            group_size = f.tell() - group_start
+                            written += len(rows)
+                            last_listened_at = rows[-1][0]
+                            rows = next(blocks, None)
+                    finally:
+                        writer.close()
+                    file_size = f.tell()
 
-                # Create a pandas dataframe, then write that to a parquet files
-                df = pd.DataFrame(data, dtype=object)
-                table = pa.Table.from_pandas(df, preserve_index=False)
-                pq.write_table(table, filename)
-                file_size = os.path.getsize(filename)
                 tar_file.add(filename, arcname=os.path.join(archive_dir, "%d.parquet" % parquet_file_id))
                 os.unlink(filename)
                 parquet_file_id += 1
+                listen_count += written
 
                 self.log.info("%d listens dumped for %s at %.2f listens/s (%sMB)",
-                              listen_count, current_listened_at.strftime("%Y-%m-%d"),
+                              listen_count, datetime.utcfromtimestamp(last_listened_at).strftime("%Y-%m-%d"),
                               written / (time.monotonic() - t0),
                               str(round(file_size / (1024 * 1024), 3)))
+        finally:
+            conn.close()
 
         return parquet_file_id
 
+    @staticmethod
+    def _rows_to_parquet_table(rows):
+        """ Convert a block of rows of the spark dump query to an arrow table with PARQUET_SCHEMA """
+        columns = list(zip(*rows))
+        # listened_at is in seconds, the parquet files have always stored it in microseconds
+        columns[0] = pa.array(columns[0], type=pa.int64()).cast(pa.timestamp('s')).cast(pa.timestamp('us'))
+        arrays = [column if i == 0 else pa.array(column, type=field.type)
+                  for i, (column, field) in enumerate(zip(columns, PARQUET_SCHEMA))]
+        return pa.Table.from_arrays(arrays, schema=PARQUET_SCHEMA)
+
     def dump_listens_for_spark(self, location,
                                dump_id,
                                start_time=datetime.utcfromtimestamp(DATA_START_YEAR_IN_SECONDS),
@@ -883,16 +1314,24 @@ class TimescaleListenStore(ListenStore):
         self.log.info('Dump present at %s!', archive_path)
         return archive_path
 
-    def import_listens_dump(self, archive_path, threads=DUMP_DEFAULT_THREAD_COUNT):
+    def import_listens_dump(self, archive_path, threads=DUMP_DEFAULT_THREAD_COUNT, parallel=False):
         """ Imports listens into TimescaleDB from a ListenBrainz listens dump .tar.xz archive.
 
+        In parallel mode, batches of lines of the .listens files are parsed and COPYed into the
+        listen table by a pool of worker processes. The cached listen counts and timestamps are not
+        updated per batch. Once the import is done, the continuous aggregates are refreshed over the
+        time range of the imported listens, whose buckets their policies may never refresh, and the
+        user data is recalculated for all users. This is meant for restoring a dump into an otherwise
+        idle database.
+
         Args:
             archive (str): the path to the listens dump .tar.xz archive to be imported
-            threads (int): the number of threads to be used for decompression
-                           (defaults to DUMP_DEFAULT_THREAD_COUNT)
+            threads (int): the number of threads to be used for decompression, also the number
+                           of import processes in parallel mode (defaults to DUMP_DEFAULT_THREAD_COUNT)
+            parallel (bool): import with worker processes and recalculate the user data afterwards
 
         Returns:
-            int: the number of users for whom listens have been imported
+            int: the number of listens that have been imported
         """
 
         self.log.info(
@@ -903,56 +1342,108 @@ class TimescaleListenStore(ListenStore):
                        archive_path, '-T{threads}'.format(threads=threads)]
         pxz = subprocess.Popen(pxz_command, stdout=subprocess.PIPE)
 
+        if parallel:
+            # spawn, so that the workers don't share the database connections of this process
+            pool = multiprocessing.get_context("spawn").Pool(
+                threads, initializer=_init_dump_worker, initargs=(self.timescale_uri,))
+        else:
+            pool = None
+        pending = []
+        max_pending = 2 * threads
+        # (min, max) listened_at of each batch imported by the workers
+        imported_ranges = []
+
         schema_checked = False
         total_imported = 0
-        with tarfile.open(fileobj=pxz.stdout, mode='r|') as tar:
-            listens = []
-            for member in tar:
-                if member.name.endswith('SCHEMA_SEQUENCE'):
-                    self.log.info(
-                        'Checking if schema version of dump matches...')
-                    schema_seq = int(tar.extractfile(
-                        member).read().strip() or '-1')
-                    if schema_seq != LISTENS_DUMP_SCHEMA_VERSION:
-                        raise SchemaMismatchException('Incorrect schema version! Expected: %d, got: %d.'
-                                                      'Please ensure that the data dump version matches the code version'
-                                                      'in order to import the data.'
-                                                      % (LISTENS_DUMP_SCHEMA_VERSION, schema_seq))
-                    schema_checked = True
-
-                if member.name.endswith(".listens"):
-                    if not schema_checked:
-                        raise SchemaMismatchException(
-                            "SCHEMA_SEQUENCE file missing from listen dump.")
-
-                    # tarf, really? That's the name you're going with? Yep.
-                    with tar.extractfile(member) as tarf:
-                        while True:
-                            line = tarf.readline()
-                            if not line:
-                                break
-
-                            listen = Listen.from_json(ujson.loads(line))
-                            listens.append(listen)
-
-                            if len(listens) > DUMP_CHUNK_SIZE:
-                                total_imported += len(listens)
-                                self.insert(listens)
-                                listens = []
-
-            if len(listens) > 0:
-                total_imported += len(listens)
-                self.insert(listens)
-
-        if not schema_checked:
-            raise SchemaMismatchException(
-                "SCHEMA_SEQUENCE file missing from listen dump.")
+        try:
+            with tarfile.open(fileobj=pxz.stdout, mode='r|') as tar:
+                listens = []
+                for member in tar:
+                    if member.name.endswith('SCHEMA_SEQUENCE'):
+                        self.log.info(
+                            'Checking if schema version of dump matches...')
+                        schema_seq = int(tar.extractfile(
+                            member).read().strip() or '-1')
+                        if schema_seq != LISTENS_DUMP_SCHEMA_VERSION:
+                            raise SchemaMismatchException('Incorrect schema version! Expected: %d, got: %d.'
+                                                          'Please ensure that the data dump version matches the code version'
+                                                          'in order to import the data.'
+                                                          % (LISTENS_DUMP_SCHEMA_VERSION, schema_seq))
+                        schema_checked = True
+
+                    if member.name.endswith(".listens"):
+                        if not schema_checked:
+                            raise SchemaMismatchException(
+                                "SCHEMA_SEQUENCE file missing from listen dump.")
+
+                        # tarf, really? That's the name you're going with? Yep.
+                        with tar.extractfile(member) as tarf:
+                            while True:
+                                line = tarf.readline()
+                                if not line:
+                                    break
+
+                                if pool is None:
+                                    listens.append(Listen.from_json(ujson.loads(line)))
+                                else:
+                                    listens.append(line)
+
+                                if len(listens) > DUMP_CHUNK_SIZE:
+                                    total_imported += self._import_batch(listens, pool, pending, max_pending,
+                                                                         imported_ranges)
+                                    listens = []
+
+                if len(listens) > 0:
+                    total_imported += self._import_batch(listens, pool, pending, max_pending, imported_ranges)
+
+            if not schema_checked:
+                raise SchemaMismatchException(
+                    "SCHEMA_SEQUENCE file missing from listen dump.")
+
+            for result in pending:
+                result.get()
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+            pxz.stdout.close()
+
+        if parallel:
+            # imported here because timescale_utils imports this module
+            from listenbrainz.listenstore.timescale_utils import refresh_continuous_aggregates, recalculate_user_data
+            if imported_ranges:
+                start_ts = min(start for start, _ in imported_ranges)
+                end_ts = max(end for _, end in imported_ranges)
+                # the refresh window has to cover the whole buckets of the imported listens
+                start_ts -= start_ts % LISTEN_COUNT_BUCKET_WIDTH
+                end_ts += LISTEN_COUNT_BUCKET_WIDTH - end_ts % LISTEN_COUNT_BUCKET_WIDTH
+                self.log.info('Refreshing the continuous aggregates from %d to %d...', start_ts, end_ts)
+                refresh_continuous_aggregates(start_ts, end_ts)
+
+            self.log.info('Recalculating listen counts and timestamps of all users...')
+            recalculate_user_data()
 
         self.log.info('Import of listens from dump %s done!', archive_path)
-        pxz.stdout.close()
 
         return total_imported
 
+    def _import_batch(self, listens, pool, pending, max_pending, imported_ranges):
+        """ Insert a batch of listens of a dump import, or of dump lines if a pool of import workers
+            is given. At most max_pending batches are kept in flight, so that the dump isn't read
+            into memory faster than it can be inserted. The (min, max) listened_at of each batch
+            inserted by the workers is added to imported_ranges.
+
+            Returns the number of listens in the batch.
+        """
+        if pool is None:
+            self.insert(listens)
+            return len(listens)
+
+        while len(pending) >= max_pending:
+            pending.pop(0).get()
+        pending.append(pool.apply_async(_import_listens_lines, (listens,), callback=imported_ranges.append))
+        return len(listens)
+
     def delete(self, musicbrainz_id):
         """ Delete all listens for user with specified MusicBrainz ID.
 
@@ -965,16 +1456,22 @@ class TimescaleListenStore(ListenStore):
         """
 
         self.set_empty_cache_values_for_user(musicbrainz_id)
+        cache.delete(RedisListenStore.USER_RECENT_LISTENS_KEY + musicbrainz_id)
         args = {'user_name': musicbrainz_id}
         query = "DELETE FROM listen WHERE user_name = :user_name"
+        chunk_count_query = "DELETE FROM listen_user_chunk_count WHERE user_name = :user_name"
 
         try:
             with timescale.engine.connect() as connection:
-                connection.execute(sqlalchemy.text(query), args)
+                with connection.begin():
+                    connection.execute(sqlalchemy.text(query), args)
+                    connection.execute(sqlalchemy.text(chunk_count_query), args)
         except psycopg2.OperationalError as e:
             self.log.error("Cannot delete listens for user: %s" % str(e))
             raise
 
+        self.invalidate_cached_listens_pages([musicbrainz_id])
+
     def delete_listen(self, listened_at: int, user_name: str, recording_msid: str):
         """ Delete a particular listen for user with specified MusicBrainz ID.
         Args:
@@ -990,16 +1487,86 @@ class TimescaleListenStore(ListenStore):
                     WHERE listened_at = :listened_at
                       AND user_name = :user_name
                       AND data -> 'track_metadata' -> 'additional_info' ->> 'recording_msid' = :recording_msid """
+        chunk_count_query = """UPDATE listen_user_chunk_count
+                                  SET count = count - :deleted
+                                WHERE user_name = :user_name
+                                  AND chunk_start = :chunk_start"""
 
         try:
             with timescale.engine.connect() as connection:
-                connection.execute(sqlalchemy.text(query), args)
+                with connection.begin():
+                    result = connection.execute(sqlalchemy.text(query), args)
+                    if result.rowcount:
+                        connection.execute(sqlalchemy.text(chunk_count_query), {
+                            'deleted': result.rowcount,
+                            'user_name': user_name,
+                            'chunk_start': listened_at - listened_at % LISTEN_CHUNK_SIZE,
+                        })
 
             cache._r.decrby(cache._prep_key(REDIS_USER_LISTEN_COUNT + user_name))
+            # drops the other listens of the user at the same time too, which is rare enough to not matter
+            cache._r.zremrangebyscore(cache._prep_key(RedisListenStore.USER_RECENT_LISTENS_KEY + user_name),
+                                      listened_at, listened_at)
+            self.invalidate_cached_listens_pages([user_name])
         except psycopg2.OperationalError as e:
             self.log.error("Cannot delete listen for user: %s" % str(e))
             raise TimescaleListenStoreException
 
 
+def _init_dump_worker(timescale_uri):
+    timescale.init_db_connection(timescale_uri)
+
+
+def _write_listens_file(job):
+    """ Write the listens selected by a dump query to a file, one JSON document per line.
+        The query is read with a server side cursor in batches of DUMP_FETCH_SIZE rows.
+
+        Args:
+            job: a (filename, query, args) tuple, the query has psycopg2 style parameters
+        Returns:
+            the number of listens written, the file is only created if this isn't 0
+    """
+    filename, query, args = job
+    rows_added = 0
+    out_file = None
+    try:
+        with timescale.engine.connect() as connection:
+            for rows in stream_query(connection.connection, query, args, block_size=DUMP_FETCH_SIZE):
+                if out_file is None:
+                    os.makedirs(os.path.dirname(filename), exist_ok=True)
+                    out_file = open(filename, "w")
+                out_file.write("".join(ujson.dumps(LazyListen(*row).to_json()) + "\n" for row in rows))
+                rows_added += len(rows)
+    finally:
+        if out_file is not None:
+            out_file.close()
+
+    return rows_added
+
+
+def _imap_bounded(pool, func, jobs, max_pending):
+    """ Like pool.imap, but submit a job only once fewer than max_pending jobs are waiting for
+        their results to be consumed.
+    """
+    pending = []
+    for job in jobs:
+        if len(pending) >= max_pending:
+            yield pending.pop(0).get()
+        pending.append(pool.apply_async(func, (job,)))
+    while pending:
+        yield pending.pop(0).get()
+
+
+def _import_listens_lines(lines):
+    """ Parse a batch of lines of a .listens dump file and COPY them into the listen table,
+        leaving the cached user data alone. Runs in a dump import worker process.
+
+        Returns the (min, max) listened_at of the batch.
+    """
+    submit = [Listen.from_json(ujson.loads(line)).to_timescale() for line in lines]
+    TimescaleListenStore._insert_rows(submit, use_copy=True)
+    return min(row[0] for row in submit), max(row[0] for row in submit)
+
+
 class TimescaleListenStoreException(Exception):
     pass
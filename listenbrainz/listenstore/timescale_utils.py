@@ -1,6 +1,6 @@
 import time
 from collections import defaultdict
-from datetime import datetime, timedelta
+from datetime import datetime
 import psycopg2
 from psycopg2.errors import UntranslatableCharacter
 import sqlalchemy
@@ -11,7 +11,8 @@ from brainzutils import cache
 from listenbrainz.utils import init_cache
 from listenbrainz import db
 from listenbrainz.db import timescale
-from listenbrainz.listenstore.timescale_listenstore import REDIS_USER_LISTEN_COUNT, REDIS_USER_TIMESTAMPS, DATA_START_YEAR_IN_SECONDS
+from listenbrainz.listenstore.timescale_listenstore import REDIS_USER_LISTEN_COUNT, REDIS_USER_TIMESTAMPS, DATA_START_YEAR_IN_SECONDS, \
+    LISTEN_CHUNK_SIZE
 from listenbrainz import config
 
 
@@ -19,100 +20,163 @@ logger = logging.getLogger(__name__)
 
 NUM_YEARS_TO_PROCESS_FOR_CONTINUOUS_AGGREGATE_REFRESH = 3
 SECONDS_IN_A_YEAR = 31536000
+CONTINUOUS_AGGREGATES = ("listen_count_30day", "listen_timestamps_30day")
+
+# Number of users whose data recalculate_all_user_data recalculates at a time
+RECALCULATE_USER_BATCH_SIZE = 1000
+# Holds the name of the last user recalculate_all_user_data finished, while it runs
+REDIS_RECALCULATE_CHECKPOINT_KEY = "recalculate-user-data-checkpoint"
+
+# Redis script to set the recalculated listen counts of a batch of users. KEYS holds the listen
+# count key of each user, ARGV holds the recalculated count and the count cached before counting
+# started (empty if none) of each user in the same order. The difference between the cached and
+# the earlier count is added to the recalculated one, so that the increments of listens inserted
+# meanwhile are kept.
+SET_LISTEN_COUNTS_SCRIPT = """
+for i = 1, #KEYS do
+    local count = tonumber(ARGV[2 * i - 1])
+    local old_count = tonumber(ARGV[2 * i]) or 0
+    local current_count = tonumber(redis.call('GET', KEYS[i])) or 0
+    redis.call('SET', KEYS[i], count + current_count - old_count)
+end
+"""
 
 
 def recalculate_all_user_data():
+    """
+        Connect to the databases and redis and recalculate the cached data of all users with
+        recalculate_user_data.
+    """
 
     timescale.init_db_connection(config.SQLALCHEMY_TIMESCALE_URI)
     db.init_db_connection(config.SQLALCHEMY_DATABASE_URI)
     init_cache(host=config.REDIS_HOST, port=config.REDIS_PORT,
                namespace=config.REDIS_NAMESPACE)
+    recalculate_user_data()
 
-    # Find the created timestamp of the last listen
-    query = "SELECT max(created) FROM listen WHERE created > :date"
-    try:
-        with timescale.engine.connect() as connection:
-            result = connection.execute(sqlalchemy.text(
-                query), date=datetime.now() - timedelta(weeks=4))
-            row = result.fetchone()
-            last_created_ts = row[0]
-    except psycopg2.OperationalError as e:
-        logger.error("Cannot query ts to fetch latest listen." %
-                     str(e), exc_info=True)
-        raise
 
-    logger.info("Last created timestamp: " + str(last_created_ts))
+def recalculate_user_data():
+    """
+        Recalculate the cached listen counts of all users and drop their cached timestamps, which
+        are then recalculated on demand by get_timestamps_for_user. Uses the existing database
+        connections and cache.
+
+        Users are processed in batches of RECALCULATE_USER_BATCH_SIZE in the order of their names.
+        For each batch the listen counts are summed from listen_user_chunk_count, which is updated
+        in the same transaction as the listen table. The last user of each finished batch is saved
+        in redis, so an interrupted run continues after it.
+    """
+
+    last_user_name = cache.get(REDIS_RECALCULATE_CHECKPOINT_KEY)
+    if last_user_name:
+        logger.info("Resuming after user %s" % last_user_name)
 
     # Select a list of users
-    user_list = []
-    query = 'SELECT musicbrainz_id FROM "user"'
+    query = 'SELECT musicbrainz_id FROM "user" WHERE musicbrainz_id > :last_user_name ORDER BY musicbrainz_id'
     try:
         with db.engine.connect() as connection:
-            result = connection.execute(sqlalchemy.text(query))
-            for row in result:
-                user_list.append(row[0])
+            result = connection.execute(sqlalchemy.text(query), last_user_name=last_user_name or "")
+            user_list = [row[0] for row in result]
     except psycopg2.OperationalError as e:
-        logger.error("Cannot query db to fetch user list." %
-                     str(e), exc_info=True)
+        logger.error("Cannot query db to fetch user list: %s" % str(e), exc_info=True)
         raise
 
-    logger.info("Fetched %d users. Setting empty cache entries." %
-                len(user_list))
+    logger.info("Fetched %d users." % len(user_list))
+
+    set_listen_counts_script = cache._r.register_script(SET_LISTEN_COUNTS_SCRIPT)
+    for i in range(0, len(user_list), RECALCULATE_USER_BATCH_SIZE):
+        t0 = time.monotonic()
+        batch = user_list[i:i + RECALCULATE_USER_BATCH_SIZE]
+        _recalculate_user_data_for_batch(batch, set_listen_counts_script)
+        cache.set(REDIS_RECALCULATE_CHECKPOINT_KEY, batch[-1], expirein=0)
+        logger.info("Recalculated user data for %d of %d users in %.2fs" %
+                    (i + len(batch), len(user_list), time.monotonic() - t0))
+
+    cache.delete(REDIS_RECALCULATE_CHECKPOINT_KEY)
 
-    # Reset the timestamps and listen counts to 0 for all users
-    for user_name in user_list:
-        cache.set(REDIS_USER_LISTEN_COUNT + user_name, 0, expirein=0, encode=False)
-        cache.set(REDIS_USER_LISTEN_COUNT + user_name, 0, expirein=0, encode=False)
-        cache.set(REDIS_USER_TIMESTAMPS + user_name, "0,0", expirein=0)
 
-    # Tabulate all of the listen counts/timestamps for all users
-    logger.info("Scan the whole listen table...")
-    listen_counts = defaultdict(int)
-    user_timestamps = {}
-    query = "SELECT listened_at, user_name FROM listen where created <= :ts"
+def _recalculate_user_data_for_batch(user_names, set_listen_counts_script):
+    """ Recalculate the cached listen counts of a batch of users and drop their cached timestamps.
+
+        The cached counts are read before counting and the recalculated counts are written in one
+        step by set_listen_counts_script, which keeps whatever the counts were incremented by
+        meanwhile for newly inserted listens.
+    """
+
+    keys = [cache._prep_key(REDIS_USER_LISTEN_COUNT + user_name) for user_name in user_names]
+    old_counts = cache._r.mget(keys)
+
+    counts = defaultdict(int)
+    query = """SELECT user_name, sum(count)
+                 FROM listen_user_chunk_count
+                WHERE user_name IN :user_names
+             GROUP BY user_name"""
     try:
         with timescale.engine.connect() as connection:
-            result = connection.execute(
-                sqlalchemy.text(query), ts=last_created_ts)
-            for row in result:
-                ts = row[0]
-                user_name = row[1]
-                if user_name not in user_timestamps:
-                    user_timestamps[user_name] = [ts, ts]
-                else:
-                    if ts > user_timestamps[user_name][1]:
-                        user_timestamps[user_name][1] = ts
-                    if ts < user_timestamps[user_name][0]:
-                        user_timestamps[user_name][0] = ts
-
-                listen_counts[user_name] += 1
-
+            result = connection.execute(sqlalchemy.text(query), user_names=tuple(user_names))
+            for user_name, count in result:
+                counts[user_name] = int(count)
     except psycopg2.OperationalError as e:
-        logger.error("Cannot query db to fetch user list." %
-                     str(e), exc_info=True)
+        logger.error("Cannot query listen counts: %s" % str(e), exc_info=True)
         raise
 
-    logger.info("Setting updated cache entries.")
-    # Set the timestamps and listen counts for all users
-    for user_name in user_list:
-        try:
-            cache.increment(REDIS_USER_LISTEN_COUNT + user_name, amount=listen_counts[user_name])
-        except KeyError:
-            pass
+    args = []
+    for user_name, old_count in zip(user_names, old_counts):
+        args.extend((counts[user_name], old_count or ""))
+
+    pipe = cache._r.pipeline()
+    set_listen_counts_script(keys=keys, args=args, client=pipe)
+    for user_name in user_names:
+        pipe.delete(cache._prep_key(REDIS_USER_TIMESTAMPS + user_name))
+    pipe.execute()
+
+
+def backfill_listen_recording_msid():
+    """
+        Copy the recording_msid of listens inserted before the recording_msid column existed
+        from the listen JSON into the column. The listen table is updated one hypertable chunk
+        at a time, each in its own transaction, so that the backfill doesn't hold locks on
+        the whole table and can be interrupted and restarted at any point.
+    """
+
+    timescale.init_db_connection(config.SQLALCHEMY_TIMESCALE_URI)
 
+    query = "SELECT min(listened_at), max(listened_at) FROM listen"
+    with timescale.engine.connect() as connection:
+        min_ts, max_ts = connection.execute(sqlalchemy.text(query)).fetchone()
+
+    if min_ts is None:
+        logger.info("No listens to backfill.")
+        return
+
+    # Listens with a recording_msid that isn't a valid uuid are left as NULL
+    query = """UPDATE listen
+                  SET recording_msid = (data->'track_metadata'->'additional_info'->>'recording_msid')::uuid
+                WHERE listened_at >= :start_ts
+                  AND listened_at < :end_ts
+                  AND recording_msid IS NULL
+                  AND data->'track_metadata'->'additional_info'->>'recording_msid' ~*
+                      '^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$'"""
+
+    total = 0
+    start_ts = max_ts - max_ts % LISTEN_CHUNK_SIZE
+    while start_ts + LISTEN_CHUNK_SIZE > min_ts:
+        t0 = time.monotonic()
         try:
-            tss = cache.get(REDIS_USER_TIMESTAMPS + user_name)
-            (min_ts, max_ts) = tss.split(",")
-            min_ts = int(min_ts)
-            max_ts = int(max_ts)
-            if min_ts and min_ts < user_timestamps[user_name][0]:
-                user_timestamps[user_name][0] = min_ts
-            if max_ts and max_ts > user_timestamps[user_name][1]:
-                user_timestamps[user_name][1] = max_ts
-            cache.set(REDIS_USER_TIMESTAMPS + user_name, "%d,%d" %
-                      (user_timestamps[user_name][0], user_timestamps[user_name][1]), expirein=0)
-        except KeyError:
-            pass
+            with timescale.engine.connect() as connection:
+                with connection.begin():
+                    result = connection.execute(sqlalchemy.text(query), start_ts=start_ts,
+                                                end_ts=start_ts + LISTEN_CHUNK_SIZE)
+        except psycopg2.OperationalError as e:
+            logger.error("Cannot backfill recording_msid: %s" % str(e), exc_info=True)
+            raise
+
+        total += result.rowcount
+        logger.info("Backfilled %d listens from %s in %.2fs" % (result.rowcount,
+                    str(datetime.fromtimestamp(start_ts)), time.monotonic() - t0))
+        start_ts -= LISTEN_CHUNK_SIZE
+
+    logger.info("Backfilled recording_msid of %d listens." % total)
 
 
 def unlock_cron():
@@ -125,9 +189,30 @@ def unlock_cron():
         logger.error("Cannot unlock cron after updating continuous aggregates: %s" % str(err))
 
 
+def refresh_continuous_aggregates(start_ts, end_ts):
+    """ Refresh the buckets of the listen_count and listen_timestamps continuous aggregates between
+        start_ts and end_ts. Their policies only refresh the last year, older buckets have to be
+        refreshed like this once listens were added to or removed from them.
+    """
+    query = "call refresh_continuous_aggregate(:view, :start_ts, :end_ts)"
+    for view in CONTINUOUS_AGGREGATES:
+        try:
+            with timescale.engine.connect() as connection:
+                # the isolation level of pooled connections is restored when they are returned
+                connection = connection.execution_options(isolation_level="AUTOCOMMIT")
+                connection.execute(sqlalchemy.text(query), {
+                    "view": view,
+                    "start_ts": start_ts,
+                    "end_ts": end_ts
+                })
+        except psycopg2.OperationalError as e:
+            logger.error("Cannot refresh %s cont agg: %s" % (view, str(e)), exc_info=True)
+            raise
+
+
 def refresh_listen_count_aggregate():
     """
-        Manually refresh the listen_count continuous aggregate.
+        Manually refresh the listen_count and listen_timestamps continuous aggregates.
 
         Arg:
 
@@ -156,17 +241,10 @@ def refresh_listen_count_aggregate():
         (NUM_YEARS_TO_PROCESS_FOR_CONTINUOUS_AGGREGATE_REFRESH * SECONDS_IN_A_YEAR) + 1
 
     while True:
-        query = "call refresh_continuous_aggregate('listen_count_30day', :start_ts, :end_ts)"
         t0 = time.monotonic()
         try:
-            with timescale.engine.connect() as connection:
-                connection.connection.set_isolation_level(0)
-                connection.execute(sqlalchemy.text(query), {
-                    "start_ts": start_ts,
-                    "end_ts": end_ts
-                })
-        except psycopg2.OperationalError as e:
-            logger.error("Cannot refresh listen_count_30day cont agg: %s" % str(e), exc_info=True)
+            refresh_continuous_aggregates(start_ts, end_ts)
+        except psycopg2.OperationalError:
             unlock_cron()
             raise
 
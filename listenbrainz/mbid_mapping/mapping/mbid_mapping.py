@@ -4,7 +4,7 @@ import psycopg2
 from psycopg2.errors import OperationalError
 from unidecode import unidecode
 
-from mapping.utils import create_schema, insert_rows, log
+from mapping.utils import create_schema, insert_rows, log, stream_query
 from mapping.formats import create_formats_table
 import config
 
@@ -117,30 +117,31 @@ def create_temp_release_table(conn):
         for op in ['!=', '=']:
             if config.USE_MINIMAL_DATASET:
                 log("mbid mapping temp tables: Using a minimal dataset for artist credit pairs: artist_id %s 1" % op)
-                curs.execute(query % (op, 'AND rg.artist_credit IN (%s)' % ",".join([str(i) for i in TEST_ARTIST_IDS])))
+                op_query = query % (op, 'AND rg.artist_credit IN (%s)' % ",".join([str(i) for i in TEST_ARTIST_IDS]))
             else:
                 log("mbid mapping temp tables: Using a full dataset for artist credit pairs: artsit_id %s 1" % op)
-                curs.execute(query % (op, ""))
+                op_query = query % (op, "")
 
             # Fetch releases and toss out duplicates -- using DISTINCT in the query above is not possible as it will
             # destroy the sort order we so carefully crafted.
             with conn.cursor() as curs_insert:
                 rows = []
                 release_index = {}
-                for row in curs:
-                    if row[0] in release_index:
-                        continue
-
-                    release_index[row[0]] = 1
-                    count += 1
-                    rows.append((count, row[0]))
-                    if len(rows) == BATCH_SIZE:
-                        insert_rows(
-                            curs_insert, "mapping.tmp_mbid_mapping_releases", rows)
-                        rows = []
+                for block in stream_query(conn, op_query):
+                    for row in block:
+                        if row[0] in release_index:
+                            continue
+
+                        release_index[row[0]] = 1
+                        count += 1
+                        rows.append((count, row[0]))
+                        if len(rows) == BATCH_SIZE:
+                            insert_rows(
+                                curs_insert, "mapping.tmp_mbid_mapping_releases", rows)
+                            rows = []
 
-                    if count % 1000000 == 0:
-                        log("mbid mapping temp tables: inserted %s rows." % count)
+                        if count % 1000000 == 0:
+                            log("mbid mapping temp tables: inserted %s rows." % count)
 
                 if rows:
                     insert_rows(
@@ -194,63 +195,59 @@ def create_mbid_mapping():
 
     log("mbid mapping: start")
     with psycopg2.connect(config.MBID_MAPPING_DATABASE_URI) as mb_conn:
-        with mb_conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as mb_curs:
-
-            # Create the dest table (perhaps dropping the old one first)
-            log("mbid mapping: create schema")
-            create_schema(mb_conn)
-            log("mbid mapping: drop old tables, create new tables")
-            create_tables(mb_conn)
-
-            create_temp_release_table(mb_conn)
-            with mb_conn.cursor() as mb_curs2:
-                rows = []
-                last_artist_credit_id = None
-                artist_recordings = {}
-                count = 0
-                batch_count = 0
-                serial = 1
-                log("mbid mapping: fetch recordings")
-                mb_curs.execute("""SELECT ac.id as artist_credit_id,
-                                          r.name AS recording_name,
-                                          r.gid AS recording_mbid,
-                                          ac.name AS artist_credit_name,
-                                          s.artist_mbids,
-                                          rl.name AS release_name,
-                                          rl.gid AS release_mbid,
-                                          rpr.id AS score
-                                     FROM recording r
-                                     JOIN artist_credit ac
-                                       ON r.artist_credit = ac.id
-                                     JOIN artist_credit_name acn
-                                       ON ac.id = acn.artist_credit
-                                     JOIN artist a
-                                       ON acn.artist = a.id
-                                     JOIN track t
-                                       ON t.recording = r.id
-                                     JOIN medium m
-                                       ON m.id = t.medium
-                                     JOIN release rl
-                                       ON rl.id = m.release
-                                     JOIN mapping.tmp_mbid_mapping_releases rpr
-                                       ON rl.id = rpr.release
-                                     JOIN (SELECT artist_credit, array_agg(gid) AS artist_mbids
-                                             FROM artist_credit_name acn2
-                                             JOIN artist a2
-                                               ON acn2.artist = a2.id
-                                         GROUP BY acn2.artist_credit) s
-                                       ON acn.artist_credit = s.artist_credit
-                                LEFT JOIN release_country rc
-                                       ON rc.release = rl.id
-                                 GROUP BY rpr.id, ac.id, s.artist_mbids, rl.gid, artist_credit_name, r.gid, r.name, release_name
-                                 ORDER BY ac.id, rpr.id""")
-
-                row_count = 0
-                while True:
-                    row = mb_curs.fetchone()
-                    if not row:
-                        break
-
+        # Create the dest table (perhaps dropping the old one first)
+        log("mbid mapping: create schema")
+        create_schema(mb_conn)
+        log("mbid mapping: drop old tables, create new tables")
+        create_tables(mb_conn)
+
+        create_temp_release_table(mb_conn)
+        with mb_conn.cursor() as mb_curs2:
+            rows = []
+            last_artist_credit_id = None
+            artist_recordings = {}
+            count = 0
+            batch_count = 0
+            serial = 1
+            log("mbid mapping: fetch recordings")
+            query = """SELECT ac.id as artist_credit_id,
+                              r.name AS recording_name,
+                              r.gid AS recording_mbid,
+                              ac.name AS artist_credit_name,
+                              s.artist_mbids,
+                              rl.name AS release_name,
+                              rl.gid AS release_mbid,
+                              rpr.id AS score
+                         FROM recording r
+                         JOIN artist_credit ac
+                           ON r.artist_credit = ac.id
+                         JOIN artist_credit_name acn
+                           ON ac.id = acn.artist_credit
+                         JOIN artist a
+                           ON acn.artist = a.id
+                         JOIN track t
+                           ON t.recording = r.id
+                         JOIN medium m
+                           ON m.id = t.medium
+                         JOIN release rl
+                           ON rl.id = m.release
+                         JOIN mapping.tmp_mbid_mapping_releases rpr
+                           ON rl.id = rpr.release
+                         JOIN (SELECT artist_credit, array_agg(gid) AS artist_mbids
+                                 FROM artist_credit_name acn2
+                                 JOIN artist a2
+                                   ON acn2.artist = a2.id
+                             GROUP BY acn2.artist_credit) s
+                           ON acn.artist_credit = s.artist_credit
+                    LEFT JOIN release_country rc
+                           ON rc.release = rl.id
+                     GROUP BY rpr.id, ac.id, s.artist_mbids, rl.gid, artist_credit_name, r.gid, r.name, release_name
+                     ORDER BY ac.id, rpr.id"""
+
+            row_count = 0
+            # The cursor is held open across the commits of the inserted rows
+            for block in stream_query(mb_conn, query, cursor_factory=psycopg2.extras.DictCursor, withhold=True):
+                for row in block:
                     if not last_artist_credit_id:
                         last_artist_credit_id = row['artist_credit_id']
 
@@ -294,17 +291,17 @@ def create_mbid_mapping():
 
                     last_artist_credit_id = row['artist_credit_id']
 
-                rows.extend(artist_recordings.values())
-                if rows:
-                    insert_rows(mb_curs2, "mapping.tmp_mbid_mapping", rows)
-                    mb_conn.commit()
-                    count += len(rows)
+            rows.extend(artist_recordings.values())
+            if rows:
+                insert_rows(mb_curs2, "mapping.tmp_mbid_mapping", rows)
+                mb_conn.commit()
+                count += len(rows)
 
-            log("mbid mapping: inserted %d rows total." % count)
-            log("mbid mapping: create indexes")
-            create_indexes(mb_conn)
+        log("mbid mapping: inserted %d rows total." % count)
+        log("mbid mapping: create indexes")
+        create_indexes(mb_conn)
 
-            log("mbid mapping: swap tables and indexes into production.")
-            swap_table_and_indexes(mb_conn)
+        log("mbid mapping: swap tables and indexes into production.")
+        swap_table_and_indexes(mb_conn)
 
     log("mbid mapping: done")
@@ -9,7 +9,7 @@ from unidecode import unidecode
 import psycopg2
 
 import config
-from mapping.utils import log
+from mapping.utils import log, stream_query
 
 
 BATCH_SIZE = 5000
@@ -102,21 +102,23 @@ def build(client, collection_name):
                                score
                           FROM mapping.mbid_mapping""")
 
-            curs.execute(query)
             documents = []
-            for i, row in enumerate(curs):
-                document = dict(row)
-                document['artist_mbids'] = row["artist_mbids"][1:-1]
-                document['score'] = max_score - document['score']
-                document['combined'] = prepare_string(document['recording_name'] + " " + document['artist_credit_name'])
-                documents.append(document)
-
-                if len(documents) == BATCH_SIZE:
-                    client.collections[collection_name].documents.import_(documents)
-                    documents = []
-
-                if i and i % 1000000 == 0:
-                    log("typesense index: Indexed %d rows" % i)
+            i = 0
+            for block in stream_query(conn, query, cursor_factory=psycopg2.extras.DictCursor):
+                for row in block:
+                    document = dict(row)
+                    document['artist_mbids'] = row["artist_mbids"][1:-1]
+                    document['score'] = max_score - document['score']
+                    document['combined'] = prepare_string(document['recording_name'] + " " + document['artist_credit_name'])
+                    documents.append(document)
+
+                    if len(documents) == BATCH_SIZE:
+                        client.collections[collection_name].documents.import_(documents)
+                        documents = []
+
+                    if i and i % 1000000 == 0:
+                        log("typesense index: Indexed %d rows" % i)
+                    i += 1
 
             if documents:
                 client.collections[collection_name].documents.import_(documents)
@@ -1,4 +1,5 @@
 import sys
+import uuid
 from time import asctime
 
 import psycopg2
@@ -7,6 +8,9 @@ from psycopg2.errors import OperationalError
 
 CRON_LOG_FILE = "lb-cron.log"
 
+# Default number of rows fetched at a time by stream_query
+STREAM_QUERY_BLOCK_SIZE = 10000
+
 
 def create_schema(conn):
     '''
@@ -31,6 +35,25 @@ def insert_rows(curs, table, values):
     execute_values(curs, query, values, template=None)
 
 
+def stream_query(conn, query, params=None, block_size=STREAM_QUERY_BLOCK_SIZE, cursor_factory=None, withhold=False):
+    '''
+        Run a query on a named server side cursor and yield its result in lists of up to block_size rows,
+        so that only one block of the result is held in memory at a time. Set withhold to keep the cursor
+        open when the transaction is committed while iterating. This is the same as
+        listenbrainz.db.stream_query, which can't be imported from here.
+    '''
+
+    with conn.cursor(name="stream_query_%s" % uuid.uuid4().hex, cursor_factory=cursor_factory,
+                     withhold=withhold) as curs:
+        curs.itersize = block_size
+        curs.execute(query, params)
+        while True:
+            rows = curs.fetchmany(block_size)
+            if not rows:
+                break
+            yield rows
+
+
 def log(*args):
     '''
         Super simple logging function that prepends timestamps. Did I mention I hate python's logging module?
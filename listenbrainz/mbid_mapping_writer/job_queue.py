@@ -9,9 +9,8 @@ import traceback
 from io import StringIO
 
 from flask import current_app
-import sqlalchemy
 from listenbrainz.listen import Listen
-from listenbrainz.db import timescale
+from listenbrainz.db import timescale, stream_query
 from listenbrainz.mbid_mapping_writer.matcher import process_listens
 from listenbrainz.labs_api.labs.api.mbid_mapping import MATCH_TYPES
 from listenbrainz.utils import init_cache
@@ -118,31 +117,28 @@ class MappingJobQueue(threading.Thread):
         # Load listens
         self.app.logger.info("Load more legacy listens for %s" % datetime.datetime.fromtimestamp(
             self.legacy_listens_index_date).strftime("%Y-%m-%d"))
-        query = """SELECT data->'track_metadata'->'additional_info'->>'recording_msid'::TEXT AS recording_msid,
+        query = """SELECT l.recording_msid::TEXT AS recording_msid,
                           track_name,
                           data->'track_metadata'->'artist_name' AS artist_name
-                     FROM listen
+                     FROM listen l
                 LEFT JOIN listen_join_listen_mbid_mapping lj
-                       ON data->'track_metadata'->'additional_info'->>'recording_msid' = lj.recording_msid::text
+                       ON l.recording_msid = lj.recording_msid
                  WHERE lj.recording_msid IS NULL
-                      AND listened_at <= :max_ts
-                      AND listened_at > :min_ts"""
+                      AND l.recording_msid IS NOT NULL
+                      AND listened_at <= %(max_ts)s
+                      AND listened_at > %(min_ts)s"""
 
         count = 0
         with timescale.engine.connect() as connection:
-            curs = connection.execute(sqlalchemy.text(query),
-                                      max_ts=self.legacy_listens_index_date,
-                                      min_ts=self.legacy_listens_index_date - LEGACY_LISTENS_LOAD_WINDOW)
-            while True:
-                result = curs.fetchone()
-                if not result:
-                    break
-
-                self.queue.put(JobItem(LEGACY_LISTEN, [{"data": {"artist_name": result[2],
-                                                                 "track_name": result[1]},
-                                                        "recording_msid": result[0],
-                                                        "legacy": True}]))
-                count += 1
+            params = {"max_ts": self.legacy_listens_index_date,
+                      "min_ts": self.legacy_listens_index_date - LEGACY_LISTENS_LOAD_WINDOW}
+            for rows in stream_query(connection.connection, query, params):
+                for result in rows:
+                    self.queue.put(JobItem(LEGACY_LISTEN, [{"data": {"artist_name": result[2],
+                                                                     "track_name": result[1]},
+                                                            "recording_msid": result[0],
+                                                            "legacy": True}]))
+                count += len(rows)
 
         # update cache entry and count
         self.legacy_listens_index_date -= LEGACY_LISTENS_LOAD_WINDOW
@@ -7,6 +7,7 @@ from psycopg2.extras import execute_values
 from listenbrainz.labs_api.labs.api.mbid_mapping import MBIDMappingQuery, MATCH_TYPES, MATCH_TYPE_NO_MATCH, MATCH_TYPE_EXACT_MATCH
 from listenbrainz.labs_api.labs.api.artist_credit_recording_lookup import ArtistCreditRecordingLookupQuery
 from listenbrainz.db import timescale
+from listenbrainz.listenstore.redis_listenstore import set_recent_listens_mbid_mappings
 
 
 MAX_THREADS = 2
@@ -25,13 +26,18 @@ def process_listens(app, listens, is_legacy_listen=False):
         stats[typ] = 0
 
     skipped = 0
+    # the MBID mappings of the new listens, for the recent listens of their users in redis
+    mappings = {}
 
     msids = {str(listen['recording_msid']): listen for listen in listens}
     stats["total"] = len(msids)
     if len(msids):
         if not is_legacy_listen:
             with timescale.engine.connect() as connection:
-                query = """SELECT recording_msid 
+                query = """SELECT recording_msid
+                                , recording_mbid::TEXT
+                                , release_mbid::TEXT
+                                , artist_mbids::TEXT[]
                              FROM listen_join_listen_mbid_mapping lj
                              JOIN listen_mbid_mapping mbid
                                ON mbid.id = lj.listen_mbid_mapping
@@ -45,10 +51,13 @@ def process_listens(app, listens, is_legacy_listen=False):
                     del msids[str(result[0])]
                     stats["processed"] += 1
                     skipped += 1
+                    if result[1] is not None:
+                        mappings[str(result[0])] = _api_mbid_mapping(*result[1:])
         else:
             stats["processed"] += len(msids)
 
         if len(msids) == 0:
+            _cache_mbid_mappings(app, mappings)
             return stats
 
         conn = timescale.engine.raw_connection()
@@ -112,8 +121,9 @@ def process_listens(app, listens, is_legacy_listen=False):
                                         , match_type
                                    FROM   data
                               ON CONFLICT DO NOTHING
-                                   RETURNING id AS join_id, recording_mbid, release_mbid, artist_credit_id
+                                   RETURNING id AS join_id, recording_mbid, release_mbid, artist_mbids, artist_credit_id
                                    )
+                           , mapping_insert AS (
                                 INSERT INTO listen_join_listen_mbid_mapping (recording_msid, listen_mbid_mapping)
                                 SELECT d.recording_msid
                                      , ji.join_id
@@ -121,8 +131,19 @@ def process_listens(app, listens, is_legacy_listen=False):
                                   JOIN join_insert ji
                                     ON ji.recording_mbid = d.recording_mbid
                                    AND ji.release_mbid = d.release_mbid
-                                   AND ji.artist_credit_id = d.artist_credit_id""" % ",".join(mogrified)
+                                   AND ji.artist_credit_id = d.artist_credit_id
+                             RETURNING recording_msid, listen_mbid_mapping
+                                   )
+                                SELECT mi.recording_msid
+                                     , ji.recording_mbid::TEXT
+                                     , ji.release_mbid::TEXT
+                                     , ji.artist_mbids::TEXT[]
+                                  FROM mapping_insert mi
+                                  JOIN join_insert ji
+                                    ON ji.join_id = mi.listen_mbid_mapping
+                                 WHERE ji.recording_mbid IS NOT NULL""" % ",".join(mogrified)
                 curs.execute(query)
+                inserted = curs.fetchall()
 
             except (psycopg2.OperationalError, psycopg2.errors.DatatypeMismatch) as err:
                 app.logger.info(
@@ -132,9 +153,34 @@ def process_listens(app, listens, is_legacy_listen=False):
 
         conn.commit()
 
+        if not is_legacy_listen:
+            for row in inserted:
+                mappings[str(row[0])] = _api_mbid_mapping(*row[1:])
+            _cache_mbid_mappings(app, mappings)
+
     return stats
 
 
+def _api_mbid_mapping(recording_mbid, release_mbid, artist_mbids):
+    """ The mbid_mapping of a listen as returned by the API """
+    return {
+        "recording_mbid": recording_mbid,
+        "release_mbid": release_mbid,
+        "artist_mbids": artist_mbids,
+    }
+
+
+def _cache_mbid_mappings(app, mappings):
+    """ Store the mappings for the recent listens of each user in redis, if they are kept """
+    if not mappings or not app.config.get("USER_RECENT_LISTENS_MAX"):
+        return
+    try:
+        set_recent_listens_mbid_mappings(mappings)
+    except Exception:
+        # Not critical, the recent listens are shown without mapping then
+        app.logger.error("Cannot store MBID mappings of recent listens in redis", exc_info=True)
+
+
 def lookup_listens(app, listens, stats, exact):
     """ Attempt an exact string lookup on the passed in listens. Return the maches and the
         listens that were NOT matched. if exact == True, use an exact PG lookup otherwise
@@ -26,7 +26,9 @@ RABBITMQ_PORT = 5672
 RABBITMQ_USERNAME = "guest"
 RABBITMQ_PASSWORD = "guest"
 RABBITMQ_VHOST = "/"
-MAXIMUM_RABBITMQ_CONNECTIONS = 2
+# Seconds the publisher of each webserver process waits for more listens to merge into one message,
+# only useful with threaded workers
+RABBITMQ_PUBLISH_BATCH_WINDOW = 0
 
 # RabbitMQ exchanges and queues
 INCOMING_EXCHANGE = "incoming"
@@ -13,11 +13,10 @@ from listenbrainz.domain.external_service import ExternalServiceError, ExternalS
     ExternalServiceInvalidGrantError
 from listenbrainz.domain.spotify import SpotifyService
 
-from listenbrainz.webserver.errors import APIBadRequest
 
 from dateutil import parser
 from flask import current_app, render_template
-from listenbrainz.webserver.views.api_tools import insert_payload, validate_listen, LISTEN_TYPE_IMPORT, LISTEN_TYPE_PLAYING_NOW
+from listenbrainz.webserver.views.api_tools import insert_payload, validate_listens, LISTEN_TYPE_IMPORT, LISTEN_TYPE_PLAYING_NOW
 from listenbrainz.db import user as db_user
 from listenbrainz.db.exceptions import DatabaseException
 from spotipy import SpotifyException
@@ -265,10 +264,9 @@ def parse_and_validate_spotify_plays(plays, listen_type):
                 (latest_listen_ts is None or listen['listened_at'] > latest_listen_ts):
             latest_listen_ts = listen['listened_at']
 
-        try:
-            listens.append(validate_listen(listen, listen_type))
-        except APIBadRequest:
-            pass
+        listens.append(listen)
+
+    listens, _ = validate_listens(listens, listen_type)
     return listens, latest_listen_ts
 
 
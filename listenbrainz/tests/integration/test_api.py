@@ -1,5 +1,6 @@
 import json
 import time
+from unittest import mock
 
 import pytest
 from flask import url_for, current_app
@@ -8,7 +9,7 @@ import listenbrainz.db.user as db_user
 import listenbrainz.db.user_relationship as db_user_relationship
 from listenbrainz import db
 from listenbrainz.tests.integration import ListenAPIIntegrationTestCase
-from listenbrainz.webserver import timescale_connection
+from listenbrainz.webserver import timescale_connection, redis_connection
 from listenbrainz.webserver.views.api_tools import is_valid_uuid
 
 
@@ -304,6 +305,24 @@ class APITestCase(ListenAPIIntegrationTestCase):
                                     user_name=self.user['musicbrainz_id']))
         self.assertEqual(r.json['payload']['count'], 0)
 
+    def test_playing_now_with_zero_duration(self):
+        """ Test that playing now listens with a duration of 0 are stored with the max duration
+        """
+        with open(self.path_to_data_file('playing_now_with_duration.json'), 'r') as f:
+            payload = json.load(f)
+        payload['payload'][0]['track_metadata']['additional_info']['duration'] = 0
+        response = self.send_data(payload)
+        self.assert200(response)
+        self.assertEqual(response.json['status'], 'ok')
+
+        time.sleep(1.1)
+
+        r = self.client.get(url_for('api_v1.get_playing_now',
+                                    user_name=self.user['musicbrainz_id']))
+        self.assertEqual(r.json['payload']['count'], 1)
+        self.assertEqual(r.json['payload']['listens'][0]
+                         ['track_metadata']['track_name'], 'Fade')
+
     def test_playing_now_with_ts(self):
         """ Test for invalid submission of listen_type 'playing_now' which contains
             timestamp 'listened_at'
@@ -846,6 +865,14 @@ class APITestCase(ListenAPIIntegrationTestCase):
         self.assert200(r)
         self.assertTrue(db_user_relationship.is_following_user(self.user.id, self.followed_user['id']))
 
+    def test_follow_user_invalidates_feeds_if_feed_reset_fails(self):
+        with mock.patch.dict(current_app.config, {'FEED_LISTENS_MAX': 10}), \
+                mock.patch.object(redis_connection._redis, 'reset_feed_listens', side_effect=Exception), \
+                mock.patch.object(redis_connection._redis, 'invalidate_feeds') as invalidate_feeds:
+            r = self.client.post(self.follow_user_url, headers=self.follow_user_headers)
+        self.assert200(r)
+        invalidate_feeds.assert_called_once()
+
     def test_follow_user_requires_login(self):
         r = self.client.post(self.follow_user_url)
         self.assert401(r)
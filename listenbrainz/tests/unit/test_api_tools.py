@@ -0,0 +1,59 @@
+import time
+import unittest
+import uuid
+
+from flask import Flask
+
+from listenbrainz.webserver.views.api_tools import validate_listens, validate_listen, is_valid_mbid, is_valid_uuid, \
+    LISTEN_TYPE_IMPORT
+
+
+class APIToolsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        # log_raise_400 logs through the app logger
+        self.app = Flask(__name__)
+
+    def _listen(self, listened_at, **additional_info):
+        return {
+            'listened_at': listened_at,
+            'track_metadata': {
+                'artist_name': ' Frank Ocean ',
+                'track_name': 'Lens',
+                'additional_info': additional_info,
+            },
+        }
+
+    def test_is_valid_mbid(self):
+        mbid = str(uuid.uuid4())
+        for value in (mbid, mbid.upper(), '{%s}' % mbid, 'urn:uuid:%s' % mbid, mbid.replace('-', ''),
+                      mbid + '\n', mbid[:-1], 'hjjkghjk', 123):
+            self.assertEqual(is_valid_mbid(value), is_valid_uuid(value), value)
+
+    def test_validate_listens(self):
+        recording_mbid = str(uuid.uuid4())
+        listens = [
+            self._listen(1500000000, recording_mbid=recording_mbid, artist_mbids=[recording_mbid, None], release_mbid=''),
+            {'track_metadata': {'artist_name': 'Frank Ocean', 'track_name': 'Lens'}},
+            self._listen(int(time.time()) + 7200),
+            self._listen(1500000001, recording_mbid='not an mbid'),
+        ]
+        with self.app.app_context():
+            validated, errors = validate_listens(listens, LISTEN_TYPE_IMPORT)
+
+        self.assertEqual(validated, [listens[0]])
+        self.assertEqual(validated[0]['track_metadata'], {
+            'artist_name': 'Frank Ocean',
+            'track_name': 'Lens',
+            'additional_info': {'recording_mbid': recording_mbid, 'artist_mbids': [recording_mbid]},
+        })
+        self.assertEqual([index for index, _ in errors], [1, 2, 3])
+        self.assertEqual(errors[0][1].message, "JSON document must contain the key listened_at at the top level.")
+        self.assertEqual(errors[1][1].message, "Value for key listened_at is too high.")
+        self.assertEqual(errors[2][1].message, "recording_mbid MBID format invalid.")
+
+        # the errors are the ones validate_listen raises
+        for index, error in errors:
+            with self.app.app_context(), self.assertRaises(type(error)) as cm:
+                validate_listen(listens[index], LISTEN_TYPE_IMPORT)
+            self.assertEqual(cm.exception.message, error.message)
@@ -0,0 +1,49 @@
+import unittest
+from unittest.mock import patch
+
+from sqlalchemy import create_engine
+from sqlalchemy.pool import NullPool
+
+from listenbrainz.db import pool
+from listenbrainz.db.pool import MeteredQueuePool
+
+
+class DbPoolTestCase(unittest.TestCase):
+
+    @patch("listenbrainz.db.pool.config")
+    def test_engine_options(self, mock_config):
+        mock_config.TIMESCALE_POOL_SIZE = 5
+        mock_config.TIMESCALE_POOL_MAX_OVERFLOW = 2
+        mock_config.TIMESCALE_POOL_PRE_PING = False
+        mock_config.TIMESCALE_POOL_RECYCLE = 600
+        mock_config.TIMESCALE_PGBOUNCER = False
+        self.assertEqual(pool.engine_options("TIMESCALE"), {
+            "poolclass": MeteredQueuePool,
+            "pool_size": 5,
+            "max_overflow": 2,
+            "pool_pre_ping": False,
+            "pool_recycle": 600,
+        })
+
+        mock_config.TIMESCALE_PGBOUNCER = True
+        self.assertEqual(pool.engine_options("TIMESCALE"), {"poolclass": NullPool})
+        self.assertEqual(pool.engine_options(None), {"poolclass": NullPool})
+
+    def test_metered_pool(self):
+        engine = create_engine("sqlite://", poolclass=MeteredQueuePool, pool_size=1, max_overflow=0)
+        pool.init_pool_metrics(engine, "test")
+        with engine.connect() as connection:
+            connection.execute("SELECT 1")
+        self.assertEqual(engine.pool.checkouts, 1)
+
+        engine.dispose()
+        self.assertEqual(engine.pool.metrics_name, "test")
+
+    def test_reset_autocommit(self):
+        class DBAPIConnection:
+            autocommit = True
+
+        connection = DBAPIConnection()
+        pool._reset_autocommit(connection, None)
+        self.assertFalse(connection.autocommit)
+        pool._reset_autocommit(None, None)
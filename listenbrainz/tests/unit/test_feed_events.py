@@ -0,0 +1,35 @@
+import unittest
+from types import SimpleNamespace
+
+from flask import Flask, current_app
+
+from listenbrainz.webserver.views.user_timeline_event_api import get_feed_events, merge_feed_events
+
+
+def _events(source, *timestamps):
+    return [SimpleNamespace(source=source, created=ts) for ts in timestamps]
+
+
+class FeedEventsTestCase(unittest.TestCase):
+
+    def test_merge_feed_events(self):
+        merged = merge_feed_events([
+            _events("listen", 5, 9, 1),
+            _events("follow", 8, 5),
+            _events("notification", 2, 7),  # notifications are returned oldest first
+        ], count=5)
+        # newest first, events with the same timestamp in the order of their sources
+        self.assertEqual([(e.source, e.created) for e in merged], [
+            ("listen", 9), ("follow", 8), ("notification", 7), ("listen", 5), ("follow", 5),
+        ])
+        self.assertEqual(merge_feed_events([[], []], count=5), [])
+
+    def test_get_feed_events(self):
+        def source(name, *timestamps):
+            # sources run in other threads, with the app context of the request
+            self.assertEqual(current_app.name, "feed")
+            return _events(name, *timestamps)
+
+        with Flask("feed").app_context():
+            events = get_feed_events([(source, ("listen", 3, 1)), (source, ("pin", 2))], count=2)
+        self.assertEqual([(e.source, e.created) for e in events], [("listen", 3), ("pin", 2)])
@@ -1,5 +1,5 @@
 import unittest
-from listenbrainz.listen import Listen
+from listenbrainz.listen import Listen, LazyListen
 from datetime import datetime
 import time
 import uuid
@@ -97,7 +97,7 @@ class ListenTestCase(unittest.TestCase):
             }
         )
 
-        listened_at, track_name, user_name, data = listen.to_timescale()
+        listened_at, track_name, user_name, data, recording_msid = listen.to_timescale()
 
         # Check data is of type string
         self.assertIsInstance(data, str)
@@ -113,6 +113,7 @@ class ListenTestCase(unittest.TestCase):
         self.assertEqual(listened_at, listen.ts_since_epoch)
         self.assertEqual(track_name, listen.data['track_name'])
         self.assertEqual(user_name, listen.user_name)
+        self.assertEqual(recording_msid, listen.recording_msid)
         self.assertEqual(json_data['user_id'], listen.user_id)
         self.assertEqual(json_data['track_metadata']['artist_name'], listen.data['artist_name'])
 
@@ -141,3 +142,35 @@ class ListenTestCase(unittest.TestCase):
             }
         with self.assertRaises(ValueError):
             Listen.from_json(data)
+
+    def test_lazy_listen(self):
+        listen = Listen(
+            timestamp=1525557084,
+            user_name='testuser',
+            user_id=1,
+            artist_msid=str(uuid.uuid4()),
+            recording_msid=str(uuid.uuid4()),
+            data={
+                'artist_name': 'Radiohead',
+                'track_name': 'True Love Waits',
+                'additional_info': {'tags': ['rock']},
+            }
+        )
+        listened_at, track_name, user_name, data, _ = listen.to_timescale()
+        created = datetime.utcfromtimestamp(1525557090)
+        mapping = ("99e087e1-5649-4e8c-b84f-eea05b8e143a", "4b6ca48c-f7db-439d-ba57-6104b5fec61e",
+                   ["e1564e98-978b-4947-8698-f6fd6f8b0181"])
+
+        expected = Listen.from_timescale(listened_at, track_name, user_name, created, ujson.loads(data), *mapping)
+        lazy = LazyListen(listened_at, track_name, user_name, created, data, *mapping)
+
+        # the timestamp and user name are available without decoding the listen
+        self.assertEqual(lazy.ts_since_epoch, expected.ts_since_epoch)
+        self.assertEqual(lazy.timestamp, expected.timestamp)
+        self.assertEqual(lazy.user_name, expected.user_name)
+        self.assertIsNone(lazy._json)
+
+        self.assertEqual(lazy.to_json(), expected.to_json())
+        self.assertEqual(lazy.to_api(), expected.to_api())
+        self.assertEqual(lazy.recording_msid, listen.recording_msid)
+        self.assertFalse(hasattr(lazy, '__dict__'))
@@ -0,0 +1,52 @@
+import unittest
+from unittest.mock import patch
+
+from listenbrainz.timescale_writer.msid_cache import MsidCache, REDIS_MSID_CACHE_KEY
+
+
+class MsidCacheTestCase(unittest.TestCase):
+
+    def test_key_ignores_case_and_key_order(self):
+        key1 = MsidCache.key({"artist": "Frank Ocean", "title": "Nights"})
+        key2 = MsidCache.key({"title": "NIGHTS", "artist": "frank ocean"})
+        self.assertEqual(key1, key2)
+        self.assertNotEqual(key1, MsidCache.key({"artist": "Frank Ocean", "title": "Ivy"}))
+
+    def test_lru_eviction(self):
+        msid_cache = MsidCache(2)
+        msid_cache.set_many({"a": {"recording_msid": "1"}, "b": {"recording_msid": "2"}})
+
+        # touch a, so that b is the least recently used entry
+        self.assertEqual(msid_cache.get_many(["a"]), {"a": {"recording_msid": "1"}})
+        msid_cache.set_many({"c": {"recording_msid": "3"}})
+
+        self.assertEqual(msid_cache.get_many(["a", "b", "c"]), {
+            "a": {"recording_msid": "1"},
+            "c": {"recording_msid": "3"},
+        })
+        self.assertEqual(msid_cache.evictions, 1)
+        self.assertEqual(msid_cache.hits, 3)
+        self.assertEqual(msid_cache.misses, 1)
+        self.assertEqual(msid_cache.hit_rate(), 0.75)
+
+    @patch("listenbrainz.timescale_writer.msid_cache.cache")
+    def test_redis_backing(self, mock_cache):
+        mock_cache.get_many.return_value = {REDIS_MSID_CACHE_KEY + "b": {"recording_msid": "2"}}
+        msid_cache = MsidCache(10, redis_expiry=60)
+        msid_cache.set_many({"a": {"recording_msid": "1"}})
+        mock_cache.set_many.assert_called_once_with({REDIS_MSID_CACHE_KEY + "a": {"recording_msid": "1"}}, expirein=60)
+
+        found = msid_cache.get_many(["a", "b", "c"])
+        mock_cache.get_many.assert_called_once_with([REDIS_MSID_CACHE_KEY + "b", REDIS_MSID_CACHE_KEY + "c"])
+        self.assertEqual(found, {"a": {"recording_msid": "1"}, "b": {"recording_msid": "2"}})
+
+        # entries found in redis are promoted to the in-process cache
+        self.assertIn("b", msid_cache.entries)
+
+    @patch("listenbrainz.timescale_writer.msid_cache.cache")
+    def test_duplicate_keys(self, mock_cache):
+        mock_cache.get_many.return_value = {}
+        msid_cache = MsidCache(10, redis_expiry=60)
+        self.assertEqual(msid_cache.get_many(["a", "b", "a"]), {})
+        mock_cache.get_many.assert_called_once_with([REDIS_MSID_CACHE_KEY + "a", REDIS_MSID_CACHE_KEY + "b"])
+        self.assertEqual(msid_cache.misses, 2)
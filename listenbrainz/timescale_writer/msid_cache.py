@@ -0,0 +1,80 @@
+from collections import OrderedDict
+from hashlib import sha256
+
+from brainzutils import cache
+
+from messybrainz.db.data import convert_to_messybrainz_json
+
+# Prefix for the redis keys of the optional second level cache, append the sha256 of the recording
+REDIS_MSID_CACHE_KEY = "msid."
+
+
+class MsidCache:
+    """ A bounded LRU cache of MessyBrainz ids, keyed on the sha256 of the lowercased
+        MessyBrainz JSON of a recording. MessyBrainz itself dedups recordings on this hash,
+        so a hit returns exactly the ids that a MessyBrainz lookup would have returned.
+
+        If redis_expiry is non-zero, entries are also stored in redis for that many seconds
+        so that the cache survives writer restarts and is shared between writers.
+    """
+
+    def __init__(self, max_size, redis_expiry=0):
+        self.max_size = max_size
+        self.redis_expiry = redis_expiry
+        self.entries = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key(messy_dict):
+        """ Return the cache key for a recording dict as submitted to MessyBrainz """
+        _, data_json = convert_to_messybrainz_json(messy_dict)
+        return sha256(data_json.encode("utf-8")).hexdigest()
+
+    def get_many(self, keys):
+        """ Look up the ids for the given keys. Returns a dict of key -> ids for the keys
+            that were found, moving them to the front of the LRU. Duplicate keys are looked up once.
+        """
+        found = {}
+        missing = []
+        for key in dict.fromkeys(keys):
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                found[key] = self.entries[key]
+            else:
+                missing.append(key)
+
+        if missing and self.redis_expiry:
+            cached = cache.get_many([REDIS_MSID_CACHE_KEY + key for key in missing])
+            for key in missing:
+                ids = cached.get(REDIS_MSID_CACHE_KEY + key)
+                if ids is not None:
+                    found[key] = ids
+                    self._add(key, ids)
+
+        self.hits += len(found)
+        self.misses += len(set(keys)) - len(found)
+        return found
+
+    def set_many(self, mapping):
+        """ Store a dict of key -> ids in the cache """
+        for key, ids in mapping.items():
+            self._add(key, ids)
+
+        if mapping and self.redis_expiry:
+            cache.set_many({REDIS_MSID_CACHE_KEY + key: ids for key, ids in mapping.items()},
+                           expirein=self.redis_expiry)
+
+    def _add(self, key, ids):
+        self.entries[key] = ids
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def hit_rate(self):
+        """ Return the fraction of lookups which were answered from the cache """
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
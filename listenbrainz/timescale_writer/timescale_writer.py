@@ -2,7 +2,8 @@
 import logging
 import sys
 import traceback
-from time import sleep, monotonic
+from multiprocessing import Process
+from time import sleep, monotonic, time
 from datetime import datetime
 
 import pika
@@ -12,20 +13,27 @@ from more_itertools import chunked
 from redis import Redis
 import psycopg2
 
+import listenbrainz.db.user_relationship as db_user_relationship
 from listenbrainz.listen import Listen
 from listenbrainz.listenstore import RedisListenStore
 from listenbrainz.listen_writer import ListenWriter
 from listenbrainz.listenstore import TimescaleListenStore
-from listenbrainz.webserver import create_app
+from listenbrainz.webserver import create_app, API_LISTENED_AT_ALLOWED_SKEW
 from listenbrainz.utils import init_cache
 from brainzutils import metrics, cache
 
+from listenbrainz.timescale_writer.msid_cache import MsidCache
 from listenbrainz.webserver.external import messybrainz
 from listenbrainz.webserver.views.api_tools import MAX_ITEMS_PER_MESSYBRAINZ_LOOKUP
 
 METRIC_UPDATE_INTERVAL = 60  # seconds
 LISTEN_INSERT_ERROR_SENTINEL = -1  #
 
+DEFAULT_MSID_CACHE_SIZE = 100000
+
+# The max number of seconds a partial batch of incoming messages waits before it is written
+DEFAULT_BATCH_TIMEOUT = 1
+
 
 def check_recursively_for_nulls(listen):
     for key, value in listen.items():
@@ -48,6 +56,7 @@ class TimescaleWriterSubscriber(ListenWriter):
         self.incoming_ch = None
         self.unique_ch = None
         self.redis_listenstore = None
+        self.msid_cache = None
 
         self.incoming_listens = 0
         self.unique_listens = 0
@@ -55,7 +64,56 @@ class TimescaleWriterSubscriber(ListenWriter):
 
     def callback(self, ch, method, properties, body):
 
-        listens = ujson.loads(body)
+        ret = self.process_listens(ujson.loads(body))
+
+        # If there is an error, we do not ack the message so that rabbitmq redelivers it later.
+        if ret == LISTEN_INSERT_ERROR_SENTINEL:
+            return ret
+
+        while True:
+            try:
+                self.incoming_ch.basic_ack(delivery_tag=method.delivery_tag)
+                break
+            except pika.exceptions.ConnectionClosed:
+                self.connect_to_rabbitmq()
+
+        return ret
+
+    def batch_callback(self, messages):
+        """ Process a batch of messages from the incoming queue as one insert and ack
+            all of them at once after the insert has committed.
+
+            Args:
+                messages: a list of (delivery_tag, body) tuples in the order they were delivered
+        """
+
+        listens = []
+        for _, body in messages:
+            listens.extend(ujson.loads(body))
+
+        ret = self.process_listens(listens)
+
+        # The messages in a batch are delivered in order on the same channel, so acking
+        # (or nacking) the last delivery tag with multiple=True covers the whole batch.
+        last_delivery_tag = messages[-1][0]
+        while True:
+            try:
+                if ret == LISTEN_INSERT_ERROR_SENTINEL:
+                    self.incoming_ch.basic_nack(delivery_tag=last_delivery_tag, multiple=True, requeue=True)
+                else:
+                    self.incoming_ch.basic_ack(delivery_tag=last_delivery_tag, multiple=True)
+                break
+            except pika.exceptions.ConnectionClosed:
+                self.connect_to_rabbitmq()
+
+        return ret
+
+    def process_listens(self, listens):
+        """ Look up the MessyBrainz ids for a list of listen dicts and insert them into the listenstore.
+
+            Returns: the return value of insert_to_listenstore
+        """
+
         non_null_listens = []
 
         for listen in listens:
@@ -78,20 +136,29 @@ class TimescaleWriterSubscriber(ListenWriter):
             except ValueError:
                 pass
 
-        ret = self.insert_to_listenstore(submit)
+        return self.insert_to_listenstore(submit)
 
-        # If there is an error, we do not ack the message so that rabbitmq redelivers it later.
-        if ret == LISTEN_INSERT_ERROR_SENTINEL:
-            return ret
+    def consume_in_batches(self, batch_size, batch_timeout):
+        """ Consume the incoming queue, merging up to batch_size messages into a single
+            insert. A partial batch is processed once it is batch_timeout seconds old.
+        """
 
-        while True:
-            try:
-                self.incoming_ch.basic_ack(delivery_tag=method.delivery_tag)
-                break
-            except pika.exceptions.ConnectionClosed:
-                self.connect_to_rabbitmq()
+        messages = []
+        batch_started = None
+        for method, _, body in self.incoming_ch.consume(queue=current_app.config['INCOMING_QUEUE'],
+                                                        inactivity_timeout=batch_timeout):
+            # method is None if no message arrived within batch_timeout
+            if method is not None:
+                if not messages:
+                    batch_started = monotonic()
+                messages.append((method.delivery_tag, body))
+
+            if not messages:
+                continue
 
-        return ret
+            if len(messages) >= batch_size or monotonic() - batch_started >= batch_timeout:
+                self.batch_callback(messages)
+                messages = []
 
     def messybrainz_lookup(self, listens):
         msb_listens = []
@@ -118,17 +185,32 @@ class TimescaleWriterSubscriber(ListenWriter):
 
             msb_listens.append(messy_dict)
 
-        try:
-            msb_responses = messybrainz.submit_listens(msb_listens)
-        except (messybrainz.exceptions.BadDataException, messybrainz.exceptions.ErrorAddingException):
-            current_app.logger.error("MessyBrainz lookup for listens failed: ", exc_info=True)
-            return []
-        except messybrainz.exceptions.NoDataFoundException:
-            return []
+        # Only send the recordings we haven't seen recently to MessyBrainz
+        keys = [MsidCache.key(messy_dict) for messy_dict in msb_listens]
+        cached = self.msid_cache.get_many(keys)
+        lookup = {}
+        for key, messy_dict in zip(keys, msb_listens):
+            if key not in cached:
+                lookup[key] = messy_dict
+
+        if lookup:
+            try:
+                msb_responses = messybrainz.submit_listens(list(lookup.values()))
+            except (messybrainz.exceptions.BadDataException, messybrainz.exceptions.ErrorAddingException):
+                current_app.logger.error("MessyBrainz lookup for listens failed: ", exc_info=True)
+                return []
+            except messybrainz.exceptions.NoDataFoundException:
+                return []
+
+            looked_up = {}
+            for key, messybrainz_resp in zip(lookup, msb_responses['payload']):
+                looked_up[key] = messybrainz_resp['ids']
+            self.msid_cache.set_many(looked_up)
+            cached.update(looked_up)
 
         augmented_listens = []
-        for listen, messybrainz_resp in zip(listens, msb_responses['payload']):
-            messybrainz_resp = messybrainz_resp['ids']
+        for listen, key in zip(listens, keys):
+            messybrainz_resp = cached[key]
 
             if 'additional_info' not in listen['track_metadata']:
                 listen['track_metadata']['additional_info'] = {}
@@ -221,14 +303,34 @@ class TimescaleWriterSubscriber(ListenWriter):
                 self.connect_to_rabbitmq()
 
         self.redis_listenstore.update_recent_listens(unique)
+        if self.redis_listenstore.feed_listens_max > 0:
+            self.add_listens_to_feeds(unique)
         self.unique_listens += len(unique)
 
         if monotonic() > self.metric_submission_time:
             self.metric_submission_time += METRIC_UPDATE_INTERVAL
-            metrics.set("timescale_writer", incoming_listens=self.incoming_listens, unique_listens=self.unique_listens)
+            metrics.set("timescale_writer", incoming_listens=self.incoming_listens, unique_listens=self.unique_listens,
+                        msid_cache_hits=self.msid_cache.hits, msid_cache_misses=self.msid_cache.misses,
+                        msid_cache_evictions=self.msid_cache.evictions, msid_cache_hit_rate=self.msid_cache.hit_rate())
 
         return len(data)
 
+    def add_listens_to_feeds(self, unique):
+        """ Add the unique listens to the feeds of the users who follow their listeners.
+
+            A feed missing listens would be served as complete, so if the listens cannot be added,
+            all feeds are invalidated. If that fails too, the error is raised and the writer exits,
+            a new writer invalidates the feeds when it starts.
+        """
+        try:
+            followers = db_user_relationship.get_follower_ids_of_users({listen.user_id for listen in unique})
+            self.redis_listenstore.add_listens_to_feeds(unique, followers,
+                                                        int(time()) + API_LISTENED_AT_ALLOWED_SKEW)
+        except Exception:
+            current_app.logger.error("Could not add listens to the feeds in redis, invalidating all feeds",
+                                     exc_info=True)
+            self.redis_listenstore.invalidate_feeds()
+
     def start(self):
         app = create_app()
         with app.app_context():
@@ -241,6 +343,9 @@ class TimescaleWriterSubscriber(ListenWriter):
                 sleep(self.ERROR_RETRY_DELAY)
                 sys.exit(-1)
 
+            self.msid_cache = MsidCache(current_app.config.get("MSID_CACHE_SIZE", DEFAULT_MSID_CACHE_SIZE),
+                                        redis_expiry=current_app.config.get("MSID_CACHE_REDIS_EXPIRY", 0))
+
             try:
                 while True:
                     try:
@@ -262,12 +367,22 @@ class TimescaleWriterSubscriber(ListenWriter):
                                            decode_responses=True)
                         self.redis.ping()
                         self.redis_listenstore = RedisListenStore(current_app.logger, current_app.config)
+                        # listens inserted by a writer which stopped before adding them to the feeds
+                        # are not redelivered as unique listens, so the feeds may be missing them
+                        if self.redis_listenstore.feed_listens_max > 0:
+                            self.redis_listenstore.invalidate_feeds()
                         break
                     except Exception as err:
                         current_app.logger.error("Cannot connect to redis: %s. Retrying in 2 seconds and trying again." %
                                                  str(err), exc_info=True)
                         sleep(self.ERROR_RETRY_DELAY)
 
+                batch_size = current_app.config.get('TIMESCALE_WRITER_BATCH_SIZE', 1)
+                batch_timeout = current_app.config.get('TIMESCALE_WRITER_BATCH_TIMEOUT', DEFAULT_BATCH_TIMEOUT)
+                # with fewer unacked messages than a batch holds, batches would never fill up
+                prefetch_count = max(current_app.config.get('TIMESCALE_WRITER_PREFETCH_COUNT', max(batch_size, 1) * 2),
+                                     batch_size)
+
                 while True:
                     self.connect_to_rabbitmq()
                     self.incoming_ch = self.connection.channel()
@@ -275,16 +390,21 @@ class TimescaleWriterSubscriber(ListenWriter):
                     self.incoming_ch.queue_declare(current_app.config['INCOMING_QUEUE'], durable=True)
                     self.incoming_ch.queue_bind(exchange=current_app.config['INCOMING_EXCHANGE'],
                                                 queue=current_app.config['INCOMING_QUEUE'])
-                    self.incoming_ch.basic_consume(
-                        queue=current_app.config['INCOMING_QUEUE'],
-                        on_message_callback=lambda ch, method, properties, body: self.static_callback(ch, method, properties, body, obj=self)
-                    )
+                    self.incoming_ch.basic_qos(prefetch_count=prefetch_count)
+                    if batch_size <= 1:
+                        self.incoming_ch.basic_consume(
+                            queue=current_app.config['INCOMING_QUEUE'],
+                            on_message_callback=lambda ch, method, properties, body: self.static_callback(ch, method, properties, body, obj=self)
+                        )
 
                     self.unique_ch = self.connection.channel()
                     self.unique_ch.exchange_declare(exchange=current_app.config['UNIQUE_EXCHANGE'], exchange_type='fanout')
 
                     try:
-                        self.incoming_ch.start_consuming()
+                        if batch_size > 1:
+                            self.consume_in_batches(batch_size, batch_timeout)
+                        else:
+                            self.incoming_ch.start_consuming()
                     except pika.exceptions.ConnectionClosed:
                         current_app.logger.warn("Connection to rabbitmq closed. Re-opening.", exc_info=True)
                         self.connection = None
@@ -296,6 +416,22 @@ class TimescaleWriterSubscriber(ListenWriter):
                 current_app.logger.error("failed to start timescale loop:", exc_info=True)
 
 
-if __name__ == "__main__":
+def start_writer():
     rc = TimescaleWriterSubscriber()
     rc.start()
+
+
+if __name__ == "__main__":
+    from listenbrainz import config
+
+    # Each worker process has its own connections and consumes from the same queue,
+    # rabbitmq distributes the incoming messages between them.
+    workers = getattr(config, "TIMESCALE_WRITER_WORKERS", 1)
+    if workers <= 1:
+        start_writer()
+    else:
+        processes = [Process(target=start_writer) for _ in range(workers)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
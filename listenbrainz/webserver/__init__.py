@@ -28,6 +28,7 @@ def create_timescale(app):
         'REDIS_PORT': app.config['REDIS_PORT'],
         'REDIS_NAMESPACE': app.config['REDIS_NAMESPACE'],
         'LISTEN_DUMP_TEMP_DIR_ROOT': app.config['LISTEN_DUMP_TEMP_DIR_ROOT'],
+        'USER_RECENT_LISTENS_MAX': app.config.get('USER_RECENT_LISTENS_MAX', 0),
     })
 
 
@@ -115,10 +116,10 @@ def gen_app(debug=None):
     # Database connections
     from listenbrainz import db
     from listenbrainz.db import timescale as ts
-    db.init_db_connection(app.config['SQLALCHEMY_DATABASE_URI'])
-    ts.init_db_connection(app.config['SQLALCHEMY_TIMESCALE_URI'])
+    db.init_db_connection(app.config['SQLALCHEMY_DATABASE_URI'], pool_prefix="DB")
+    ts.init_db_connection(app.config['SQLALCHEMY_TIMESCALE_URI'], pool_prefix="TIMESCALE")
     from listenbrainz.webserver.external import messybrainz
-    messybrainz.init_db_connection(app.config['MESSYBRAINZ_SQLALCHEMY_DATABASE_URI'])
+    messybrainz.init_db_connection(app.config['MESSYBRAINZ_SQLALCHEMY_DATABASE_URI'], pool_prefix="MESSYBRAINZ")
 
     if app.config['MB_DATABASE_URI']:
         from brainzutils import musicbrainz_db
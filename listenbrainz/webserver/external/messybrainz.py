@@ -3,6 +3,8 @@ import os
 import psycopg2
 import time
 
+from listenbrainz.db import pool
+
 try:
     # Should be able to continue if messybrainz package is unavailable during
     # documentation generation (we don't need it in this case).
@@ -14,10 +16,11 @@ except ImportError:
         raise
 
 
-def init_db_connection(uri):
+def init_db_connection(uri, pool_prefix=None):
     while True:
         try:
-            messybrainz.db.init_db_engine(uri)
+            messybrainz.db.init_db_engine(uri, **pool.engine_options(pool_prefix))
+            pool.init_pool_metrics(messybrainz.db.engine, pool_prefix)
             break
         except psycopg2.OperationalError as e:
             print("Couldn't establish connection to db: {}".format(str(e)))
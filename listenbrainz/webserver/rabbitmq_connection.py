@@ -1,19 +1,32 @@
+import os
 import queue
-from time import sleep
+import threading
+from collections import deque, OrderedDict
+from time import sleep, monotonic
+
 import pika
+import ujson
+from brainzutils import metrics
+
 from listenbrainz.utils import get_fallback_connection_name
-from flask import current_app
 
 _rabbitmq = None
 
 CONNECTION_RETRIES = 10
 TIME_BEFORE_RETRIES = 2
 
+PUBLISH_TIMEOUT = 30  # seconds a request waits for its data to be confirmed by RabbitMQ
+MAX_BATCH_REQUESTS = 100  # max number of publish requests merged into one message
+IDLE_INTERVAL = 1  # seconds after which an idle publisher services the connection heartbeats
+METRIC_UPDATE_INTERVAL = 60  # seconds
+PUBLISH_LATENCY_SAMPLES = 10000  # number of recent publish latencies the percentiles are calculated from
+
+
 def init_rabbitmq_connection(app):
     """Initialize the webserver rabbitmq connection.
 
-    This initializes _rabbitmq as a connection pool from which new RabbitMQ
-    connections can be acquired.
+    This initializes _rabbitmq as a publisher which lazily connects to RabbitMQ
+    in each process that publishes messages.
     """
     global _rabbitmq
 
@@ -35,113 +48,213 @@ def init_rabbitmq_connection(app):
         client_properties={"connection_name": get_fallback_connection_name()}
     )
 
-    _rabbitmq = RabbitMQConnectionPool(
+    _rabbitmq = RabbitMQPublisher(
             app.logger,
             connection_parameters,
-            app.config['MAXIMUM_RABBITMQ_CONNECTIONS'],
-            app.config['INCOMING_EXCHANGE'],
+            app.config.get('RABBITMQ_PUBLISH_BATCH_WINDOW', 0),
         )
 
 
-class RabbitMQConnectionPool:
-    """ The RabbitMQ connection pool used by the api and api_compat to publish messages to
-    the incoming queue."""
-    def __init__(self, logger, connection_parameters, max_size, exchange):
+class PublishRequest:
+    """ A list of items to publish to an exchange, and the outcome once the publisher has handled it """
+
+    def __init__(self, exchange, queue_name, data, wait=True):
+        self.exchange = exchange
+        self.queue_name = queue_name
+        self.data = data
+        self.wait = wait
+        self.created = monotonic()
+        self.done = threading.Event()
+        self.error = None
+
+
+class RabbitMQPublisher:
+    """ The RabbitMQ publisher used by the api and api_compat to publish messages to the incoming
+    and playing now queues.
+
+    A background thread owns a long lived connection and channel with publisher confirms enabled,
+    which is reconnected when it breaks. Requests hand their data to the thread and wait until
+    RabbitMQ has confirmed it. The data of all requests that are waiting for the same exchange
+    is merged into a single message. If batch_window is set, the thread waits up to that many
+    seconds for more requests to arrive before publishing, which only helps if the process serves
+    several requests at the same time.
+    """
+
+    def __init__(self, logger, connection_parameters, batch_window=0):
         self.log = logger
         self.connection_parameters = connection_parameters
-        self.max_size = max_size
-        self.queue = queue.Queue(maxsize=max_size)
-        self.exchange = exchange
+        self.batch_window = batch_window
+        self.lock = threading.Lock()
+        self.pid = None
+        self.thread = None
+        self.requests = None
+        self.connection = None
+        self.channel = None
+        self.declared = set()
 
-    def add(self):
-        try:
-            self.queue.put_nowait(self.create())
-        except queue.Full:
-            self.log.error('Tried to add a new connection into a full queue...', exc_info=True)
+        self.latencies = deque(maxlen=PUBLISH_LATENCY_SAMPLES)
+        self.messages = 0
+        self.published_requests = 0
+        self.metric_submission_time = monotonic() + METRIC_UPDATE_INTERVAL
+
+    def publish(self, exchange, queue_name, data, wait=True):
+        """ Publish the items of the list data to the exchange, declaring the exchange and the durable
+        queue_name if needed. Waits until RabbitMQ has confirmed the message that contains them,
+        unless wait is False, in which case publishing errors are only logged.
+
+        Raises:
+            TimeoutError: if the message isn't confirmed within PUBLISH_TIMEOUT seconds
+            the pika exception which made publishing fail otherwise
+        """
+        request = PublishRequest(exchange, queue_name, data, wait)
+        self._start()
+        self.requests.put(request)
+        if not wait:
+            return
+        if not request.done.wait(PUBLISH_TIMEOUT):
+            raise TimeoutError("RabbitMQ didn't confirm the message in %d seconds" % PUBLISH_TIMEOUT)
+        if request.error is not None:
+            raise request.error
 
-    def get(self):
+    def _start(self):
+        """ Start the publisher thread, once in every process. uwsgi forks its workers after the
+        app was created, the threads and connections of the parent aren't usable in a worker.
+        """
+        with self.lock:
+            if self.pid == os.getpid() and self.thread.is_alive():
+                return
+            self.pid = os.getpid()
+            self.requests = queue.Queue()
+            self.connection = None
+            self.channel = None
+            self.declared = set()
+            self.thread = threading.Thread(target=self._run, name="rabbitmq-publisher", daemon=True)
+            self.thread.start()
+
+    def _run(self):
         while True:
             try:
-                connection = self.queue.get_nowait()
-                if connection.is_open:
-                    return connection
+                batch = [self.requests.get(timeout=IDLE_INTERVAL)]
             except queue.Empty:
-                self.add()
+                self._process_data_events()
+                continue
 
-    def release(self, connection):
-        try:
-            # If we're running in the dev server, close connections since threads exit after the request
-            if current_app.debug:
-                connection.close()
-                return
+            deadline = monotonic() + self.batch_window
+            while len(batch) < MAX_BATCH_REQUESTS:
+                try:
+                    batch.append(self.requests.get(timeout=max(deadline - monotonic(), 0)))
+                except queue.Empty:
+                    break
 
-            if connection.is_open:
-                self.queue.put_nowait(connection)
-        except queue.Full:
-            self.log.error('Tried to put a connection into a full queue...', exc_info=True)
-            connection.close()
+            self._publish_batch(batch)
 
-    def create(self):
-        for attempt in range(CONNECTION_RETRIES):
-            try:
-                connection = pika.BlockingConnection(self.connection_parameters)
-                return RabbitMQConnection(connection, self)
-            except (pika.exceptions.ConnectionClosed, pika.exceptions.ChannelClosed) as e:
-                sleep(TIME_BEFORE_RETRIES)
-                if attempt == CONNECTION_RETRIES - 1: # if this is the last attempt
-                    self.log.critical('Unable to create a RabbitMQ connection: %s', str(e), exc_info=True)
-                    raise
+    def _publish_batch(self, batch):
+        """ Publish the data of all requests for the same exchange as one message """
+        by_exchange = OrderedDict()
+        for request in batch:
+            by_exchange.setdefault((request.exchange, request.queue_name), []).append(request)
 
+        for (exchange, queue_name), requests in by_exchange.items():
+            data = [item for request in requests for item in request.data]
+            error = None
+            try:
+                self._publish(exchange, queue_name, ujson.dumps(data))
+                self.messages += 1
+            except Exception as e:
+                # logged by the requests that wait for it
+                error = e
+                if not all(request.wait for request in requests):
+                    self.log.error("Cannot publish to exchange %s: %s", exchange, str(e), exc_info=True)
 
-class RabbitMQConnection:
-    def __init__(self, connection, pool):
-        self.connection = connection
-        self.channel = connection.channel()
-        self.pool = pool
+            now = monotonic()
+            self.published_requests += len(requests)
+            for request in requests:
+                self.latencies.append(now - request.created)
+                request.error = error
+                request.done.set()
 
-    def __enter__(self):
-        if not self.is_channel_open:
-            self.recreate_channel()
-        return self
+        if monotonic() > self.metric_submission_time:
+            self._submit_metrics()
 
-    def __exit__(self, type, value, traceback):
-        self.pool.release(self)
+    def _publish(self, exchange, queue_name, body):
+        """ Publish a message, reconnecting once if the connection turns out to be broken """
+        for attempt in range(2):
+            try:
+                channel = self._get_channel()
+                if (exchange, queue_name) not in self.declared:
+                    channel.exchange_declare(exchange=exchange, exchange_type='fanout')
+                    channel.queue_declare(queue_name, durable=True)
+                    self.declared.add((exchange, queue_name))
+                # with confirm_delivery enabled this returns once the broker confirmed the message
+                # and raises NackError if it refused it
+                channel.basic_publish(
+                    exchange=exchange,
+                    routing_key='',
+                    body=body,
+                    properties=pika.BasicProperties(delivery_mode=2, ),
+                )
+                return
+            except (pika.exceptions.AMQPConnectionError, pika.exceptions.AMQPChannelError, OSError):
+                self._close()
+                if attempt == 1:
+                    raise
 
-    @property
-    def is_channel_open(self):
-        """ Checks if current channel is open or not.
+    def _get_channel(self):
+        if self.channel is None or not self.channel.is_open:
+            if self.connection is None or not self.connection.is_open:
+                self.connection = self._connect()
+            self.channel = self.connection.channel()
+            self.channel.confirm_delivery()
+            self.declared = set()
+        return self.channel
 
-        Note: We cannot use channel.is_open because this is a BlockingChannel where the is_open
-        property is not trustworthy (https://github.com/pika/pika/issues/877)
+    def _connect(self):
+        for attempt in range(CONNECTION_RETRIES):
+            try:
+                return pika.BlockingConnection(self.connection_parameters)
+            except (pika.exceptions.ConnectionClosed, pika.exceptions.ChannelClosed, pika.exceptions.AMQPConnectionError) as e:
+                if attempt == CONNECTION_RETRIES - 1:  # if this is the last attempt
+                    self.log.critical('Unable to create a RabbitMQ connection: %s', str(e), exc_info=True)
+                    raise
+                sleep(TIME_BEFORE_RETRIES)
 
-        So we check if an exchange exists each time, to check if the channel is ok. This exchange
-        is the exchange which houses incoming listens.
+    def _process_data_events(self):
+        """ Let pika answer heartbeats while there is nothing to publish """
+        if self.connection is not None:
+            try:
+                self.connection.process_data_events()
+            except (pika.exceptions.AMQPConnectionError, OSError):
+                self._close()
 
-        Returns:
-            bool: True if channel is open, False otherwise
-        """
+    def _close(self):
         try:
-            self.channel.exchange_declare(exchange=self.pool.exchange, exchange_type='fanout', passive=True)
-            return True
-        except (pika.exceptions.ConnectionClosed, pika.exceptions.ChannelClosed, FileNotFoundError, OSError) as e:
-            return False
-
-    @property
-    def is_open(self):
-        """ Checks if current connection is open or not.
+            if self.connection is not None and self.connection.is_open:
+                self.connection.close()
+        except Exception:
+            pass
+        self.connection = None
+        self.channel = None
 
-        Note: We're using process_data_events here instead of the is_open property because of
-        https://github.com/pika/pika/issues/877
+    def latency_percentiles(self, percentiles=(50, 95, 99)):
+        """ Return a dict of percentile to the request publish latency in seconds, from the time a
+        request handed over its data until it was confirmed, over the recent requests
         """
-        try:
-            self.connection.process_data_events()
-            return True
-        except (pika.exceptions.ConnectionClosed, FileNotFoundError, OSError) as e:
-            return False
+        latencies = sorted(self.latencies)
+        if not latencies:
+            return {}
+        return {p: latencies[min(len(latencies) * p // 100, len(latencies) - 1)] for p in percentiles}
 
-    def recreate_channel(self):
-        self.channel = self.connection.channel()
-
-    def close(self):
-        if self.connection.is_open:
-            self.connection.close()
+    def _submit_metrics(self):
+        self.metric_submission_time = monotonic() + METRIC_UPDATE_INTERVAL
+        percentiles = self.latency_percentiles()
+        try:
+            metrics.set("rabbitmq_publisher",
+                        messages=self.messages,
+                        requests=self.published_requests,
+                        **{"publish_p%d_ms" % p: int(latency * 1000) for p, latency in percentiles.items()})
+        except Exception:
+            # Not critical, metrics are not initialized outside of the webserver
+            pass
+        self.messages = 0
+        self.published_requests = 0
+        self.latencies.clear()
@@ -1,27 +1,78 @@
 from flask import Flask
 from unittest import TestCase
 from unittest.mock import patch, MagicMock
+
+import ujson
 from pika.exceptions import ConnectionClosed
 
 import listenbrainz.webserver.rabbitmq_connection as rabbitmq_connection
 
-from listenbrainz.webserver.rabbitmq_connection import RabbitMQConnectionPool, CONNECTION_RETRIES, init_rabbitmq_connection
+from listenbrainz.webserver.rabbitmq_connection import RabbitMQPublisher, PublishRequest, CONNECTION_RETRIES, \
+    init_rabbitmq_connection
 
 
 
-class RabbitMQConnectionPoolTestCase(TestCase):
+class RabbitMQPublisherTestCase(TestCase):
 
     def setUp(self):
-        self.pool = RabbitMQConnectionPool(MagicMock(), MagicMock(), 10, 'test_exchange')
+        self.publisher = RabbitMQPublisher(MagicMock(), MagicMock())
 
     @patch('listenbrainz.webserver.rabbitmq_connection.pika.BlockingConnection')
     @patch('listenbrainz.webserver.rabbitmq_connection.sleep')
     def test_connection_closed_while_creating(self, mock_sleep, mock_blocking_connection):
         mock_blocking_connection.side_effect = ConnectionClosed(reply_code=200, reply_text='Normal Shutdown')
         with self.assertRaises(ConnectionClosed):
-            connection = self.pool.create()
-            self.pool.log.critical.assert_called_once()
-            self.assertEqual(self.mock_sleep.call_count, CONNECTION_RETRIES - 1)
+            self.publisher._connect()
+        self.publisher.log.critical.assert_called_once()
+        self.assertEqual(mock_sleep.call_count, CONNECTION_RETRIES - 1)
+
+    @patch('listenbrainz.webserver.rabbitmq_connection.pika.BlockingConnection')
+    def test_publish_batch(self, mock_blocking_connection):
+        channel = mock_blocking_connection.return_value.channel.return_value
+        requests = [
+            PublishRequest('incoming', 'incoming', [{'listened_at': 1}]),
+            PublishRequest('playing_now', 'playing_now', [{'listened_at': 2}]),
+            PublishRequest('incoming', 'incoming', [{'listened_at': 3}, {'listened_at': 4}]),
+        ]
+        self.publisher._publish_batch(requests)
+
+        # the requests for the same exchange are merged into one message, on a single channel with confirms
+        channel.confirm_delivery.assert_called_once()
+        bodies = [(kwargs['exchange'], ujson.loads(kwargs['body'])) for _, kwargs in channel.basic_publish.call_args_list]
+        self.assertEqual(bodies, [
+            ('incoming', [{'listened_at': 1}, {'listened_at': 3}, {'listened_at': 4}]),
+            ('playing_now', [{'listened_at': 2}]),
+        ])
+        for request in requests:
+            self.assertTrue(request.done.is_set())
+            self.assertIsNone(request.error)
+        self.assertEqual(set(self.publisher.latency_percentiles()), {50, 95, 99})
+
+        # the exchanges are only declared once per channel
+        self.publisher._publish_batch([PublishRequest('incoming', 'incoming', [{'listened_at': 5}])])
+        self.assertEqual(channel.exchange_declare.call_count, 2)
+        mock_blocking_connection.assert_called_once()
+
+    @patch('listenbrainz.webserver.rabbitmq_connection.pika.BlockingConnection')
+    def test_publish_reconnects(self, mock_blocking_connection):
+        channel = mock_blocking_connection.return_value.channel.return_value
+        channel.basic_publish.side_effect = [ConnectionClosed(reply_code=320, reply_text='Broker restarted'), None]
+        request = PublishRequest('incoming', 'incoming', [{'listened_at': 1}])
+        self.publisher._publish_batch([request])
+
+        self.assertIsNone(request.error)
+        self.assertEqual(mock_blocking_connection.call_count, 2)
+
+    @patch('listenbrainz.webserver.rabbitmq_connection.pika.BlockingConnection')
+    def test_publish_error_without_waiting(self, mock_blocking_connection):
+        channel = mock_blocking_connection.return_value.channel.return_value
+        channel.basic_publish.side_effect = ConnectionClosed(reply_code=320, reply_text='Broker restarted')
+        request = PublishRequest('playing_now', 'playing_now', [{'track_metadata': {}}], wait=False)
+        self.publisher._publish_batch([request])
+
+        # nobody waits for the request, so the publisher logs the error itself
+        self.assertIsInstance(request.error, ConnectionClosed)
+        self.publisher.log.error.assert_called_once()
 
     def test_connection_error_when_rabbitmq_down(self):
         # create an app with no RabbitMQ config
@@ -3,7 +3,7 @@ from typing import Tuple
 
 import ujson
 import psycopg2
-from flask import Blueprint, request, jsonify, current_app
+from flask import Blueprint, Response, request, jsonify, current_app, stream_with_context
 from brainzutils.musicbrainz_db import engine as mb_engine
 
 from data.model.external_service import ExternalServiceType
@@ -20,9 +20,9 @@ from listenbrainz.db import listens_importer
 from brainzutils.ratelimit import ratelimit
 import listenbrainz.webserver.redis_connection as redis_connection
 from listenbrainz.webserver.utils import REJECT_LISTENS_WITHOUT_EMAIL_ERROR
-from listenbrainz.webserver.views.api_tools import insert_payload, log_raise_400, validate_listen, parse_param_list,\
+from listenbrainz.webserver.views.api_tools import insert_payload, log_raise_400, validate_listens, parse_param_list,\
     is_valid_uuid, MAX_LISTEN_SIZE, MAX_ITEMS_PER_GET, DEFAULT_ITEMS_PER_GET, LISTEN_TYPE_SINGLE, LISTEN_TYPE_IMPORT,\
-    LISTEN_TYPE_PLAYING_NOW, validate_auth_header, get_non_negative_param
+    LISTEN_TYPE_PLAYING_NOW, validate_auth_header, get_non_negative_param, serialize_listens_payload
 from listenbrainz.webserver.views.playlist_api import serialize_jspf
 from listenbrainz.listenstore.timescale_listenstore import TimescaleListenStoreException
 from listenbrainz.webserver.timescale_connection import _ts
@@ -86,7 +86,9 @@ def submit_listen():
         log_raise_400("Invalid JSON document submitted.", raw_data)
 
     # validate listens to make sure json is okay
-    validated_payload = [validate_listen(listen, listen_type) for listen in payload]
+    validated_payload, errors = validate_listens(payload, listen_type)
+    if errors:
+        raise errors[0][1]
 
     try:
         insert_payload(validated_payload, user, listen_type)
@@ -122,22 +124,27 @@ def get_listens(user_name):
     if min_ts and max_ts and min_ts >= max_ts:
         raise APIBadRequest("min_ts should be less than max_ts")
 
+    # The latest listens page is what profile pages request, serve it from redis when possible
+    latest_page = min_ts is None and max_ts is None
+    if latest_page:
+        page = db_conn.get_cached_listens_page(user_name, count)
+        if page is not None:
+            return Response(page, mimetype="application/json")
+
     listens, _, max_ts_per_user = db_conn.fetch_listens(
         user_name,
         limit=count,
         from_ts=min_ts,
-        to_ts=max_ts
+        to_ts=max_ts,
+        as_json=True
     )
-    listen_data = []
-    for listen in listens:
-        listen_data.append(listen.to_api())
+    output = serialize_listens_payload(listens, user_id=user_name, latest_listen_ts=max_ts_per_user)
+    if not latest_page:
+        return Response(stream_with_context(output), mimetype="application/json")
 
-    return jsonify({'payload': {
-        'user_id': user_name,
-        'count': len(listen_data),
-        'listens': listen_data,
-        'latest_listen_ts': max_ts_per_user,
-    }})
+    page = "".join(output)
+    db_conn.set_cached_listens_page(user_name, count, page)
+    return Response(page, mimetype="application/json")
 
 
 @api_bp.route("/user/<user_name>/listen-count")
@@ -231,17 +238,11 @@ def get_recent_listens_for_user_list(user_list):
     db_conn = webserver.create_timescale(current_app)
     listens = db_conn.fetch_recent_listens_for_users(
         users,
-        limit=limit
+        limit=limit,
+        as_json=True
     )
-    listen_data = []
-    for listen in listens:
-        listen_data.append(listen.to_api())
-
-    return jsonify({'payload': {
-        'user_list': user_list,
-        'count': len(listen_data),
-        'listens': listen_data,
-    }})
+    output = serialize_listens_payload(listens, user_list=user_list)
+    return Response(stream_with_context(output), mimetype="application/json")
 
 
 @api_bp.route("/user/<user_name>/similar-users", methods=['GET', 'OPTIONS'])
@@ -1,7 +1,8 @@
-from typing import Dict
+from typing import Dict, List, Tuple
 from urllib.parse import urlparse
 
 import bleach
+import re
 
 import listenbrainz.webserver.rabbitmq_connection as rabbitmq_connection
 import listenbrainz.webserver.redis_connection as redis_connection
@@ -31,7 +32,11 @@ MAX_ITEMS_PER_GET = 100
 #: The default number of listens returned in a single GET request.
 DEFAULT_ITEMS_PER_GET = 25
 
-MAX_ITEMS_PER_MESSYBRAINZ_LOOKUP = 10
+MAX_ITEMS_PER_MESSYBRAINZ_LOOKUP = 100
+
+#: Matches MBIDs in the canonical form nearly all clients submit them in, anything
+#: else is still checked with is_valid_uuid.
+CANONICAL_MBID_RE = re.compile(r"[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}")
 
 
 # Define the values for types of listens
@@ -57,19 +62,12 @@ def insert_payload(payload, user, listen_type=LISTEN_TYPE_IMPORT):
 
 def handle_playing_now(listen):
     """ Check that the listen doesn't already exist in redis and put it in
-    there if it isn't.
+    there if it isn't. Both happen in a single redis call.
 
     Returns:
         listen if new playing now listen, None otherwise
     """
-    old_playing_now = redis_connection._redis.get_playing_now(listen['user_id'])
-
     track_metadata = listen['track_metadata']
-    if old_playing_now and \
-            listen['track_metadata']['track_name'] == old_playing_now.data['track_name'] and \
-            listen['track_metadata']['artist_name'] == old_playing_now.data['artist_name']:
-        return None
-
     listen_timeout = None
     if 'additional_info' in track_metadata:
         additional_info = track_metadata['additional_info']
@@ -77,9 +75,11 @@ def handle_playing_now(listen):
             listen_timeout = additional_info['duration']
         elif 'duration_ms' in additional_info:
             listen_timeout = additional_info['duration_ms'] // 1000
-    if listen_timeout is None:
+    # redis only accepts a positive whole number of seconds as expiry time
+    if not isinstance(listen_timeout, int) or listen_timeout <= 0:
         listen_timeout = current_app.config['PLAYING_NOW_MAX_DURATION']
-    redis_connection._redis.put_playing_now(listen['user_id'], listen, listen_timeout)
+    if not redis_connection._redis.update_playing_now(listen['user_id'], listen, listen_timeout):
+        return None
     return listen
 
 
@@ -118,13 +118,36 @@ def _send_listens_to_queue(listen_type, listens):
             exchange=exchange,
             queue=queue,
             error_msg='Cannot submit listens to queue, please try again later.',
+            # playing now listens are already stored in redis, their message only notifies
+            # listeners of the change, so don't keep the request waiting for the broker
+            wait=listen_type != LISTEN_TYPE_PLAYING_NOW,
         )
 
 
 def validate_listen(listen: Dict, listen_type) -> Dict:
     """Make sure that required keys are present, filled out and not too large.
     The function may also mutate listens in place if needed."""
+    return _validate_listen(listen, listen_type, int(time.time()) + API_LISTENED_AT_ALLOWED_SKEW)
+
 
+def validate_listens(listens: List[Dict], listen_type) -> Tuple[List[Dict], List[Tuple[int, APIBadRequest]]]:
+    """ Validate all listens of a payload like validate_listen, which mutates them in place if needed.
+
+    Returns:
+        a tuple of the list of valid listens and a list of (index in listens, APIBadRequest)
+        tuples for the invalid ones
+    """
+    max_listened_at = int(time.time()) + API_LISTENED_AT_ALLOWED_SKEW
+    validated, errors = [], []
+    for i, listen in enumerate(listens):
+        try:
+            validated.append(_validate_listen(listen, listen_type, max_listened_at))
+        except APIBadRequest as e:
+            errors.append((i, e))
+    return validated, errors
+
+
+def _validate_listen(listen: Dict, listen_type, max_listened_at: int) -> Dict:
     if listen is None:
         raise APIBadRequest("Listen is empty and cannot be validated.")
 
@@ -144,7 +167,7 @@ def validate_listen(listen: Dict, listen_type) -> Dict:
         # if timestamp is too high, raise BadRequest
         # in order to make up for possible clock skew, we allow
         # timestamps to be one hour ahead of server time
-        if not is_valid_timestamp(listen['listened_at']):
+        if listen['listened_at'] > max_listened_at:
             raise APIBadRequest("Value for key listened_at is too high.", listen)
 
     elif listen_type == LISTEN_TYPE_PLAYING_NOW:
@@ -209,6 +232,11 @@ def is_valid_uuid(u):
         return False
 
 
+def is_valid_mbid(mbid):
+    """ Same as is_valid_uuid, but avoids creating a UUID for MBIDs in canonical form """
+    return (isinstance(mbid, str) and CANONICAL_MBID_RE.fullmatch(mbid) is not None) or is_valid_uuid(mbid)
+
+
 def _get_augmented_listens(payload, user):
     """ Converts the payload to augmented list after adding user_id and user_name attributes """
     for listen in payload:
@@ -247,7 +275,7 @@ def validate_single_mbid_field(listen, key):
             del listen['track_metadata']['additional_info'][key]
             return
 
-        if not is_valid_uuid(mbid):  # if the mbid is invalid raise an error
+        if not is_valid_mbid(mbid):  # if the mbid is invalid raise an error
             log_raise_400("%s MBID format invalid." % (key, ), listen)
 
 
@@ -273,7 +301,7 @@ def validate_multiple_mbids_field(listen, key):
         mbids = [x for x in mbids if x]  # drop None and "" from list of mbids if any
 
         for mbid in mbids:
-            if not is_valid_uuid(mbid):   # if the mbid is invalid raise an error
+            if not is_valid_mbid(mbid):   # if the mbid is invalid raise an error
                 log_raise_400("%s MBID format invalid." % (key,), listen)
 
         listen['track_metadata']['additional_info'][key] = mbids  # set the filtered in the listen payload
@@ -291,7 +319,23 @@ def is_valid_timestamp(ts):
     return ts <= int(time.time()) + API_LISTENED_AT_ALLOWED_SKEW
 
 
-def publish_data_to_queue(data, exchange, queue, error_msg):
+def serialize_listens_payload(listens, **fields):
+    """ Return a generator of string fragments of a listens API response. The listens are
+        JSON strings as returned by the listenstore with as_json set, they are written out as
+        they are. fields are added to the payload next to count and listens.
+    """
+    yield '{"payload":{'
+    for key, value in fields.items():
+        yield ujson.dumps(key) + ':' + ujson.dumps(value) + ','
+    yield '"count":%d,"listens":[' % len(listens)
+    for i, listen in enumerate(listens):
+        if i:
+            yield ','
+        yield listen
+    yield ']}}'
+
+
+def publish_data_to_queue(data, exchange, queue, error_msg, wait=True):
     """ Publish specified data to the specified queue.
 
     Args:
@@ -299,18 +343,10 @@ def publish_data_to_queue(data, exchange, queue, error_msg):
         exchange (str): the name of the exchange
         queue (str): the name of the queue
         error_msg (str): the error message to be returned in case of an error
+        wait (bool): whether to wait until RabbitMQ confirmed the data
     """
     try:
-        with rabbitmq_connection._rabbitmq.get() as connection:
-            channel = connection.channel
-            channel.exchange_declare(exchange=exchange, exchange_type='fanout')
-            channel.queue_declare(queue, durable=True)
-            channel.basic_publish(
-                exchange=exchange,
-                routing_key='',
-                body=ujson.dumps(data),
-                properties=pika.BasicProperties(delivery_mode=2, ),
-            )
+        rabbitmq_connection._rabbitmq.publish(exchange, queue, data, wait=wait)
     except pika.exceptions.ConnectionClosed as e:
         current_app.logger.error("Connection to rabbitmq closed while trying to publish: %s" % str(e), exc_info=True)
         raise APIServiceUnavailable(error_msg)
@@ -23,6 +23,7 @@ from listenbrainz.webserver.errors import APIServiceUnavailable, APINotFound, AP
 
 from listenbrainz import webserver
 from listenbrainz.db.exceptions import DatabaseException
+from listenbrainz.listenstore.timescale_listenstore import LISTEN_JSON_EXPORT
 from listenbrainz.webserver import flash
 from listenbrainz.webserver.login import api_login_required
 from listenbrainz.webserver.views.user import delete_user, delete_listens_history
@@ -122,15 +123,17 @@ def fetch_listens(musicbrainz_id, to_ts):
     """
     Fetch all listens for the user from listenstore by making repeated queries
     to listenstore until we get all the data. Returns a generator that streams
-    the results.
+    the results as API JSON strings.
     """
     db_conn = webserver.create_timescale(current_app)
     while True:
-        batch, _, _ = db_conn.fetch_listens(current_user.musicbrainz_id, to_ts=to_ts, limit=EXPORT_FETCH_COUNT)
+        batch, _, _ = db_conn.fetch_listens(current_user.musicbrainz_id, to_ts=to_ts, limit=EXPORT_FETCH_COUNT,
+                                            as_json=LISTEN_JSON_EXPORT)
         if not batch:
             break
         yield from batch
-        to_ts = batch[-1].ts_since_epoch  # new to_ts will be the the timestamp of the last listen fetched
+        # new to_ts will be the the timestamp of the last listen fetched
+        to_ts = ujson.loads(batch[-1])['listened_at']
 
 
 def fetch_feedback(user_id):
@@ -148,11 +151,12 @@ def fetch_feedback(user_id):
         offset += len(batch)
 
 
-def stream_json_array(elements):
-    """ Return a generator of string fragments of the elements encoded as array. """
+def stream_json_array(elements, encoded=False):
+    """ Return a generator of string fragments of the elements encoded as array.
+    Pass encoded if the elements already are JSON strings. """
     for i, element in enumerate(elements):
         yield '[' if i == 0 else ','
-        yield ujson.dumps(element)
+        yield element if encoded else ujson.dumps(element)
     yield ']'
 
 
@@ -170,7 +174,7 @@ def export_data():
         # immediately.
         to_ts = int(time())
         listens = fetch_listens(current_user.musicbrainz_id, to_ts)
-        output = stream_json_array(listen.to_api() for listen in listens)
+        output = stream_json_array(listens, encoded=True)
 
         response = Response(stream_with_context(output))
         response.headers["Content-Disposition"] = "attachment; filename=" + filename
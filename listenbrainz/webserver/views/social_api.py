@@ -3,6 +3,7 @@ from flask import Blueprint, current_app, jsonify
 import listenbrainz.db.user as db_user
 import listenbrainz.db.user_relationship as db_user_relationship
 
+from listenbrainz.webserver import redis_connection
 from listenbrainz.webserver.decorators import crossdomain
 from listenbrainz.webserver.errors import APINotFound, APIInternalServerError, APIBadRequest
 from brainzutils.ratelimit import ratelimit
@@ -110,6 +111,8 @@ def follow_user(user_name: str):
         current_app.logger.error("Error while trying to insert a relationship: %s", str(e))
         raise APIInternalServerError("Something went wrong, please try again later")
 
+    _reset_feed_listens(current_user["id"])
+
     return jsonify({"status": "ok"})
 
 
@@ -139,4 +142,25 @@ def unfollow_user(user_name: str):
         current_app.logger.error("Error while trying to delete a relationship: %s", str(e))
         raise APIInternalServerError("Something went wrong, please try again later")
 
+    _reset_feed_listens(current_user["id"])
+
     return jsonify({"status": "ok"})
+
+
+def _reset_feed_listens(user_id: int):
+    """ Drop the listens of the feed of the user kept in redis, which are of the users the user followed before.
+
+    The feed would be served without the earlier listens of a newly followed user, so if it cannot be
+    dropped, all feeds are invalidated, and if that fails too, the request fails.
+    """
+    if current_app.config.get("FEED_LISTENS_MAX", 0) <= 0:
+        return
+    try:
+        redis_connection._redis.reset_feed_listens(user_id)
+    except Exception as e:
+        current_app.logger.error("Error while trying to reset the feed listens: %s", str(e))
+        try:
+            redis_connection._redis.invalidate_feeds()
+        except Exception as e:
+            current_app.logger.error("Error while trying to invalidate the feeds: %s", str(e))
+            raise APIInternalServerError("Something went wrong, please try again later")
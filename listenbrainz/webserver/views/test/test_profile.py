@@ -237,6 +237,7 @@ class ProfileViewsTestCase(IntegrationTestCase):
 
         # We expect three calls to fetch_listens, and we return two, one, and
         # zero listens in the batch. This tests that we fetch all batches.
+        listens = [ujson.dumps(listen.to_api()) for listen in listens]
         mock_fetch_listens.side_effect = [(listens[0:2], 0, 0), (listens[2:3], 0, 0), ([], 0, 0)]
 
         r = self.client.post(url_for('profile.export_data'))
@@ -16,11 +16,16 @@
 # with this program; if not, write to the Free Software Foundation, Inc.,
 # 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
 
+import heapq
+import itertools
+import os
 import pydantic
+import threading
 import time
 import ujson
 
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional, List, Tuple
 
 from flask import Blueprint, jsonify, request, current_app
@@ -35,6 +40,7 @@ from data.model.user_timeline_event import RecordingRecommendationMetadata, APIT
 from listenbrainz.db.pinned_recording import get_pins_for_feed
 from listenbrainz.db.model.pinned_recording import fetch_track_metadata_for_pins
 from listenbrainz import webserver
+from listenbrainz.webserver import redis_connection
 from listenbrainz.db.exceptions import DatabaseException
 from listenbrainz.listenstore import TimescaleListenStore
 from listenbrainz.webserver.views.api import _validate_get_endpoint_params
@@ -45,6 +51,11 @@ from listenbrainz.webserver.views.api_tools import validate_auth_header, _filter
 from brainzutils.ratelimit import ratelimit
 
 MAX_LISTEN_EVENTS_PER_USER = 2 # the maximum number of listens we want to return in the feed per user
+FEED_SOURCE_WORKERS = 10  # the number of threads of each process which fetch the events of the feed sources
+
+_feed_executor = None
+_feed_executor_pid = None
+_feed_executor_lock = threading.Lock()
 
 user_timeline_event_api_bp = Blueprint('user_timeline_event_api_bp', __name__)
 
@@ -189,49 +200,29 @@ def user_feed(user_name: str):
 
     # get all listen events
     musicbrainz_ids = [user['musicbrainz_id'] for user in users_following]
-    if len(users_following) == 0:
-        listen_events = []
-    else:
-        listen_events = get_listen_events(db_conn, musicbrainz_ids, min_ts, max_ts, count)
 
     # for events like "follow" and "recording recommendations", we want to show the user
     # their own events as well
     users_for_feed_events = users_following + [user]
-    follow_events = get_follow_events(
-        user_ids=tuple(user['id'] for user in users_for_feed_events),
-        min_ts=min_ts or 0,
-        max_ts=max_ts or int(time.time()),
-        count=count,
-    )
-
-    recording_recommendation_events = get_recording_recommendation_events(
-        users_for_events=users_for_feed_events,
-        min_ts=min_ts or 0,
-        max_ts=max_ts or int(time.time()),
-        count=count,
-    )
-
-    notification_events = get_notification_events(user, count)
-
-    recording_pin_events = get_recording_pin_events(
-        users_for_events=users_for_feed_events,
-        min_ts=min_ts or 0,
-        max_ts=max_ts or int(time.time()),
-        count=count,
-    )
+    user_ids = tuple(user['id'] for user in users_for_feed_events)
+    events_min_ts = min_ts or 0
+    events_max_ts = max_ts or int(time.time())
 
     # TODO: add playlist event and like event
-    all_events = sorted(
-        listen_events + follow_events + recording_recommendation_events + recording_pin_events + notification_events,
-        key=lambda event: -event.created,
-    )
+    sources = [
+        (get_follow_events, (user_ids, events_min_ts, events_max_ts, count)),
+        (get_recording_recommendation_events, (users_for_feed_events, events_min_ts, events_max_ts, count)),
+        (get_recording_pin_events, (users_for_feed_events, events_min_ts, events_max_ts, count)),
+        (get_notification_events, (user, count)),
+    ]
+    if len(users_following) > 0:
+        sources.insert(0, (get_listen_events, (db_conn, musicbrainz_ids, min_ts, max_ts, count, user['id'])))
+    all_events = get_feed_events(sources, count)
 
     # sadly, we need to serialize the event_type ourselves, otherwise, jsonify converts it badly
     for index, event in enumerate(all_events):
         all_events[index].event_type = event.event_type.value
 
-    all_events = all_events[:count]
-
     return jsonify({'payload': {
         'count': len(all_events),
         'user_id': user_name,
@@ -289,14 +280,55 @@ def delete_feed_events(user_name):
         raise APIBadRequest(f"Invalid JSON: {str(e)}")
 
 
+def get_feed_events(sources, count: int) -> List[APITimelineEvent]:
+    """ Fetch the events of all feed sources concurrently and return the count most recent ones.
+
+    Args:
+        sources: a list of (function, args) tuples, each function returns a list of events
+        count: the number of events to return
+
+    Returns:
+        the most recent events of all sources, newest first. Events with the same timestamp
+        are ordered like their sources.
+    """
+    app = current_app._get_current_object()
+    futures = [_get_feed_executor().submit(_call_with_app_context, app, source, args) for source, args in sources]
+    return merge_feed_events([future.result() for future in futures], count)
+
+
+def merge_feed_events(event_lists, count: int) -> list:
+    """ Merge lists of events into the count most recent events, newest first """
+    streams = [sorted(events, key=lambda event: -event.created) for events in event_lists]
+    return list(itertools.islice(heapq.merge(*streams, key=lambda event: -event.created), count))
+
+
+def _call_with_app_context(app, function, args):
+    with app.app_context():
+        return function(*args)
+
+
+def _get_feed_executor() -> ThreadPoolExecutor:
+    """ Return the thread pool of this process, uwsgi forks its workers after the app was created """
+    global _feed_executor, _feed_executor_pid
+    with _feed_executor_lock:
+        if _feed_executor is None or _feed_executor_pid != os.getpid():
+            _feed_executor = ThreadPoolExecutor(max_workers=FEED_SOURCE_WORKERS, thread_name_prefix="feed")
+            _feed_executor_pid = os.getpid()
+        return _feed_executor
+
+
 def get_listen_events(
     db_conn: TimescaleListenStore,
     musicbrainz_ids: List[str],
     min_ts: int,
     max_ts: int,
     count: int,
+    user_id: Optional[int] = None,
 ) -> List[APITimelineEvent]:
     """ Gets all listen events in the feed.
+
+    If FEED_LISTENS_MAX is set, the listens are looked up from the feed of the user with id user_id
+    that the timescale writer keeps in redis, if it holds the requested range.
     """
 
     # NOTE: For now, we get a bunch of listens for the users the current
@@ -304,13 +336,24 @@ def get_listen_events(
     # could be done better by writing a complex query to get exactly 2 listens for each user,
     # but I'm happy with this heuristic for now and we can change later.
     db_conn = webserver.create_timescale(current_app)
-    listens, _, _ = db_conn.fetch_listens_for_multiple_users_from_storage(
-        musicbrainz_ids,
-        limit=count,
-        from_ts=min_ts,
-        to_ts=max_ts,
-        order=0,  # descending
-    )
+    refs = None
+    if user_id is not None and current_app.config.get('FEED_LISTENS_MAX', 0) > 0:
+        try:
+            refs = redis_connection._redis.get_feed_listens(user_id, min_ts, max_ts, count)
+        except Exception:
+            current_app.logger.error("Could not get the feed listens from redis", exc_info=True)
+
+    if refs is not None:
+        followed = set(musicbrainz_ids)
+        listens = db_conn.fetch_listens_by_refs([ref for ref in refs if ref[1] in followed])
+    else:
+        listens, _, _ = db_conn.fetch_listens_for_multiple_users_from_storage(
+            musicbrainz_ids,
+            limit=count,
+            from_ts=min_ts,
+            to_ts=max_ts,
+            order=0,  # descending
+        )
 
     user_listens_map = defaultdict(list)
     for listen in listens:
@@ -1,9 +1,11 @@
 from datetime import datetime
 
+import listenbrainz.benchmark_manager as benchmark_manager
 import listenbrainz.db.dump_manager as dump_manager
 import listenbrainz.spark.request_manage as spark_request_manage
 from listenbrainz.listenstore.timescale_utils import recalculate_all_user_data as ts_recalculate_all_user_data, \
-    refresh_listen_count_aggregate as ts_refresh_listen_count_aggregate
+    refresh_listen_count_aggregate as ts_refresh_listen_count_aggregate, \
+    backfill_listen_recording_msid as ts_backfill_listen_recording_msid
 
 from listenbrainz import db
 from listenbrainz.db import timescale as ts
@@ -288,9 +290,18 @@ def refresh_continuous_aggregates():
     ts_refresh_listen_count_aggregate()
 
 
+@cli.command(name="backfill_listen_recording_msid")
+def backfill_listen_recording_msid():
+    """
+        Fill the recording_msid column of existing listens from the listen data, one chunk at a time.
+    """
+    ts_backfill_listen_recording_msid()
+
+
 # Add other commands here
 cli.add_command(spark_request_manage.cli, name="spark")
 cli.add_command(dump_manager.cli, name="dump")
+cli.add_command(benchmark_manager.cli, name="benchmark")
 
 
 if __name__ == '__main__':
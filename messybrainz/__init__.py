@@ -86,9 +86,9 @@ def insert_all_in_transaction(recordings):
         A list of dicts containing the recording data for each inserted recording
     """
 
-    ret = []
+    if not recordings:
+        return []
+
     with db.engine.begin() as connection:
-        for recording in recordings:
-            result = insert_single(connection, recording)
-            ret.append(result)
-    return ret
+        gids = data.submit_recordings(connection, recordings)
+        return data.load_recordings_from_msids(connection, gids)
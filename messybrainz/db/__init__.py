@@ -9,9 +9,13 @@ SCHEMA_VERSION = 1
 
 engine = None
 
-def init_db_engine(connect_str):
+def init_db_engine(connect_str, **engine_options):
+    """ Create the engine, engine_options are passed on to create_engine and can
+        configure a connection pool. Connections aren't pooled by default.
+    """
     global engine
-    engine = create_engine(connect_str, poolclass=NullPool)
+    engine_options.setdefault("poolclass", NullPool)
+    engine = create_engine(connect_str, **engine_options)
 
 def run_sql_script(sql_file_path):
     with open(sql_file_path) as sql:
@@ -182,6 +182,179 @@ def submit_recording(connection, data):
     return gid
 
 
+def get_ids_from_data_sha256s(connection, data_sha256s):
+    """ Returns the Recording MessyBrainz IDs for a batch of recording data hashes
+
+    Args:
+        connection: the sqlalchemy db connection to be used to execute queries
+        data_sha256s (list [str]): the sha256 of the lowercased MessyBrainz JSON of the recordings
+
+    Returns:
+        dict: a dict mapping each data_sha256 which exists in MessyBrainz to its Recording MessyBrainz ID
+    """
+    if not data_sha256s:
+        return {}
+
+    query = text("""SELECT sj.data_sha256
+                         , s.gid
+                      FROM recording s
+                      JOIN recording_json sj
+                        ON sj.id = s.data
+                     WHERE sj.data_sha256 IN :data_sha256s""")
+    result = connection.execute(query, {"data_sha256s": tuple(set(data_sha256s))})
+    return {row["data_sha256"]: str(row["gid"]) for row in result.fetchall()}
+
+
+def get_artist_credits(connection, artist_credits):
+    """ Returns the MessyBrainz artist IDs for a batch of artist credits
+
+    Args:
+        connection: the sqlalchemy db connection to be used to execute queries
+        artist_credits (list [str]): the names of the artists
+
+    Returns:
+        dict: a dict mapping each artist credit that exists in MessyBrainz to its Artist MessyBrainz ID
+    """
+    if not artist_credits:
+        return {}
+
+    query = text("""SELECT DISTINCT ON (a.name)
+                           a.name
+                         , a.gid
+                      FROM artist_credit a
+                     WHERE a.name IN :names""")
+    result = connection.execute(query, {"names": tuple(set(artist_credits))})
+    return {row["name"]: str(row["gid"]) for row in result.fetchall()}
+
+
+def get_releases(connection, releases):
+    """ Returns the MessyBrainz release IDs for a batch of release titles
+
+    Args:
+        connection: the sqlalchemy db connection to be used to execute queries
+        releases (list [str]): the titles of the releases
+
+    Returns:
+        dict: a dict mapping each release title that exists in MessyBrainz to its Release MessyBrainz ID
+    """
+    if not releases:
+        return {}
+
+    query = text("""SELECT DISTINCT ON (r.title)
+                           r.title
+                         , r.gid
+                      FROM release r
+                     WHERE r.title IN :titles""")
+    result = connection.execute(query, {"titles": tuple(set(releases))})
+    return {row["title"]: str(row["gid"]) for row in result.fetchall()}
+
+
+def add_artist_credits(connection, artist_credits):
+    """ Insert a batch of new artists into the MessyBrainz database
+
+    Args:
+        connection: the sqlalchemy db connection to be used to execute queries
+        artist_credits (list [str]): the names of the artists, which must not already exist
+
+    Returns:
+        dict: a dict mapping each artist credit to its new Artist MessyBrainz ID
+    """
+    gids = {name: str(uuid.uuid4()) for name in set(artist_credits)}
+    if gids:
+        query = text("""INSERT INTO artist_credit (gid, name, submitted)
+                             VALUES (:gid, :name, now())""")
+        connection.execute(query, [{"gid": gid, "name": name} for name, gid in gids.items()])
+    return gids
+
+
+def add_releases(connection, releases):
+    """ Insert a batch of new releases into the MessyBrainz database
+
+    Args:
+        connection: the sqlalchemy db connection to be used to execute queries
+        releases (list [str]): the titles of the releases, which must not already exist
+
+    Returns:
+        dict: a dict mapping each release title to its new Release MessyBrainz ID
+    """
+    gids = {title: str(uuid.uuid4()) for title in set(releases)}
+    if gids:
+        query = text("""INSERT INTO release (gid, title, submitted)
+                             VALUES (:gid, :title, now())""")
+        connection.execute(query, [{"gid": gid, "title": title} for title, gid in gids.items()])
+    return gids
+
+
+def submit_recordings(connection, recordings):
+    """ Submits a batch of recordings to MessyBrainz, only inserting the rows that
+    do not exist yet. Recordings which hash to the same MessyBrainz JSON get the same ID.
+
+    Args:
+        connection: the sqlalchemy db connection to execute queries with
+        recordings (list [dict]): the recording data for each recording
+
+    Returns:
+        list [str]: the Recording MessyBrainz IDs of the recordings, in the same order as given
+    """
+    hashed = []
+    for recording in recordings:
+        data_json, sha256_json = convert_to_messybrainz_json(recording)
+        data_sha256 = sha256(sha256_json.encode("utf-8")).hexdigest()
+        hashed.append((data_sha256, data_json, recording))
+
+    existing = get_ids_from_data_sha256s(connection, [data_sha256 for data_sha256, _, _ in hashed])
+
+    # keep only the first occurrence of every new recording in the batch
+    missing = {}
+    for data_sha256, data_json, recording in hashed:
+        if data_sha256 not in existing and data_sha256 not in missing:
+            missing[data_sha256] = (data_json, recording)
+
+    if missing:
+        artist_names = {recording["artist"] for _, recording in missing.values()}
+        artists = get_artist_credits(connection, artist_names)
+        artists.update(add_artist_credits(connection, artist_names - artists.keys()))
+
+        release_titles = {recording["release"] for _, recording in missing.values() if "release" in recording}
+        releases = get_releases(connection, release_titles)
+        releases.update(add_releases(connection, release_titles - releases.keys()))
+
+        data_sha256s, data_jsons, meta_sha256s = [], [], []
+        for data_sha256, (data_json, recording) in missing.items():
+            meta = {"artist": recording["artist"], "title": recording["title"]}
+            _, meta_sha256_json = convert_to_messybrainz_json(meta)
+            data_sha256s.append(data_sha256)
+            data_jsons.append(data_json)
+            meta_sha256s.append(sha256(meta_sha256_json.encode("utf-8")).hexdigest())
+
+        query = text("""INSERT INTO recording_json (data, data_sha256, meta_sha256)
+                             SELECT CAST(t.data AS JSONB), t.data_sha256, t.meta_sha256
+                               FROM unnest(:data, :data_sha256s, :meta_sha256s) AS t(data, data_sha256, meta_sha256)
+                          RETURNING id, data_sha256""")
+        result = connection.execute(query, {
+            "data": data_jsons,
+            "data_sha256s": data_sha256s,
+            "meta_sha256s": meta_sha256s,
+        })
+        data_ids = {row["data_sha256"]: row["id"] for row in result.fetchall()}
+
+        values = []
+        for data_sha256, (_, recording) in missing.items():
+            gid = str(uuid.uuid4())
+            existing[data_sha256] = gid
+            values.append({
+                "gid": gid,
+                "data": data_ids[data_sha256],
+                "artist": artists[recording["artist"]],
+                "release": releases[recording["release"]] if "release" in recording else None,
+            })
+        query = text("""INSERT INTO recording (gid, data, artist, release, submitted)
+                             VALUES (:gid, :data, :artist, :release, now())""")
+        connection.execute(query, values)
+
+    return [existing[data_sha256] for data_sha256, _, _ in hashed]
+
+
 def load_recordings_from_msids(connection, messybrainz_ids):
     """ Returns data for a recordings corresponding to a given list of MessyBrainz IDs.
 
@@ -210,10 +383,11 @@ def load_recordings_from_msids(connection, messybrainz_ids):
     if not rows:
         raise exceptions.NoDataFoundException
 
-    # match results to every given mbid so list is returned in the same order
+    # match results to every given msid so list is returned in the same order
+    rows_by_msid = {str(row["gid"]): row for row in rows}
     results = []
     for msid in messybrainz_ids:
-        row = list(filter(lambda x: str(x["gid"]) == str(msid), rows))[0]
+        row = rows_by_msid.get(str(msid))
         if not row:
             raise exceptions.NoDataFoundException
 
@@ -92,6 +92,21 @@ class DataTestCase(DatabaseTestCase):
             msid2 = str(data.get_id_from_recording(connection, recording_diff_case))
             self.assertEqual(msid1, msid2)
 
+    def test_submit_recordings(self):
+        """ Tests that a batch submission reuses existing rows and dedups recordings within the batch.
+        """
+        other_recording = {'artist': 'Frank Ocean', 'title': 'Nights'}
+        with db.engine.connect() as connection:
+            existing_msid = data.submit_recording(connection, recording)
+            msids = data.submit_recordings(connection, [recording_diff_case, other_recording, other_recording])
+            self.assertEqual(msids[0], existing_msid)
+            self.assertEqual(msids[1], msids[2])
+            self.assertEqual(msids[1], str(data.get_id_from_recording(connection, other_recording)))
+
+            loaded = data.load_recordings_from_msids(connection, msids)
+            self.assertEqual(loaded[0]['ids']['artist_msid'], loaded[1]['ids']['artist_msid'])
+            self.assertIsNone(loaded[1]['ids']['release_msid'])
+
     def test_load_recordings_from_msids(self):
         with db.engine.connect() as connection:
             recording_msid = data.submit_recording(connection, recording)